@@ -0,0 +1,284 @@
+import asyncio
+import base64
+import time
+
+from search import TrackSearchEngine, SPOTIFY_API_URL, SPOTIFY_TOKEN_URL
+from search_cache import SpotifyCache, MISSING
+from search_batching import AsyncAudioFeatureBatcher
+from rate_limit import RequestScheduler, retry_after
+from metrics import span
+
+
+def _httpx_retry_after(error: Exception) -> float | None:
+    import httpx
+
+    if isinstance(error, httpx.TransportError):
+        return 0.0
+    if isinstance(error, httpx.HTTPStatusError):
+        return retry_after(error.response.status_code, error.response.headers)
+
+    return None
+
+
+class AsyncTrackSearchEngine():
+    """
+    Implementation of the Track Search Engine on top of asyncio
+
+    Uses one pooled keep-alive HTTP client and one client-credentials token
+    shared by all coroutines, so lookups never block the event loop.
+
+    Attributes
+    ----------
+    `client_id`: str = None
+        Spotify client id
+    `client_secret`: str = None
+        Spotify client secret
+    `cache`: SpotifyCache = None
+        Cache of search results and audio features
+    `batcher`: AsyncAudioFeatureBatcher = None
+        Batches audio feature requests of concurrent coroutines
+    `scheduler`: RequestScheduler
+        Rate limits and retries all Spotify requests
+    `client`: httpx.AsyncClient
+        Pooled HTTP client, created (and httpx imported) on first use
+    """
+
+    # Formatting does not depend on the transport
+    format_track = TrackSearchEngine.format_track
+
+    def __init__(
+        self,
+        client_id: str = None,
+        client_secret: str = None,
+        cache: SpotifyCache = None,
+        batch_window: float = None,
+        scheduler: RequestScheduler = None,
+        max_connections: int = 20,
+        max_concurrency: int = 10,
+        timeout: float = 10.0,
+        api_url: str = SPOTIFY_API_URL,
+        token_url: str = SPOTIFY_TOKEN_URL
+    ) -> None:
+        """
+        Implementation of the Track Search Engine on top of asyncio
+
+        Attributes
+        ----------
+        `client_id`: str = None
+            Spotify client id
+        `client_secret`: str = None
+            Spotify client secret
+        `cache`: SpotifyCache = None
+            Cache of search results and audio features, `None` to disable caching
+        `batch_window`: float = None
+            Seconds to collect concurrent audio feature requests into one call, `None` to disable batching
+        `scheduler`: RequestScheduler = None
+            Scheduler shared with other Spotify clients, `None` for a scheduler of its own
+        `max_connections`: int = 20
+            Size of the keep-alive connection pool
+        `max_concurrency`: int = 10
+            Maximum amount of Spotify requests in flight
+        `timeout`: float = 10.0
+            Seconds to wait for one Spotify response
+        `api_url`: str = SPOTIFY_API_URL
+            Base URL of Spotify Web API
+        `token_url`: str = SPOTIFY_TOKEN_URL
+            URL of Spotify token endpoint
+
+        Returns
+        ----------
+        `self`: AsyncTrackSearchEngine
+            AsyncTrackSearchEngine class object.
+        """
+
+        # Assertion error on initialization
+        assert client_id is not None and client_secret is not None, (
+            "`client_id` or `client_secret` must be specified."
+        )
+
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache = cache
+        self.batcher = AsyncAudioFeatureBatcher(fetch=self._audio_features, max_wait=batch_window) if batch_window is not None else None
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.api_url = api_url
+        self.token_url = token_url
+
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_refresh = None
+
+    @property
+    def client(self):
+        # Tracks found in the local catalog never need Spotify, so startup does not import httpx
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            )
+
+        return self._client
+
+    async def _fetch_token(self) -> None:
+        credentials = base64.b64encode(f'{self.client_id}:{self.client_secret}'.encode()).decode()
+
+        response = await self.client.post(
+            self.token_url,
+            data={'grant_type': 'client_credentials'},
+            headers={'Authorization': f'Basic {credentials}'}
+        )
+        response.raise_for_status()
+        token_info = response.json()
+
+        self._token = token_info['access_token']
+        self._token_expires_at = time.monotonic() + token_info.get('expires_in', 3600)
+
+    async def _get_token(self) -> str:
+        """
+        Return a valid access token, fetching it once for all waiting coroutines.
+        """
+
+        remaining = self._token_expires_at - time.monotonic()
+
+        # Close to expiry: keep serving the current token and refresh it in the background
+        if self._token is not None and 0 < remaining < 60:
+            if self._token_refresh is None or self._token_refresh.done():
+                self._token_refresh = asyncio.create_task(self._refresh_token())
+            return self._token
+
+        if self._token is None or remaining <= 0:
+            await self._refresh_token()
+
+        return self._token
+
+    async def _refresh_token(self) -> None:
+        async with self._token_lock:
+            # Another coroutine may have refreshed the token while this one waited
+            if self._token is not None and self._token_expires_at - time.monotonic() >= 60:
+                return
+            await self._fetch_token()
+
+    async def _get(self, path: str, params: dict) -> dict:
+        return await self.scheduler.acall(lambda: self._send(path, params), _httpx_retry_after)
+
+    async def _send(self, path: str, params: dict) -> dict:
+        async with self._semaphore:
+            for attempt in range(2):
+                token = await self._get_token()
+                response = await self.client.get(self.api_url + path, params=params, headers={'Authorization': f'Bearer {token}'})
+
+                # Token revoked or expired earlier than announced, fetch a new one once
+                if response.status_code == 401 and attempt == 0:
+                    self._token = None
+                    continue
+
+                response.raise_for_status()
+                return response.json()
+
+    async def _audio_features(self, track_ids: list[str]) -> list[dict]:
+        return (await self._get('audio-features', {'ids': ','.join(track_ids)}))['audio_features']
+
+    async def search_track(self, query):
+        """
+        Searching for a track via Spotify API
+
+        Parameters
+        ----------
+        `query`: str
+            Search query
+
+        Returns
+        ----------
+        `result`: dict
+            The dictionary containing features of a first track.
+        """
+        if self.cache is not None:
+            cache_key = ' '.join(query.lower().split())
+            track_id = self.cache.get('query', cache_key)
+            if track_id is not MISSING:
+                track = self.cache.get('track', track_id)
+                if track is not MISSING:
+                    return track
+
+        with span('spotify_search'):
+            results = await self._get('search', {'q': query, 'type': 'track', 'limit': 1})
+        track = results['tracks']['items'][0]
+
+        if self.cache is not None:
+            self.cache.set('query', cache_key, track['id'])
+            self.cache.set('track', track['id'], track)
+
+        return track
+
+    async def get_audio_features(self, track_id):
+        """
+        Extracting numerical audio features of one track.
+
+        Parameters
+        ----------
+        `track_id`: str
+            ID of the track on Spotify
+
+        Returns
+        ----------
+        `features`: dict
+            Dictionary containing features.
+        """
+        if self.cache is not None:
+            audio_info = self.cache.get('features', track_id)
+            if audio_info is not MISSING:
+                return audio_info
+
+        with span('spotify_audio_features'):
+            if self.batcher is not None:
+                audio_info = await self.batcher.get(track_id)
+            else:
+                audio_info = (await self._audio_features([track_id]))[0]
+
+        # Tracks without audio features are not cached, they may get them later
+        if self.cache is not None and audio_info is not None:
+            self.cache.set('features', track_id, audio_info)
+
+        return audio_info
+
+    async def find_track_features(self, title, artist=None):
+        """
+        Combination of `search_track` and `get_audio_features`.
+
+        Parameters
+        ----------
+        `title`: str
+            Title of a track
+        `artist`: str = None
+            Name of the artist.
+
+        Returns
+        ----------
+        `features`: dict
+            Dictionary containing alphanumerical features.
+        """
+        if artist:
+            query = f'track:{title} artist:{artist}'
+        else:
+            query = f'track:{title}'
+
+        features = await self.search_track(query)
+        features = features | await self.get_audio_features(features['id'])
+        return features
+
+    async def aclose(self) -> None:
+        """
+        Flush pending audio feature requests and close the pooled HTTP client.
+        """
+        if self.batcher is not None:
+            await self.batcher.aclose()
+        if self._client is not None:
+            await self._client.aclose()
@@ -0,0 +1,366 @@
+# Import necessary dependencies
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import TrackPreprocessor
+from catalog import Catalog
+from track_store import TrackStore
+from track_index import ClusterIndex, INDEX_DIR_NAME, probe_clusters, top_k_positions
+from retrieval import IVFPQIndex, IVFPQBackend, ClusterScanBackend
+from benchmark_suite import synthetic_tracks
+
+
+def sample_queries(store: TrackStore = None, n_queries: int = 1000, seed: int = 42) -> np.ndarray:
+    """
+    Sample preprocessed features of random tracks from the store to use as queries.
+
+    Parameters
+    ----------
+    `store`: TrackStore = None
+        Track store to sample from.
+    `n_queries`: int = 1000
+        The amount of queries.
+    `seed`: int = 42
+        Random seed.
+
+    Returns
+    ----------
+    `queries`: np.ndarray
+        `float32` matrix of shape (n_queries, n_features).
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store), size=min(n_queries, len(store)), replace=False))
+
+    return np.asarray(store.features[rows])
+
+
+def probe_recall_report(
+    index: ClusterIndex = None,
+    centroids: np.ndarray = None,
+    queries: np.ndarray = None,
+    top_k: int = 5,
+    n_probes: list[int] = [1, 2, 3, 4, 6, 8]
+) -> pd.DataFrame:
+    """
+    Measure recall@`top_k` and latency of multi-probe cluster search against exact brute-force search.
+
+    Parameters
+    ----------
+    `index`: ClusterIndex = None
+        Index to search in.
+    `centroids`: np.ndarray = None
+        Cluster centers of K-Means model.
+    `queries`: np.ndarray = None
+        Preprocessed query features.
+    `top_k`: int = 5
+        The amount of most similar tracks to retrieve.
+    `n_probes`: list[int] = [1, 2, 3, 4, 6, 8]
+        Values of `n_probe` to evaluate.
+
+    Returns
+    ----------
+    `report`: pd.DataFrame
+        A Data frame with `n_probe`, `recall`, `mean_ms`, `p50_ms`, and `p99_ms`
+        for every value of `n_probe` and for exact search (`n_probe` equal to the amount of clusters).
+    """
+
+    assert index is not None and centroids is not None and queries is not None, (
+        '`index`, `centroids`, and `queries` must be specified.'
+    )
+
+    exact_results, exact_latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        row_ids, _ = index.search_exact(query=query, top_k=top_k)
+        exact_latencies.append(time.perf_counter() - start)
+        exact_results.append(set(row_ids.tolist()))
+
+    report = []
+    for n_probe in n_probes:
+        hits, latencies = 0, []
+        for query, exact in zip(queries, exact_results):
+            start = time.perf_counter()
+            clusters = probe_clusters(query=query, centroids=centroids, n_probe=n_probe)
+            row_ids, _ = index.search(query=query, cluster=clusters if n_probe > 1 else clusters[0], top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(exact.intersection(row_ids.tolist()))
+
+        report.append(_latency_row(n_probe=n_probe, recall=hits / (top_k * len(queries)), latencies=latencies))
+
+    report.append(_latency_row(n_probe=index.n_clusters, recall=1.0, latencies=exact_latencies))
+
+    return pd.DataFrame(report)
+
+
+def ann_recall_report(
+    snapshot=None,
+    index: IVFPQIndex = None,
+    centroids: np.ndarray = None,
+    queries: np.ndarray = None,
+    top_k: int = 5,
+    n_probes: list[int] = [1, 2, 4, 8, 16, 32],
+    rerank: int = 4
+) -> pd.DataFrame:
+    """
+    Measure recall@`top_k` and latency of the retrieval backends against exact brute-force search.
+
+    Parameters
+    ----------
+    `snapshot`: CatalogSnapshot = None
+        Catalog version to search in.
+    `index`: IVFPQIndex = None
+        ANN index of `snapshot`.
+    `centroids`: np.ndarray = None
+        Cluster centers of K-Means model.
+    `queries`: np.ndarray = None
+        Preprocessed query features.
+    `top_k`: int = 5
+        The amount of most similar tracks to retrieve.
+    `n_probes`: list[int] = [1, 2, 4, 8, 16, 32]
+        Values of `n_probe` of 'ivf_pq' to evaluate.
+    `rerank`: int = 4
+        Shortlist size of 'ivf_pq' as a multiple of `top_k`.
+
+    Returns
+    ----------
+    `report`: pd.DataFrame
+        A Data frame with `backend`, `n_probe`, `recall`, `mean_ms`, `p50_ms`, and `p99_ms`
+        for the cluster scan of the query cluster and for 'ivf_pq' with every value of `n_probe`.
+    """
+
+    assert snapshot is not None and index is not None and centroids is not None and queries is not None, (
+        '`snapshot`, `index`, `centroids`, and `queries` must be specified.'
+    )
+
+    exact_results = [set(snapshot.index.search_exact(query=query, top_k=top_k)[0].tolist()) for query in queries]
+    clusters = [int(probe_clusters(query=query, centroids=centroids, n_probe=1)[0]) for query in queries]
+
+    def measure(retrieval, **columns) -> dict:
+        hits, latencies = 0, []
+        for query, cluster, exact in zip(queries, clusters, exact_results):
+            start = time.perf_counter()
+            row_ids, _ = retrieval.search(query=query, cluster=cluster, top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(exact.intersection(row_ids.tolist()))
+
+        return _latency_row(latencies=latencies, **columns, recall=hits / (top_k * len(queries)))
+
+    report = [measure(ClusterScanBackend(snapshot), backend='cluster_scan', n_probe=1)]
+    for n_probe in n_probes:
+        report.append(measure(IVFPQBackend(snapshot, index, n_probe=n_probe, rerank=rerank), backend='ivf_pq', n_probe=n_probe))
+
+    return pd.DataFrame(report)
+
+
+def precision_report(
+    snapshot=None,
+    centroids: np.ndarray = None,
+    queries: np.ndarray = None,
+    top_k: int = 5,
+    reranks: list[int] = [1, 2, 4, 8]
+) -> pd.DataFrame:
+    """
+    Measure top-`top_k` overlap with `float64` scoring and latency of `float32` and `int8` cluster scans.
+
+    Parameters
+    ----------
+    `snapshot`: CatalogSnapshot = None
+        Catalog version to search in, a single segment one.
+    `centroids`: np.ndarray = None
+        Cluster centers of K-Means model.
+    `queries`: np.ndarray = None
+        Preprocessed query features.
+    `top_k`: int = 5
+        The amount of most similar tracks to retrieve.
+    `reranks`: list[int] = [1, 2, 4, 8]
+        Shortlist sizes of the `int8` scan, as multiples of `top_k`, to evaluate.
+
+    Returns
+    ----------
+    `report`: pd.DataFrame
+        A Data frame with `precision`, `rerank`, `bytes_per_track` of the scanned vectors,
+        `overlap`, `mean_ms`, `p50_ms`, and `p99_ms`.
+    """
+
+    assert snapshot is not None and centroids is not None and queries is not None, (
+        '`snapshot`, `centroids`, and `queries` must be specified.'
+    )
+
+    index = snapshot.index
+    assert isinstance(index, ClusterIndex), (
+        'Compact the catalog first, `snapshot` must have a single segment.'
+    )
+
+    clusters = [int(probe_clusters(query=query, centroids=centroids, n_probe=1)[0]) for query in queries]
+
+    reference = []
+    for query, cluster in zip(queries, clusters):
+        rows = np.asarray(index.row_ids[index.offsets[cluster]:index.offsets[cluster + 1]])
+        vectors = np.asarray(snapshot.store.features[rows], dtype=np.float64)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-300)
+        query = np.asarray(query, dtype=np.float64)
+        reference.append(set(rows[top_k_positions(vectors @ (query / np.linalg.norm(query)), top_k)].tolist()))
+
+    float_index = ClusterIndex(vectors=index.vectors, row_ids=index.row_ids, offsets=index.offsets)
+    quantized = ClusterIndex.load(os.path.join(snapshot.store.path, INDEX_DIR_NAME), precision='int8') \
+        if os.path.exists(os.path.join(snapshot.store.path, INDEX_DIR_NAME, 'codes.i8')) else float_index.quantize()
+
+    def measure(scan_index: ClusterIndex, **columns) -> dict:
+        hits, latencies = 0, []
+        for query, cluster, exact in zip(queries, clusters, reference):
+            start = time.perf_counter()
+            row_ids, _ = scan_index.search(query=query, cluster=cluster, top_k=top_k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(exact.intersection(row_ids.tolist()))
+
+        return _latency_row(latencies=latencies, **columns, overlap=hits / (top_k * len(queries)))
+
+    n_features = index.vectors.shape[1]
+    report = [measure(float_index, precision='float32', rerank=0, bytes_per_track=4 * n_features)]
+    for rerank in reranks:
+        quantized.rerank = rerank
+        report.append(measure(quantized, precision='int8', rerank=rerank, bytes_per_track=n_features))
+
+    return pd.DataFrame(report)
+
+
+def preprocess_parity_report(preprocessor: TrackPreprocessor = None, tracks: pd.DataFrame = None) -> dict:
+    """
+    Compare the compiled preprocessing path against `column_transformer` and `k_means` themselves.
+
+    Parameters
+    ----------
+    `preprocessor`: TrackPreprocessor = None
+        Preprocessor to check.
+    `tracks`: pd.DataFrame = None
+        Raw tracks with the columns of `tracks_features.csv`.
+
+    Returns
+    ----------
+    `report`: dict
+        Maximum absolute feature difference, share of equal clusters, and
+        per-track latency of both paths in milliseconds.
+    """
+
+    assert preprocessor is not None and tracks is not None, (
+        '`preprocessor` and `tracks` must be specified.'
+    )
+
+    records = tracks.to_dict(orient='records')
+
+    start = time.perf_counter()
+    reference = [preprocessor._preprocess_frame(pd.DataFrame(data={column: [value] for column, value in record.items()})) for record in records]
+    reference_ms = (time.perf_counter() - start) * 1000 / len(records)
+
+    start = time.perf_counter()
+    compiled = [preprocessor.preprocess_array(record) for record in records]
+    compiled_ms = (time.perf_counter() - start) * 1000 / len(records)
+
+    reference_features = np.vstack([df.loc[:, preprocessor.feature_names].values for df in reference])
+    compiled_features = np.vstack([features for features, _ in compiled])
+
+    batch_features, batch_clusters = preprocessor.preprocess_array(records)
+
+    return {
+        'max_abs_diff': float(np.abs(reference_features - compiled_features).max()),
+        'max_abs_diff_batch': float(np.abs(reference_features - batch_features).max()),
+        'cluster_agreement': float(np.mean(np.concatenate([df.loc[:, 'cluster'].values for df in reference]) == batch_clusters)),
+        'reference_ms': reference_ms,
+        'compiled_ms': compiled_ms
+    }
+
+
+def _latency_row(latencies: list[float], **columns) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+
+    return columns | {
+        'mean_ms': latencies_ms.mean(),
+        'p50_ms': np.percentile(latencies_ms, 50),
+        'p99_ms': np.percentile(latencies_ms, 99)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the recommendation pipeline.')
+    parser.add_argument('--pkl', default='../models/k_means.pkl', help='Path to ".pkl" K-Means model and Column Transformer.')
+    parser.add_argument('--db', default='../data/track_store', help='Path to the track catalog.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    probe_parser = subparsers.add_parser('probe', help='Recall vs latency of multi-probe cluster search.')
+    probe_parser.add_argument('--queries', type=int, default=1000, help='The amount of sampled queries.')
+    probe_parser.add_argument('--top-k', type=int, default=5, help='The amount of most similar tracks to retrieve.')
+    probe_parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 3, 4, 6, 8], help='Values of `n_probe` to evaluate.')
+
+    ann_parser = subparsers.add_parser('ann', help='Build time, recall and latency of the ANN index against the cluster scan.')
+    ann_parser.add_argument('--queries', type=int, default=1000, help='The amount of sampled queries.')
+    ann_parser.add_argument('--top-k', type=int, default=5, help='The amount of most similar tracks to retrieve.')
+    ann_parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='Values of `n_probe` to evaluate.')
+    ann_parser.add_argument('--n-lists', type=int, default=None, help='The amount of inverted lists.')
+    ann_parser.add_argument('--rerank', type=int, default=4, help='Shortlist size as a multiple of `top_k`.')
+
+    precision_parser = subparsers.add_parser('precision', help='Top-k overlap with float64 and latency of float32 and int8 cluster scans.')
+    precision_parser.add_argument('--queries', type=int, default=1000, help='The amount of sampled queries.')
+    precision_parser.add_argument('--top-k', type=int, default=5, help='The amount of most similar tracks to retrieve.')
+    precision_parser.add_argument('--rerank', type=int, nargs='+', default=[1, 2, 4, 8], help='Shortlist sizes of the int8 scan to evaluate.')
+
+    parity_parser = subparsers.add_parser('parity', help='Parity and latency of compiled preprocessing against sklearn.')
+    parity_parser.add_argument('--tracks', default=None, help='Path to the raw tracks ".csv" file, synthetic tracks if not given.')
+    parity_parser.add_argument('--rows', type=int, default=1000, help='The amount of tracks to check.')
+
+    args = parser.parse_args()
+
+    if args.command == 'probe':
+        snapshot = Catalog(args.db).snapshot(name_index=False)
+        report = probe_recall_report(
+            index=snapshot.index,
+            centroids=TrackPreprocessor(pkl_path=args.pkl).centroids,
+            queries=sample_queries(snapshot.store, n_queries=args.queries),
+            top_k=args.top_k,
+            n_probes=args.n_probe
+        )
+        print(report.to_string(index=False))
+    elif args.command == 'ann':
+        snapshot = Catalog(args.db).snapshot(name_index=False)
+
+        start = time.perf_counter()
+        index = IVFPQIndex.build(features=snapshot.store.features, n_lists=args.n_lists)
+        print(f'Built {index.n_lists} lists over {index.n_vectors} tracks in {time.perf_counter() - start:.1f} s, '
+              f'{index.codes.nbytes / 2**20:.1f} MiB of codes')
+
+        report = ann_recall_report(
+            snapshot=snapshot,
+            index=index,
+            centroids=TrackPreprocessor(pkl_path=args.pkl).centroids,
+            queries=sample_queries(snapshot.store, n_queries=args.queries),
+            top_k=args.top_k,
+            n_probes=args.n_probe,
+            rerank=args.rerank
+        )
+        print(report.to_string(index=False))
+    elif args.command == 'precision':
+        snapshot = Catalog(args.db).snapshot(name_index=False)
+        report = precision_report(
+            snapshot=snapshot,
+            centroids=TrackPreprocessor(pkl_path=args.pkl).centroids,
+            queries=sample_queries(snapshot.store, n_queries=args.queries),
+            top_k=args.top_k,
+            reranks=args.rerank
+        )
+        print(report.to_string(index=False))
+    elif args.command == 'parity':
+        report = preprocess_parity_report(
+            preprocessor=TrackPreprocessor(pkl_path=args.pkl),
+            tracks=pd.read_csv(args.tracks, nrows=args.rows).dropna(subset=['name', 'album']) if args.tracks is not None else synthetic_tracks(args.rows)
+        )
+        print(json.dumps(report, indent=4))
+
+        # Clusters may only differ for tracks exactly on a boundary between two centroids
+        assert report['max_abs_diff'] < 1e-9 and report['cluster_agreement'] > 0.999, (
+            'Compiled preprocessing differs from `column_transformer` and `k_means`.'
+        )
@@ -0,0 +1,468 @@
+# Import necessary dependencies
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from const import *
+from search import TrackSearchEngine
+
+# Columns of the raw tracks ".csv" file, in its order
+RAW_COLUMNS = ['id', 'name', 'album', 'album_id', 'artists', 'artist_ids', 'track_number', 'disc_number', 'explicit',
+               'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness',
+               'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature', 'year', 'release_date']
+
+# Metrics where a higher value is better, all others are better when lower
+HIGHER_IS_BETTER = ['recommend_many_tracks_per_s']
+
+WORDS = ['love', 'night', 'blue', 'fire', 'dream', 'home', 'rain', 'gold', 'heart', 'road', 'light', 'wild']
+
+
+def synthetic_tracks(n_tracks: int = 10_000, start: int = 0, seed: int = 42, n_styles: int = 64) -> pd.DataFrame:
+    """
+    Random tracks with the columns of the raw tracks ".csv" file.
+
+    Audio features are drawn around `n_styles` random style centers, so the
+    catalog has cluster structure like the real one. Track `i` always gets the
+    same values for the same `seed`, whatever chunk it is generated in.
+
+    Parameters
+    ----------
+    `n_tracks`: int = 10_000
+        The amount of tracks.
+    `start`: int = 0
+        Number of the first track.
+    `seed`: int = 42
+        Random seed.
+    `n_styles`: int = 64
+        The amount of style centers.
+
+    Returns
+    ----------
+    `tracks`: pd.DataFrame
+        A Data frame with `RAW_COLUMNS`.
+    """
+
+    styles = np.random.default_rng(seed).random((n_styles, len(AUDIO_FEATURES)))
+    rng = np.random.default_rng([seed, start])
+
+    numbers = np.arange(start, start + n_tracks)
+    style = rng.integers(0, n_styles, n_tracks)
+    audio = np.clip(styles[style] + rng.normal(0, 0.08, (n_tracks, len(AUDIO_FEATURES))), 0, 1)
+    year = rng.integers(1960, 2021, n_tracks)
+
+    tracks = pd.DataFrame({
+        'id': [f'syn{number:09d}' for number in numbers],
+        'name': [f'{WORDS[number % len(WORDS)].title()} {WORDS[(number // 7) % len(WORDS)]} {number}' for number in numbers],
+        'album': [f'Album {number // 12}' for number in numbers],
+        'album_id': [f'album{number // 12:08d}' for number in numbers],
+        'artists': [str([f'Artist {number // 40 % 50_000}']) for number in numbers],
+        'artist_ids': [str([f'artist{number // 40 % 50_000:06d}']) for number in numbers],
+        'track_number': numbers % 12 + 1,
+        'disc_number': 1,
+        'explicit': rng.random(n_tracks) < 0.1,
+        'key': rng.integers(0, 12, n_tracks),
+        'mode': rng.integers(0, 2, n_tracks),
+        'duration_ms': np.maximum(rng.normal(240_000, 60_000, n_tracks), 30_000).astype(np.int64),
+        'time_signature': rng.choice([1.0, 3.0, 4.0, 5.0], n_tracks, p=[0.02, 0.1, 0.83, 0.05]),
+        'year': year,
+        'release_date': [f'{y}-01-01' for y in year]
+    })
+
+    for i, feature in enumerate(AUDIO_FEATURES):
+        tracks[feature] = audio[:, i]
+    # Audio features that are not in [0, 1] on Spotify
+    tracks['loudness'] = -60 + 60 * tracks['loudness']
+    tracks['tempo'] = 50 + 150 * tracks['tempo']
+
+    return tracks.loc[:, RAW_COLUMNS]
+
+
+def make_synthetic_catalog(
+    out_path: str = None,
+    n_tracks: int = 10_000,
+    seed: int = 42,
+    chunk_size: int = 100_000,
+    max_workers: int = None
+) -> dict:
+    """
+    Generate a synthetic raw tracks ".csv" file and build the model and track store from it.
+
+    The track store holds the same columns as "preprocessed_audio_features_clusters.csv";
+    it is built with `build_catalog`, so it is what the bot loads in production.
+
+    Parameters
+    ----------
+    `out_path`: str = None
+        Directory to write "tracks_features.csv", "k_means.pkl" and "track_store" to.
+    `n_tracks`: int = 10_000
+        The amount of tracks.
+    `seed`: int = 42
+        Random seed.
+    `chunk_size`: int = 100_000
+        Amount of tracks generated and processed at once.
+    `max_workers`: int = None
+        The amount of worker processes of `build_catalog`.
+
+    Returns
+    ----------
+    `paths`: dict
+        Paths of the written `tracks`, `pkl` and `db`.
+    """
+
+    assert out_path is not None, (
+        '`out_path` must be specified.'
+    )
+
+    from build_catalog import build_catalog
+
+    os.makedirs(out_path, exist_ok=True)
+    paths = {
+        'tracks': os.path.join(out_path, 'tracks_features.csv'),
+        'pkl': os.path.join(out_path, 'k_means.pkl'),
+        'db': os.path.join(out_path, 'track_store')
+    }
+
+    for start in range(0, n_tracks, chunk_size):
+        tracks = synthetic_tracks(min(chunk_size, n_tracks - start), start=start, seed=seed)
+        tracks.to_csv(paths['tracks'], mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+    build_catalog(tracks_path=paths['tracks'], pkl_path=paths['pkl'], store_path=paths['db'],
+                  chunk_size=chunk_size, max_workers=max_workers, seed=seed)
+
+    with open(os.path.join(out_path, 'synthetic.json'), 'w') as f:
+        json.dump({'n_tracks': n_tracks, 'seed': seed}, f, indent=4)
+
+    return paths
+
+
+class StubTrackSearchEngine():
+    """
+    Offline replacement of `TrackSearchEngine`: every title is found as one of
+    `n_tracks` synthetic tracks picked by the title, so benchmarks never call Spotify.
+    """
+
+    format_track = TrackSearchEngine.format_track
+
+    def __init__(self, seed: int = 42, n_tracks: int = 1024) -> None:
+        # Generated once, so that lookups cost about as little as a cached Spotify response
+        self.tracks = synthetic_tracks(n_tracks, start=0, seed=seed + 1).to_dict(orient='records')
+
+    def find_track_features(self, title, artist=None):
+        number = zlib.crc32(title.encode('utf-8'))
+        track = self.tracks[number % len(self.tracks)]
+
+        return {
+            'id': f'stub{number:010d}',
+            'name': title,
+            'album': {'name': track['album'], 'id': track['album_id'], 'release_date': track['release_date']},
+            'artists': [{'name': artist or 'Stub Artist', 'id': 'stub'}],
+            'track_number': int(track['track_number']),
+            'disc_number': 1,
+            'explicit': bool(track['explicit']),
+            'duration_ms': int(track['duration_ms']),
+            'popularity': 0
+        } | {
+            feature: track[feature] for feature in AUDIO_FEATURES + ['key', 'mode', 'time_signature']
+        }
+
+    def find_many_track_features(self, titles, artists=None):
+        return [self.find_track_features(title, artist) for title, artist in zip(titles, artists or [None] * len(titles))]
+
+
+def _latency_stats(name: str, latencies: list[float]) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+
+    return {
+        f'{name}_p50_ms': float(np.percentile(latencies_ms, 50)),
+        f'{name}_p99_ms': float(np.percentile(latencies_ms, 99))
+    }
+
+
+def _peak_rss_mb() -> float:
+    import resource
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def _make_rec_sys(pkl_path: str, db_path: str):
+    from recsys import RecSys
+
+    return RecSys(client_id='offline', client_secret='offline', pkl_path=pkl_path, db_path=db_path)
+
+
+def measure(pkl_path: str = None, db_path: str = None, n_queries: int = 1000, batch_size: int = 10_000, seed: int = 42) -> dict:
+    """
+    Measure the pipeline in the current process, see `run_suite`.
+
+    Peak RSS is only meaningful in a fresh interpreter.
+    """
+
+    assert pkl_path is not None and db_path is not None, (
+        '`pkl_path` and `db_path` must be specified.'
+    )
+
+    rec_sys = _make_rec_sys(pkl_path, db_path)
+
+    stub = StubTrackSearchEngine(seed=seed)
+    rec_sys.search_engine = stub
+
+    rng = np.random.default_rng(seed)
+    store = rec_sys.track_store
+    rows = np.sort(rng.choice(len(store), size=min(n_queries, len(store)), replace=False))
+    local_names = store.column('name', rows)
+    # Titles that are not in the catalog go through the (stubbed) Spotify path
+    remote_names = [f'Unknown title {i}' for i in range(n_queries)]
+
+    metrics = {}
+
+    tracks = [stub.format_track(stub.find_track_features(name)) for name in remote_names]
+    latencies = []
+    for track in tracks:
+        frame = {column: [value] for column, value in track.items()}
+        started = time.perf_counter()
+        rec_sys.track_preprocessor.preprocess(frame)
+        latencies.append(time.perf_counter() - started)
+    metrics |= _latency_stats('preprocess', latencies)
+
+    for name, names in (('recommend_local', local_names), ('recommend_remote', remote_names)):
+        latencies = []
+        for track_name in names:
+            started = time.perf_counter()
+            rec_sys.recommend(track_name, top_k=5)
+            latencies.append(time.perf_counter() - started)
+        metrics |= _latency_stats(name, latencies)
+
+    batch_rows = rng.choice(len(store), size=min(batch_size, len(store)), replace=False)
+    batch_names = store.column('name', np.sort(batch_rows))
+    started = time.perf_counter()
+    rec_sys.recommend_many(batch_names, top_k=5)
+    metrics['recommend_many_tracks_per_s'] = len(batch_names) / (time.perf_counter() - started)
+
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+
+    return metrics
+
+
+def metrics_overhead(pkl_path: str = None, db_path: str = None, n_queries: int = 1000, n_rounds: int = 10, seed: int = 42) -> dict:
+    """
+    Measure the cost of stage spans: the same requests are timed in alternating
+    rounds with metrics disabled and enabled, so drift affects both alike.
+
+    Parameters
+    ----------
+    `pkl_path`: str = None
+        Path to ".pkl" K-Means model and Column Transformer.
+    `db_path`: str = None
+        Path to the track catalog.
+    `n_queries`: int = 1000
+        The amount of requests per round, half resolved locally and half through stubbed Spotify.
+    `n_rounds`: int = 10
+        The amount of rounds of every mode.
+    `seed`: int = 42
+        Random seed.
+
+    Returns
+    ----------
+    `report`: dict
+        Median microseconds per request with metrics `disabled` and `enabled`, and `overhead` as a fraction.
+    """
+
+    import metrics
+
+    rec_sys = _make_rec_sys(pkl_path, db_path)
+    rec_sys.search_engine = StubTrackSearchEngine(seed=seed)
+
+    rng = np.random.default_rng(seed)
+    store = rec_sys.track_store
+    names = store.column('name', np.sort(rng.choice(len(store), size=min(n_queries // 2, len(store)), replace=False)))
+    names += [f'Unknown title {i}' for i in range(n_queries - len(names))]
+
+    timings = {False: [], True: []}
+    for _ in range(n_rounds):
+        for enabled in (False, True):
+            metrics.REGISTRY.enabled = enabled
+            start = time.perf_counter()
+            for track_name in names:
+                rec_sys.recommend(track_name, top_k=5)
+            timings[enabled].append((time.perf_counter() - start) / len(names))
+    metrics.disable()
+
+    disabled_us, enabled_us = float(np.median(timings[False]) * 1e6), float(np.median(timings[True]) * 1e6)
+
+    return {'disabled_us': disabled_us, 'enabled_us': enabled_us, 'overhead': enabled_us / disabled_us - 1}
+
+
+def run_suite(pkl_path: str = None, db_path: str = None, n_queries: int = 1000, batch_size: int = 10_000, seed: int = 42) -> dict:
+    """
+    Measure startup time, peak RSS, preprocessing latency, recommendation latency
+    and batch throughput of the pipeline with Spotify stubbed.
+
+    Measurements run in fresh interpreters: startup is the wall time of a process
+    that only imports and initializes `RecSys`, and RSS only counts what the
+    pipeline itself loads.
+
+    Parameters
+    ----------
+    `pkl_path`: str = None
+        Path to ".pkl" K-Means model and Column Transformer.
+    `db_path`: str = None
+        Path to the track catalog.
+    `n_queries`: int = 1000
+        The amount of single-track requests of every kind.
+    `batch_size`: int = 10_000
+        The amount of tracks in the `recommend_many` request.
+    `seed`: int = 42
+        Random seed of query sampling and stubbed tracks.
+
+    Returns
+    ----------
+    `results`: dict
+        `meta` with the catalog size and environment, and `metrics` with
+        `startup_s`, `*_rss_mb`, `*_p50_ms`, `*_p99_ms` and `recommend_many_tracks_per_s`.
+    """
+
+    assert pkl_path is not None and db_path is not None, (
+        '`pkl_path` and `db_path` must be specified.'
+    )
+
+    def run_child(*args: str) -> dict:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *args, '--pkl', pkl_path, '--db', db_path],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout
+
+        return json.loads(output.strip().splitlines()[-1])
+
+    # The first start may read the catalog from disk, the second one shows a warm page cache
+    run_child('startup')
+    start = time.perf_counter()
+    metrics = {'startup_s': None} | run_child('startup')
+    metrics['startup_s'] = time.perf_counter() - start
+
+    metrics |= run_child('measure', '--queries', str(n_queries), '--batch', str(batch_size), '--seed', str(seed))
+
+    from catalog import Catalog
+    snapshot = Catalog(db_path).snapshot(name_index=False)
+
+    return {
+        'meta': {
+            'n_tracks': len(snapshot.store),
+            'catalog_version': snapshot.version,
+            'n_queries': n_queries,
+            'batch_size': batch_size,
+            'seed': seed,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'metrics': metrics
+    }
+
+
+def compare_to_baseline(results: dict = None, baseline: dict = None, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compare `results` of `run_suite` against stored `baseline` results.
+
+    Parameters
+    ----------
+    `results`: dict = None
+        Current results.
+    `baseline`: dict = None
+        Baseline results of the same catalog.
+    `tolerance`: float = 0.2
+        Relative change in the worse direction that counts as a regression.
+
+    Returns
+    ----------
+    `comparison`: pd.DataFrame
+        A Data frame with `metric`, `baseline`, `current`, `change` (relative,
+        positive is worse), and `regression` for every metric of both results.
+    """
+
+    assert results is not None and baseline is not None, (
+        '`results` and `baseline` must be specified.'
+    )
+    assert results['meta']['n_tracks'] == baseline['meta']['n_tracks'], (
+        '`baseline` must be measured on a catalog of the same size.'
+    )
+
+    rows = []
+    for metric, current in results['metrics'].items():
+        if metric not in baseline['metrics']:
+            continue
+
+        reference = baseline['metrics'][metric]
+        change = (current - reference) / reference if reference else 0.0
+        if metric in HIGHER_IS_BETTER:
+            change = -change
+
+        rows.append({'metric': metric, 'baseline': reference, 'current': current, 'change': change, 'regression': change > tolerance})
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reproducible benchmark suite of the recommendation pipeline.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Generate a synthetic catalog and model.')
+    generate_parser.add_argument('--out', default='../data/synthetic', help='Directory to write the catalog to.')
+    generate_parser.add_argument('--tracks', type=int, default=10_000, help='The amount of tracks.')
+    generate_parser.add_argument('--seed', type=int, default=42, help='Random seed.')
+    generate_parser.add_argument('--workers', type=int, default=None, help='The amount of worker processes.')
+
+    for name, help_text in (('run', 'Run the suite and write the results as JSON.'),
+                            ('overhead', 'Measure the overhead of stage metrics.'),
+                            ('startup', 'Initialize `RecSys` and report RSS (used by `run`).'),
+                            ('measure', 'Measure in this process (used by `run`).')):
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument('--pkl', default='../data/synthetic/k_means.pkl', help='Path to ".pkl" K-Means model.')
+        command_parser.add_argument('--db', default='../data/synthetic/track_store', help='Path to the track catalog.')
+        command_parser.add_argument('--queries', type=int, default=1000, help='The amount of single-track requests of every kind.')
+        command_parser.add_argument('--batch', type=int, default=10_000, help='The amount of tracks in the batch request.')
+        command_parser.add_argument('--seed', type=int, default=42, help='Random seed.')
+
+        if name == 'run':
+            command_parser.add_argument('--out', default=None, help='Path to write the results ".json" file to.')
+            command_parser.add_argument('--baseline', default=None, help='Path to baseline results to compare against.')
+            command_parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown that counts as a regression.')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        start = time.perf_counter()
+        paths = make_synthetic_catalog(out_path=args.out, n_tracks=args.tracks, seed=args.seed, max_workers=args.workers)
+        print(f'Generated {args.tracks} tracks in {time.perf_counter() - start:.1f} s: {json.dumps(paths)}')
+    elif args.command == 'overhead':
+        print(json.dumps(metrics_overhead(pkl_path=args.pkl, db_path=args.db, n_queries=args.queries, seed=args.seed), indent=4))
+    elif args.command == 'startup':
+        _make_rec_sys(args.pkl, args.db)
+        print(json.dumps({'startup_rss_mb': _peak_rss_mb()}))
+    elif args.command == 'measure':
+        print(json.dumps(measure(pkl_path=args.pkl, db_path=args.db, n_queries=args.queries, batch_size=args.batch, seed=args.seed)))
+    else:
+        results = run_suite(pkl_path=args.pkl, db_path=args.db, n_queries=args.queries, batch_size=args.batch, seed=args.seed)
+        print(json.dumps(results, indent=4))
+
+        if args.out is not None:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=4)
+
+        if args.baseline is not None:
+            with open(args.baseline) as f:
+                comparison = compare_to_baseline(results, json.load(f), tolerance=args.tolerance)
+            print(comparison.to_string(index=False))
+
+            if comparison['regression'].any():
+                sys.exit(1)
@@ -0,0 +1,274 @@
+# Import necessary dependencies
+import argparse
+import os
+import pickle
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from sklearn.preprocessing import StandardScaler
+from sklearn.compose import ColumnTransformer
+from sklearn.cluster import MiniBatchKMeans
+
+from const import *
+from preprocessor import encode_columns, export_model_artifact
+from track_store import TrackStore, TrackStoreWriter, METADATA_COLUMNS, TRACK_NUMBER_COLUMN
+
+# Raw columns needed to compute `PREPROCESSED_FEATURES`
+RAW_FEATURES = AUDIO_FEATURES + NUMERIC_FEATURES + BINARY_FEATURES + CYCLIC_FEATURES + TIME_SIGNATURE_FEATURES
+
+# Tracks without these are dropped, the same way the original notebook does
+REQUIRED_COLUMNS = ['name', 'album']
+
+SCALED_FEATURES = AUDIO_FEATURES + NUMERIC_FEATURES + BINARY_FEATURES
+
+
+def make_column_transformer() -> ColumnTransformer:
+    """
+    Unfitted Column Transformer of encoded track features.
+    """
+
+    return ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), SCALED_FEATURES),
+            ('cyclic', 'passthrough', ['key_sine', 'key_cosine']),
+            ('time_sig', 'passthrough', TIME_SIGNATURE_FEATURES)
+        ])
+
+
+def read_chunks(tracks_path: str, columns: list[str], chunk_size: int) -> Iterable[pd.DataFrame]:
+    """
+    Stream `columns` of the raw tracks ".csv" file, dropping tracks without name or album.
+    """
+
+    for chunk in pd.read_csv(tracks_path, usecols=list(dict.fromkeys(columns + REQUIRED_COLUMNS)), chunksize=chunk_size):
+        yield chunk.dropna(subset=REQUIRED_COLUMNS)
+
+
+def bounded_map(executor: ProcessPoolExecutor, fn: Callable, args: Iterable[tuple], max_in_flight: int) -> Iterable:
+    """
+    Ordered `executor.map` that keeps at most `max_in_flight` tasks submitted,
+    so that reading ahead never holds more than that many chunks in memory.
+    """
+
+    pending = deque()
+    for task_args in args:
+        pending.append(executor.submit(fn, *task_args))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _encode_chunk(columns: dict) -> np.ndarray:
+    # Runs in a worker: raw columns into encoded, unscaled features in `PREPROCESSED_FEATURES` order
+    encoded = encode_columns(columns)
+
+    return np.column_stack([encoded[column] if column in encoded else np.asarray(columns[column], dtype=np.float64)
+                            for column in PREPROCESSED_FEATURES])
+
+
+def _assign_chunk(
+    encoded_path: str,
+    n_rows: int,
+    start: int,
+    end: int,
+    means: np.ndarray,
+    scales: np.ndarray,
+    centroids: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    # Runs in a worker: scale a slice of the encoded features and assign clusters
+    encoded = np.memmap(encoded_path, dtype=np.float64, mode='r', shape=(n_rows, len(PREPROCESSED_FEATURES)))
+    features = (np.asarray(encoded[start:end]) - means) / scales
+    clusters = np.argmin((centroids ** 2).sum(axis=1) - 2 * features @ centroids.T, axis=1)
+
+    return features.astype(np.float32), clusters.astype(np.int32)
+
+
+def build_catalog(
+    tracks_path: str = None,
+    pkl_path: str = None,
+    store_path: str = None,
+    chunk_size: int = 100_000,
+    batch_size: int = 10_000,
+    n_epochs: int = 3,
+    max_workers: int = None,
+    seed: int = 42
+) -> TrackStore:
+    """
+    Rebuild the K-Means model and the track store from the raw tracks ".csv" file.
+
+    The file is streamed in chunks, so peak memory depends on `chunk_size` and
+    `max_workers` rather than on the catalog size:
+
+    1. chunks are encoded in worker processes, `StandardScaler` is fitted
+       incrementally and encoded features are spilled to a temporary file;
+    2. `MiniBatchKMeans` with `K_CLUSTERS` clusters is fitted on random batches
+       of the scaled features;
+    3. chunks are scaled and assigned to clusters in worker processes and
+       written to the track store together with their metadata.
+
+    Finally the cluster and name indices are saved next to the store, the store
+    replaces the catalog in `store_path` (see `Catalog.replace`) and the model is
+    saved as `{'k_means', 'column_transformer'}`. Everything is built in a
+    temporary directory first, so a failed build leaves the catalog as it was.
+
+    Parameters
+    ----------
+    `tracks_path`: str = None
+        Path to the raw tracks ".csv" file.
+    `pkl_path`: str = None
+        Path to ".pkl" file to write the K-Means model and Column Transformer to.
+    `store_path`: str = None
+        Path to the store directory to write.
+    `chunk_size`: int = 100_000
+        Amount of rows read from `tracks_path` at once.
+    `batch_size`: int = 10_000
+        Amount of rows in one `MiniBatchKMeans` step.
+    `n_epochs`: int = 3
+        Amount of passes of `MiniBatchKMeans` over the catalog.
+    `max_workers`: int = None
+        The amount of worker processes, `None` for the amount of CPU cores.
+    `seed`: int = 42
+        Random seed of `MiniBatchKMeans` and batch sampling.
+
+    Returns
+    ----------
+    `store`: TrackStore
+        The written track store.
+    """
+
+    assert tracks_path is not None and pkl_path is not None and store_path is not None, (
+        '`tracks_path`, `pkl_path`, and `store_path` must be specified.'
+    )
+
+    max_workers = max_workers or os.cpu_count()
+    max_in_flight = 2 * max_workers
+
+    # Next to the catalog, so the new store can be moved into it
+    work_dir = tempfile.mkdtemp(prefix='build_catalog_', dir=os.path.dirname(os.path.abspath(store_path)))
+    encoded_path = os.path.join(work_dir, 'encoded.f64')
+    new_store_path = os.path.join(work_dir, 'track_store')
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # 1. Encode and fit the scaler incrementally
+            column_transformer = make_column_transformer()
+            n_rows = 0
+
+            chunks = read_chunks(tracks_path, RAW_FEATURES, chunk_size)
+            tasks = (({column: chunk[column].to_numpy() for column in RAW_FEATURES},) for chunk in chunks)
+
+            with open(encoded_path, 'wb') as encoded_file:
+                for encoded in bounded_map(executor, _encode_chunk, tasks, max_in_flight):
+                    encoded_df = pd.DataFrame(data=encoded, columns=PREPROCESSED_FEATURES)
+
+                    if n_rows == 0:
+                        column_transformer.fit(encoded_df)
+                    else:
+                        column_transformer.named_transformers_['num'].partial_fit(encoded_df.loc[:, SCALED_FEATURES])
+
+                    encoded.tofile(encoded_file)
+                    n_rows += len(encoded)
+
+            assert n_rows >= K_CLUSTERS, (
+                f'At least {K_CLUSTERS} tracks are needed, got {n_rows}.'
+            )
+
+            feature_names = list(map(lambda x: x.split('__')[1], column_transformer.get_feature_names_out().tolist()))
+            assert feature_names == PREPROCESSED_FEATURES, (
+                'Column Transformer must output `PREPROCESSED_FEATURES` in order.'
+            )
+
+            scaler = column_transformer.named_transformers_['num']
+            n_passthrough = len(PREPROCESSED_FEATURES) - len(SCALED_FEATURES)
+            means = np.concatenate([scaler.mean_, np.zeros(n_passthrough)])
+            scales = np.concatenate([scaler.scale_, np.ones(n_passthrough)])
+
+            # 2. Fit K-Means on random batches, reading only those rows from the spilled file
+            encoded = np.memmap(encoded_path, dtype=np.float64, mode='r', shape=(n_rows, len(PREPROCESSED_FEATURES)))
+            k_means = MiniBatchKMeans(n_clusters=K_CLUSTERS, batch_size=batch_size, n_init=3, random_state=seed)
+            rng = np.random.default_rng(seed)
+            batch_size = max(batch_size, K_CLUSTERS)
+
+            for _ in range(n_epochs):
+                order = rng.permutation(n_rows)
+                for start in range(0, n_rows, batch_size):
+                    batch = np.sort(order[start:start + batch_size])
+                    if len(batch) < K_CLUSTERS:
+                        continue
+                    k_means.partial_fit(pd.DataFrame(data=(encoded[batch] - means) / scales, columns=feature_names))
+
+            centroids = np.asarray(k_means.cluster_centers_, dtype=np.float64)
+
+            # 3. Assign clusters and write the store, CSV chunks and encoded rows stay aligned
+            metadata_columns = METADATA_COLUMNS + [TRACK_NUMBER_COLUMN]
+            metadata_chunks = deque()
+
+            def assign_tasks() -> Iterable[tuple]:
+                start = 0
+                for chunk in read_chunks(tracks_path, metadata_columns, chunk_size):
+                    metadata_chunks.append(chunk)
+                    yield (encoded_path, n_rows, start, start + len(chunk), means, scales, centroids)
+                    start += len(chunk)
+
+            with TrackStoreWriter(new_store_path, features=feature_names) as writer:
+                for features, clusters in bounded_map(executor, _assign_chunk, assign_tasks(), max_in_flight):
+                    writer.append(features=features, clusters=clusters, metadata=metadata_chunks.popleft())
+
+            assert writer.n_tracks == n_rows, (
+                'Raw tracks ".csv" file changed while building the catalog.'
+            )
+
+        store = TrackStore(new_store_path)
+
+        from track_index import ClusterIndex, INDEX_DIR_NAME
+        from catalog_search import CatalogNameIndex, NAME_INDEX_DIR_NAME
+        ClusterIndex.build(features=store.features, clusters=store.clusters).save(os.path.join(new_store_path, INDEX_DIR_NAME))
+        CatalogNameIndex.build(store).save(os.path.join(new_store_path, NAME_INDEX_DIR_NAME))
+
+        # Only a complete store replaces the catalog, readers switch to it on their next refresh
+        from catalog import Catalog
+        store = Catalog(store_path, centroids=centroids).replace(new_store_path).store
+
+        # Replace the model atomically, a running bot may be watching it
+        with open(pkl_path + '.tmp', 'wb') as f:
+            pickle.dump({'k_means': k_means, 'column_transformer': column_transformer}, f)
+        os.replace(pkl_path + '.tmp', pkl_path)
+        export_model_artifact(pkl_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the K-Means model and the track store from the raw tracks ".csv" file.')
+    parser.add_argument('--tracks', default='../data/tracks_features.csv', help='Path to the raw tracks ".csv" file.')
+    parser.add_argument('--pkl', default='../models/k_means.pkl', help='Path to ".pkl" file to write the model to.')
+    parser.add_argument('--out', default='../data/track_store', help='Path to the store directory to write.')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='Amount of rows read at once.')
+    parser.add_argument('--batch-size', type=int, default=10_000, help='Amount of rows in one K-Means step.')
+    parser.add_argument('--epochs', type=int, default=3, help='Amount of K-Means passes over the catalog.')
+    parser.add_argument('--workers', type=int, default=None, help='The amount of worker processes.')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed.')
+    args = parser.parse_args()
+
+    store = build_catalog(
+        tracks_path=args.tracks,
+        pkl_path=args.pkl,
+        store_path=args.out,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        n_epochs=args.epochs,
+        max_workers=args.workers,
+        seed=args.seed
+    )
+
+    print(f'Written {len(store)} tracks to {args.out} and the model to {args.pkl}')
@@ -0,0 +1,847 @@
+# Import necessary dependencies
+import argparse
+import json
+import os
+import shutil
+import threading
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from const import *
+from track_store import TrackStore, TrackStoreWriter, METADATA_COLUMNS, TRACK_NUMBER_COLUMN, ID_INDEX_FILES
+from track_index import ClusterIndex, INDEX_DIR_NAME, merge_top_k
+from catalog_search import CatalogNameIndex, NAME_INDEX_DIR_NAME
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CURRENT_FILE = 'CURRENT'
+SEGMENTS_DIR = 'segments'
+STATS_FILE = 'stats.json'
+
+# Segment name of a plain track store written directly into the catalog root
+ROOT_SEGMENT = '.'
+
+# Files of a plain track store, removed from the root once it is compacted away
+_ROOT_STORE_FILES = ['meta.json', 'features.f32', 'clusters.i32', f'{TRACK_NUMBER_COLUMN}.i32', STATS_FILE] + [
+    f'{column}.{extension}' for column in METADATA_COLUMNS for extension in ('bin', 'off')] + ID_INDEX_FILES
+
+
+def cluster_stats(features: np.ndarray = None, clusters: np.ndarray = None, centroids: np.ndarray = None) -> dict:
+    """
+    Amount of tracks and sum of squared distances to the centroid of every cluster.
+
+    Parameters
+    ----------
+    `features`: np.ndarray = None
+        Preprocessed features of shape (n_tracks, n_features).
+    `clusters`: np.ndarray = None
+        Cluster of every track.
+    `centroids`: np.ndarray = None
+        Cluster centers of the K-Means model.
+
+    Returns
+    ----------
+    `stats`: dict
+        `count` and `sq_dist` lists with one value per cluster.
+    """
+
+    assert features is not None and clusters is not None and centroids is not None, (
+        '`features`, `clusters`, and `centroids` must be specified.'
+    )
+
+    clusters = np.asarray(clusters, dtype=np.int64)
+    sq_dist = ((np.asarray(features, dtype=np.float64) - centroids[clusters]) ** 2).sum(axis=1)
+
+    return {
+        'count': np.bincount(clusters, minlength=len(centroids)).tolist(),
+        'sq_dist': np.bincount(clusters, weights=sq_dist, minlength=len(centroids)).tolist()
+    }
+
+
+def _row_mask(n_rows: int, rows: np.ndarray) -> np.ndarray:
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+
+    return mask
+
+
+class SegmentedArray():
+    """
+    Read-only row view over arrays of several segments, indexed by global row.
+    """
+
+    def __init__(self, arrays: list[np.ndarray] = None) -> None:
+        self.arrays = arrays
+        self.starts = np.concatenate([[0], np.cumsum([len(array) for array in arrays])]).astype(np.int64)
+        self.shape = (int(self.starts[-1]),) + arrays[0].shape[1:]
+        self.dtype = arrays[0].dtype
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)))
+        elif np.ndim(rows) == 0:
+            segment = int(np.searchsorted(self.starts, rows, side='right')) - 1
+            return self.arrays[segment][int(rows) - self.starts[segment]]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        segments = np.searchsorted(self.starts, rows, side='right') - 1
+
+        for segment in np.unique(segments):
+            positions = np.flatnonzero(segments == segment)
+            result[positions] = self.arrays[segment][rows[positions] - self.starts[segment]]
+
+        return result
+
+
+class SegmentedStore():
+    """
+    `TrackStore` interface over the segments of a catalog snapshot.
+
+    Rows are numbered globally in segment order, so row `r` of the second
+    segment is `len(first segment) + r`.
+    """
+
+    # Builds the data frame from `column` only
+    metadata = TrackStore.metadata
+
+    def __init__(self, stores: list[TrackStore] = None, path: str = None) -> None:
+        self.stores = stores
+        self.path = path
+        self.feature_names = stores[0].feature_names
+
+        self.features = SegmentedArray([store.features for store in stores])
+        self.clusters = SegmentedArray([store.clusters for store in stores])
+        self.track_numbers = SegmentedArray([store.track_numbers for store in stores])
+        self.starts = self.features.starts
+        self.n_tracks = len(self.features)
+
+    def __len__(self) -> int:
+        return self.n_tracks
+
+    def column(self, column: str = None, rows: np.ndarray = None) -> list:
+        assert column is not None and rows is not None, (
+            '`column` and `rows` must be specified.'
+        )
+
+        rows = np.asarray(rows, dtype=np.int64)
+        values = [None] * len(rows)
+        segments = np.searchsorted(self.starts, rows, side='right') - 1
+
+        for segment in np.unique(segments):
+            positions = np.flatnonzero(segments == segment)
+            for position, value in zip(positions.tolist(), self.stores[segment].column(column, rows[positions] - self.starts[segment])):
+                values[position] = value
+
+        return values
+
+
+class SegmentedIndex():
+    """
+    `ClusterIndex` interface over the segments of a catalog snapshot.
+
+    Removed tracks of every segment are masked inside its scan, so they never
+    take the place of live candidates, and the results are merged.
+    """
+
+    def __init__(self, indices: list[ClusterIndex] = None, starts: np.ndarray = None, removed: list[np.ndarray] = None) -> None:
+        self.indices = indices
+        self.starts = starts
+        self.removed = removed
+        self._excluded = [index.exclusion_mask(local) for index, local in zip(indices, removed)]
+
+    @property
+    def n_clusters(self) -> int:
+        return max(index.n_clusters for index in self.indices)
+
+    def search(self, query: np.ndarray = None, cluster: int | list[int] = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        assert query is not None and cluster is not None, (
+            '`query` and `cluster` must be specified.'
+        )
+
+        return self._merge([index.search(query=query, cluster=cluster, top_k=top_k, excluded=excluded)
+                            for index, excluded in zip(self.indices, self._excluded)], top_k)
+
+    def search_exact(self, query: np.ndarray = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        assert query is not None, (
+            '`query` must be specified.'
+        )
+
+        return self._merge([index.search_exact(query=query, top_k=top_k, excluded=excluded)
+                            for index, excluded in zip(self.indices, self._excluded)], top_k)
+
+    def _merge(self, results: list[tuple[np.ndarray, np.ndarray]], top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        row_ids = np.concatenate([row_ids + start for (row_ids, _), start in zip(results, self.starts)])
+        similarity = np.concatenate([similarity for _, similarity in results])
+        order = np.lexsort((row_ids, -similarity))[:top_k]
+
+        return row_ids[order], similarity[order]
+
+    def search_many(self, queries: np.ndarray = None, clusters: np.ndarray = None, top_k: int = 5, **kwargs) -> tuple[np.ndarray, np.ndarray]:
+        assert queries is not None and clusters is not None, (
+            '`queries` and `clusters` must be specified.'
+        )
+
+        row_ids, similarity = [], []
+        for index, start, excluded in zip(self.indices, self.starts, self._excluded):
+            segment_row_ids, segment_similarity = index.search_many(queries=queries, clusters=clusters, top_k=top_k, excluded=excluded, **kwargs)
+            row_ids.append(np.where(segment_row_ids >= 0, segment_row_ids + start, -1))
+            similarity.append(segment_similarity)
+
+        row_ids, similarity = np.hstack(row_ids), np.hstack(similarity)
+
+        return merge_top_k(row_ids=row_ids, similarity=similarity, top_k=top_k)
+
+
+class SegmentedNameIndex():
+    """
+    `CatalogNameIndex` interface over the segments of a catalog snapshot.
+    """
+
+    # Resolution policy only depends on `exact` and `fuzzy`
+    lookup = CatalogNameIndex.lookup
+
+    def __init__(self, indices: list[CatalogNameIndex] = None, starts: np.ndarray = None, removed: list[np.ndarray] = None) -> None:
+        self.indices = indices
+        self.starts = starts
+        self.removed = removed
+        self._removed_rows = np.concatenate([local + start for local, start in zip(removed, starts)]) if removed else np.zeros(0, dtype=np.int64)
+        self._excluded = [_row_mask(len(index.n_trigrams), local) if len(local) else None for index, local in zip(indices, removed)]
+
+    def exact(self, text: str = None) -> np.ndarray:
+        rows = np.concatenate([index.exact(text).astype(np.int64) + start for index, start in zip(self.indices, self.starts)])
+
+        return rows[~np.isin(rows, self._removed_rows)]
+
+    def fuzzy(self, text: str = None, limit: int = 10, min_score: float = 0.5, **kwargs) -> tuple[np.ndarray, np.ndarray]:
+        results = [index.fuzzy(text, limit=limit, min_score=min_score, excluded=excluded, **kwargs)
+                   for index, excluded in zip(self.indices, self._excluded)]
+
+        rows = np.concatenate([rows.astype(np.int64) + start for (rows, _), start in zip(results, self.starts)])
+        scores = np.concatenate([scores for _, scores in results])
+        order = np.lexsort((rows, -scores))[:limit]
+
+        return rows[order], scores[order]
+
+
+class CatalogSnapshot():
+    """
+    Immutable view of one catalog version.
+
+    Attributes
+    ----------
+    `version`: int
+        Manifest version, 0 for a plain track store that was never updated.
+    `manifest`: dict
+        Segments, removed rows, and reference cluster statistics of this version.
+    `store`: TrackStore | SegmentedStore
+        Features, clusters and metadata of all live and removed tracks.
+    `index`: ClusterIndex | SegmentedIndex
+        Cluster index that never returns removed tracks.
+    `name_index`: CatalogNameIndex | SegmentedNameIndex
+        Title index that never returns removed tracks, `None` if not loaded.
+    `backend`: ClusterScanBackend | IVFPQBackend
+        Retrieval backend over `store`, attached by `retrieval.open_snapshot`, `None` otherwise.
+    """
+
+    def __init__(self, version: int, manifest: dict, store, index, name_index) -> None:
+        self.version = version
+        self.manifest = manifest
+        self.store = store
+        self.index = index
+        self.name_index = name_index
+        self.backend = None
+
+    def removed_rows(self) -> np.ndarray:
+        """
+        Global rows of removed tracks in `store`.
+        """
+
+        starts = getattr(self.store, 'starts', [0])
+        removed = [np.asarray(self.manifest['removed'].get(segment, []), dtype=np.int64) + start
+                   for segment, start in zip(self.manifest['segments'], starts)]
+
+        return np.concatenate(removed) if removed else np.zeros(0, dtype=np.int64)
+
+
+class Catalog():
+    """
+    Versioned track catalog that supports adding and removing tracks without a full rebuild.
+
+    Layout of the catalog root:
+
+    - track store files of the initial catalog (segment `.`), see `track_store.py`;
+    - `segments/<version>-delta`, `segments/<version>-base`: track stores of added
+      tracks and of compacted catalogs, each with its own indices and `stats.json`;
+    - `MANIFEST-<version>.json`: segments in order, removed rows of every segment,
+      and reference cluster statistics of the data the model was fitted on;
+    - `CURRENT`: name of the current manifest, replaced atomically on every update.
+
+    A root without `CURRENT` is a plain track store and is read as version 0.
+    Readers take a `snapshot` and keep using it until they load a newer one.
+    Only one process may update a catalog at a time.
+
+    Attributes
+    ----------
+    `root`: str
+        Path to the catalog root.
+    `centroids`: np.ndarray
+        Cluster centers of the K-Means model, needed for updates and drift statistics.
+    """
+
+    def __init__(self, root: str = None, centroids: np.ndarray = None) -> None:
+        """
+        Initialize `Catalog` object.
+
+        Parameters
+        ----------
+        `root`: str = None
+            Path to the catalog root, e.g. '../data/track_store'.
+        `centroids`: np.ndarray = None
+            Cluster centers of the K-Means model.
+
+        Returns
+        ----------
+        `self`: Catalog
+            Catalog class object.
+        """
+
+        assert root is not None, (
+            '`root` must be specified.'
+        )
+
+        self.root = root
+        self.centroids = None if centroids is None else np.asarray(centroids, dtype=np.float64)
+
+        self._lock = threading.Lock()
+
+    def current_version(self) -> int:
+        """
+        Version of the current manifest, 0 for a plain track store.
+        """
+
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                return int(f.read().strip().split('-')[1].split('.')[0])
+        except FileNotFoundError:
+            return 0
+
+    def _manifest_path(self, version: int) -> str:
+        return os.path.join(self.root, f'MANIFEST-{version:06d}.json')
+
+    def _segment_path(self, segment: str) -> str:
+        return self.root if segment == ROOT_SEGMENT else os.path.join(self.root, SEGMENTS_DIR, segment)
+
+    def _read_manifest(self, version: int) -> dict:
+        if version == 0:
+            return {'version': 0, 'segments': [ROOT_SEGMENT], 'removed': {}, 'reference': None}
+
+        with open(self._manifest_path(version)) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        # Manifest first, then `CURRENT`, both through an atomic rename
+        manifest_path = self._manifest_path(manifest['version'])
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        current_path = os.path.join(self.root, CURRENT_FILE)
+        with open(current_path + '.tmp', 'w') as f:
+            f.write(os.path.basename(manifest_path))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_path + '.tmp', current_path)
+
+    def snapshot(self, version: int = None, name_index: bool = True, precision: str = 'float32') -> CatalogSnapshot:
+        """
+        Load one catalog version.
+
+        Parameters
+        ----------
+        `version`: int = None
+            Manifest version, `None` for the current one.
+        `name_index`: bool = True
+            Whether to load title indices as well.
+        `precision`: str = 'float32'
+            Scan precision of cluster indices, see `ClusterIndex.from_store`.
+
+        Returns
+        ----------
+        `snapshot`: CatalogSnapshot
+            Memory-mapped view of the catalog version.
+        """
+
+        if version is None:
+            version = self.current_version()
+
+        manifest = self._read_manifest(version)
+
+        stores = [TrackStore(self._segment_path(segment)) for segment in manifest['segments']]
+        indices = [ClusterIndex.from_store(store, precision=precision) for store in stores]
+        name_indices = [CatalogNameIndex.from_store(store) for store in stores] if name_index else None
+        removed = [np.asarray(manifest['removed'].get(segment, []), dtype=np.int64) for segment in manifest['segments']]
+
+        # The common case needs no merging at all
+        if len(stores) == 1 and len(removed[0]) == 0:
+            return CatalogSnapshot(version, manifest, stores[0], indices[0], name_indices[0] if name_index else None)
+
+        store = SegmentedStore(stores, path=self.root)
+
+        return CatalogSnapshot(
+            version, manifest, store,
+            SegmentedIndex(indices, store.starts, removed),
+            SegmentedNameIndex(name_indices, store.starts, removed) if name_index else None
+        )
+
+    def _segment_stats(self, segment: str) -> dict:
+        stats_path = os.path.join(self._segment_path(segment), STATS_FILE)
+        if os.path.exists(stats_path):
+            with open(stats_path) as f:
+                return json.load(f)
+
+        assert self.centroids is not None, (
+            '`centroids` must be specified to compute cluster statistics.'
+        )
+
+        store = TrackStore(self._segment_path(segment))
+        stats = {'count': [0] * len(self.centroids), 'sq_dist': [0.0] * len(self.centroids)}
+        for start in range(0, len(store), 100_000):
+            chunk = cluster_stats(store.features[start:start + 100_000], store.clusters[start:start + 100_000], self.centroids)
+            stats = {key: np.add(stats[key], chunk[key]).tolist() for key in stats}
+
+        with open(stats_path, 'w') as f:
+            json.dump(stats, f)
+
+        return stats
+
+    def _current_manifest(self) -> dict:
+        manifest = self._read_manifest(self.current_version())
+
+        # First update of a plain or replaced track store: the model was fitted on it
+        if manifest['reference'] is None:
+            manifest['reference'] = self._segment_stats(manifest['segments'][0])
+
+        return manifest
+
+    def _find_rows(self, snapshot: CatalogSnapshot, track_ids: list[str]) -> dict[str, list[int]]:
+        # Live local rows of every segment whose track id is in `track_ids`
+        found = {}
+
+        for segment in snapshot.manifest['segments']:
+            rows = TrackStore(self._segment_path(segment)).find(track_ids)
+            rows = rows[~np.isin(rows, snapshot.manifest['removed'].get(segment, []))]
+            if len(rows):
+                found[segment] = rows.tolist()
+
+        return found
+
+    def add_tracks(self, tracks: list[dict] = None, preprocessor=None) -> CatalogSnapshot:
+        """
+        Add tracks as a new delta segment, replacing live tracks with the same ids.
+
+        Tracks are preprocessed with `preprocessor` and assigned to the existing
+        K-Means clusters; the model is not refitted. Of tracks with the same id
+        within `tracks`, the last one is added.
+
+        Parameters
+        ----------
+        `tracks`: list[dict] = None
+            Raw features of every track in the format of `TrackSearchEngine.format_track`.
+        `preprocessor`: TrackPreprocessor = None
+            Preprocessor of the model the catalog was built with.
+
+        Returns
+        ----------
+        `snapshot`: CatalogSnapshot
+            The new current version.
+        """
+
+        assert tracks is not None and preprocessor is not None, (
+            '`tracks` and `preprocessor` must be specified.'
+        )
+
+        if self.centroids is None:
+            self.centroids = preprocessor.centroids
+
+        # Like a later call replacing an earlier one, so an id never has two live rows
+        last = {track['id']: i for i, track in enumerate(tracks)}
+        tracks = [tracks[i] for i in sorted(last.values())]
+
+        features, clusters = preprocessor.preprocess_array(tracks)
+
+        import pandas as pd
+
+        metadata = pd.DataFrame.from_records(tracks).reindex(columns=METADATA_COLUMNS + [TRACK_NUMBER_COLUMN])
+        # Stored catalogs keep artists as the string of a list, e.g. "['Artist']"
+        metadata['artists'] = metadata.loc[:, 'artists'].map(lambda x: str(list(x)) if isinstance(x, (list, tuple)) else x)
+        metadata[TRACK_NUMBER_COLUMN] = metadata.loc[:, TRACK_NUMBER_COLUMN].fillna(0)
+
+        with self._lock:
+            manifest = self._current_manifest()
+            version = manifest['version'] + 1
+            segment = f'{version:06d}-delta'
+            segment_path = self._segment_path(segment)
+
+            with TrackStoreWriter(segment_path, features=preprocessor.feature_names) as writer:
+                writer.append(features=features.astype(np.float32), clusters=clusters, metadata=metadata)
+
+            store = TrackStore(segment_path)
+            ClusterIndex.build(features=store.features, clusters=store.clusters).save(os.path.join(segment_path, INDEX_DIR_NAME))
+            CatalogNameIndex.build(store).save(os.path.join(segment_path, NAME_INDEX_DIR_NAME))
+            with open(os.path.join(segment_path, STATS_FILE), 'w') as f:
+                json.dump(cluster_stats(features, clusters, self.centroids), f)
+
+            replaced = self._find_rows(self.snapshot(manifest['version'], name_index=False), metadata.loc[:, 'id'].tolist())
+
+            self._write_manifest({
+                'version': version,
+                'segments': manifest['segments'] + [segment],
+                'removed': self._merge_removed(manifest['removed'], replaced),
+                'reference': manifest['reference']
+            })
+
+        return self.snapshot(version)
+
+    def remove_tracks(self, track_ids: list[str] = None) -> CatalogSnapshot:
+        """
+        Remove tracks by id. Their rows stay on disk until the next `compact`.
+
+        Parameters
+        ----------
+        `track_ids`: list[str] = None
+            Spotify ids of tracks to remove.
+
+        Returns
+        ----------
+        `snapshot`: CatalogSnapshot
+            The new current version.
+        """
+
+        assert track_ids is not None, (
+            '`track_ids` must be specified.'
+        )
+
+        with self._lock:
+            manifest = self._current_manifest()
+            version = manifest['version'] + 1
+
+            removed = self._find_rows(self.snapshot(manifest['version'], name_index=False), track_ids)
+
+            self._write_manifest({
+                'version': version,
+                'segments': manifest['segments'],
+                'removed': self._merge_removed(manifest['removed'], removed),
+                'reference': manifest['reference']
+            })
+
+        return self.snapshot(version)
+
+    @staticmethod
+    def _merge_removed(removed: dict, new_removed: dict) -> dict:
+        merged = {segment: list(rows) for segment, rows in removed.items()}
+        for segment, rows in new_removed.items():
+            merged[segment] = sorted(set(merged.get(segment, [])) | set(rows))
+
+        return merged
+
+    def needs_compaction(self, max_segments: int = 8, max_removed: int = 10_000) -> bool:
+        """
+        Whether the current version has more than `max_segments` segments or `max_removed` removed tracks.
+        """
+
+        manifest = self._read_manifest(self.current_version())
+
+        return len(manifest['segments']) > max_segments or sum(map(len, manifest['removed'].values())) > max_removed
+
+    def compact(self, chunk_size: int = 100_000, prune: bool = True) -> CatalogSnapshot:
+        """
+        Merge all segments without removed tracks into one base segment.
+
+        Readers are not blocked: they keep using their snapshot and switch to
+        the compacted version once `CURRENT` points to it. Updates wait.
+
+        Parameters
+        ----------
+        `chunk_size`: int = 100_000
+            Amount of rows copied at once.
+        `prune`: bool = True
+            Delete segments and manifests no longer referenced by the last two versions.
+
+        Returns
+        ----------
+        `snapshot`: CatalogSnapshot
+            The new current version.
+        """
+
+        with self._lock:
+            manifest = self._current_manifest()
+            version = manifest['version'] + 1
+            segment = f'{version:06d}-base'
+            segment_path = self._segment_path(segment)
+
+            stats = None
+            with TrackStoreWriter(segment_path, features=TrackStore(self._segment_path(manifest['segments'][0])).feature_names) as writer:
+                for source in manifest['segments']:
+                    store = TrackStore(self._segment_path(source))
+                    alive = np.ones(len(store), dtype=bool)
+                    alive[manifest['removed'].get(source, [])] = False
+
+                    for start in range(0, len(store), chunk_size):
+                        rows = np.flatnonzero(alive[start:start + chunk_size]) + start
+                        if len(rows) == 0:
+                            continue
+
+                        features, clusters = np.asarray(store.features[rows]), np.asarray(store.clusters[rows])
+                        writer.append(features=features, clusters=clusters,
+                                      metadata=store.metadata(rows, columns=METADATA_COLUMNS + [TRACK_NUMBER_COLUMN]))
+
+                        if self.centroids is not None:
+                            chunk_stats = cluster_stats(features, clusters, self.centroids)
+                            stats = chunk_stats if stats is None else {key: np.add(stats[key], chunk_stats[key]).tolist() for key in stats}
+
+            store = TrackStore(segment_path)
+            ClusterIndex.build(features=store.features, clusters=store.clusters).save(os.path.join(segment_path, INDEX_DIR_NAME))
+            CatalogNameIndex.build(store).save(os.path.join(segment_path, NAME_INDEX_DIR_NAME))
+            if stats is not None:
+                with open(os.path.join(segment_path, STATS_FILE), 'w') as f:
+                    json.dump(stats, f)
+
+            self._write_manifest({'version': version, 'segments': [segment], 'removed': {}, 'reference': manifest['reference']})
+
+            if prune:
+                self._prune(keep_versions=[version, manifest['version']])
+
+        return self.snapshot(version)
+
+    def _prune(self, keep_versions: list[int]) -> None:
+        # The previous version stays loadable, so readers that just read `CURRENT` still find it
+        keep = {segment for version in keep_versions for segment in self._read_manifest(version)['segments']}
+
+        segments_dir = os.path.join(self.root, SEGMENTS_DIR)
+        for segment in os.listdir(segments_dir) if os.path.isdir(segments_dir) else []:
+            if segment not in keep:
+                shutil.rmtree(os.path.join(segments_dir, segment), ignore_errors=True)
+
+        if ROOT_SEGMENT not in keep:
+            for file_name in _ROOT_STORE_FILES:
+                if os.path.exists(os.path.join(self.root, file_name)):
+                    os.remove(os.path.join(self.root, file_name))
+            for dir_name in (INDEX_DIR_NAME, NAME_INDEX_DIR_NAME):
+                shutil.rmtree(os.path.join(self.root, dir_name), ignore_errors=True)
+
+        for file_name in os.listdir(self.root):
+            if file_name.startswith('MANIFEST-') and int(file_name.split('-')[1].split('.')[0]) not in keep_versions:
+                os.remove(os.path.join(self.root, file_name))
+
+    def replace(self, store_path: str = None, prune: bool = True) -> CatalogSnapshot:
+        """
+        Replace all tracks of the catalog by a fully written track store, e.g. after a full rebuild.
+
+        The store directory is moved into the catalog together with its indices, so it
+        must be on the same file system. A root that is not a catalog yet becomes a plain
+        track store, otherwise the store is the only segment of a new version. Readers keep
+        their snapshot until `CURRENT` points to it, and a rebuild that fails before this
+        call leaves the catalog as it was.
+
+        Parameters
+        ----------
+        `store_path`: str = None
+            Path to the track store directory to move into the catalog.
+        `prune`: bool = True
+            Delete segments and manifests no longer referenced by the last two versions.
+
+        Returns
+        ----------
+        `snapshot`: CatalogSnapshot
+            The new current version.
+        """
+
+        assert store_path is not None, (
+            '`store_path` must be specified.'
+        )
+
+        with self._lock:
+            version = self.current_version()
+
+            if version == 0 and not os.path.exists(os.path.join(self.root, 'meta.json')):
+                # Fails instead of merging into a directory that is not empty
+                os.makedirs(os.path.dirname(os.path.abspath(self.root)), exist_ok=True)
+                os.replace(store_path, self.root)
+                return self.snapshot(0)
+
+            version += 1
+            segment = f'{version:06d}-base'
+            os.makedirs(os.path.join(self.root, SEGMENTS_DIR), exist_ok=True)
+            os.replace(store_path, self._segment_path(segment))
+
+            # The model is fitted on the new tracks, so they are the reference of drift statistics (see `_current_manifest`)
+            self._write_manifest({'version': version, 'segments': [segment], 'removed': {}, 'reference': None})
+
+            if prune:
+                self._prune(keep_versions=[version, version - 1])
+
+        return self.snapshot(version)
+
+    def drift_report(self, version: int = None) -> 'pd.DataFrame':
+        """
+        Compare the distribution of live tracks over clusters to the data the model was fitted on.
+
+        Parameters
+        ----------
+        `version`: int = None
+            Manifest version, `None` for the current one.
+
+        Returns
+        ----------
+        `report`: pd.DataFrame
+            One row per cluster with `reference_count`, `count`, `reference_share`, `share`,
+            `reference_mean_sq_dist`, and `mean_sq_dist` (mean squared distance to the centroid).
+        """
+
+        manifest = self._read_manifest(self.current_version() if version is None else version)
+        reference = manifest['reference'] or self._segment_stats(manifest['segments'][0])
+
+        count = np.zeros(len(reference['count']))
+        sq_dist = np.zeros(len(reference['count']))
+        for segment in manifest['segments']:
+            stats = self._segment_stats(segment)
+            count += stats['count']
+            sq_dist += stats['sq_dist']
+
+            removed = manifest['removed'].get(segment, [])
+            if removed:
+                store = TrackStore(self._segment_path(segment))
+                removed_stats = cluster_stats(store.features[removed], store.clusters[removed], self.centroids)
+                count -= removed_stats['count']
+                sq_dist -= removed_stats['sq_dist']
+
+        reference_count = np.asarray(reference['count'], dtype=np.float64)
+        reference_sq_dist = np.asarray(reference['sq_dist'], dtype=np.float64)
+
+        import pandas as pd
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame(data={
+                'cluster': np.arange(len(count)),
+                'reference_count': reference_count.astype(np.int64),
+                'count': count.astype(np.int64),
+                'reference_share': reference_count / reference_count.sum(),
+                'share': count / count.sum(),
+                'reference_mean_sq_dist': reference_sq_dist / reference_count,
+                'mean_sq_dist': sq_dist / count
+            })
+
+
+def drift_summary(report: 'pd.DataFrame' = None, max_share_shift: float = 0.05, max_distance_ratio: float = 1.25) -> dict:
+    """
+    Summarize `Catalog.drift_report` and decide whether a full retrain is due.
+
+    Parameters
+    ----------
+    `report`: pd.DataFrame = None
+        Output of `Catalog.drift_report`.
+    `max_share_shift`: float = 0.05
+        Maximum total variation distance between reference and current cluster shares.
+    `max_distance_ratio`: float = 1.25
+        Maximum ratio of current to reference mean squared distance to the centroids.
+
+    Returns
+    ----------
+    `summary`: dict
+        `share_shift`, `distance_ratio`, `worst_cluster`, and `retrain_recommended`.
+    """
+
+    assert report is not None, (
+        '`report` must be specified.'
+    )
+
+    share_shift = float((report['share'] - report['reference_share']).abs().sum() / 2)
+    distance_ratio = float((report['mean_sq_dist'] * report['count']).sum() / report['count'].sum()
+                           / ((report['reference_mean_sq_dist'] * report['reference_count']).sum() / report['reference_count'].sum()))
+
+    return {
+        'share_shift': share_shift,
+        'distance_ratio': distance_ratio,
+        'worst_cluster': int((report['mean_sq_dist'] / report['reference_mean_sq_dist']).fillna(0).idxmax()),
+        'retrain_recommended': share_shift > max_share_shift or distance_ratio > max_distance_ratio
+    }
+
+
+class BackgroundCompactor():
+    """
+    Thread that periodically compacts a catalog once it has too many segments or removed tracks.
+    """
+
+    def __init__(self, catalog: Catalog = None, interval: float = 600, max_segments: int = 8, max_removed: int = 10_000) -> None:
+        assert catalog is not None, (
+            '`catalog` must be specified.'
+        )
+
+        self.catalog = catalog
+        self.interval = interval
+        self.max_segments = max_segments
+        self.max_removed = max_removed
+        self.n_compactions = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='catalog-compactor', daemon=True)
+
+    def start(self) -> 'BackgroundCompactor':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self.catalog.needs_compaction(max_segments=self.max_segments, max_removed=self.max_removed):
+                self.catalog.compact()
+                self.n_compactions += 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental updates of the track catalog.')
+    parser.add_argument('--pkl', default='../models/k_means.pkl', help='Path to ".pkl" K-Means model and Column Transformer.')
+    parser.add_argument('--db', default='../data/track_store', help='Path to the catalog root.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='Add (or replace) tracks from a raw tracks ".csv" file.')
+    add_parser.add_argument('--tracks', required=True, help='Path to the raw tracks ".csv" file, same columns as `tracks_features.csv`.')
+
+    remove_parser = subparsers.add_parser('remove', help='Remove tracks by id.')
+    remove_parser.add_argument('--ids', nargs='+', required=True, help='Spotify ids of tracks to remove.')
+
+    subparsers.add_parser('compact', help='Merge all segments into one.')
+    subparsers.add_parser('drift', help='Cluster drift statistics against the data the model was fitted on.')
+
+    args = parser.parse_args()
+
+    import pandas as pd
+    from preprocessor import TrackPreprocessor
+    preprocessor = TrackPreprocessor(pkl_path=args.pkl)
+    catalog = Catalog(args.db, centroids=preprocessor.centroids)
+
+    if args.command == 'add':
+        tracks = pd.read_csv(args.tracks).dropna(subset=['name', 'album']).to_dict(orient='records')
+        snapshot = catalog.add_tracks(tracks, preprocessor=preprocessor)
+        print(f'Version {snapshot.version}: {len(snapshot.store)} rows')
+    elif args.command == 'remove':
+        snapshot = catalog.remove_tracks(args.ids)
+        print(f'Version {snapshot.version}: {len(snapshot.store)} rows')
+    elif args.command == 'compact':
+        snapshot = catalog.compact()
+        print(f'Version {snapshot.version}: {len(snapshot.store)} rows')
+
+    report = catalog.drift_report()
+    print(report.to_string(index=False) if args.command == 'drift' else '')
+    print(json.dumps(drift_summary(report), indent=4))
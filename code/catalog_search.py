@@ -0,0 +1,369 @@
+# Import necessary dependencies
+import json
+import os
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+from track_store import TrackStore, stable_hash
+
+NAME_INDEX_DIR_NAME = 'name_index'
+
+# Bumped whenever `normalize_text` changes, so indices with old keys are rebuilt
+NAME_INDEX_FORMAT_VERSION = 2
+
+# Trigrams are hashed into this many buckets, so no vocabulary has to be stored
+N_TRIGRAM_BUCKETS = 2 ** 20
+
+# Fuzzy lookups with more candidate rows than this are too generic to resolve locally
+MAX_FUZZY_CANDIDATES = 50_000
+
+_NOT_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Casefold `text`, strip punctuation, and collapse whitespace, keeping letters of every script.
+    """
+
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+
+    return _NOT_WORD.sub(' ', text).strip()
+
+
+def is_mostly_digits(text: str) -> bool:
+    """
+    Whether more than half of the characters of normalized `text` are digits, e.g. "2020" or "1 2 3".
+    """
+
+    characters = text.replace(' ', '')
+
+    return 2 * sum(character.isdigit() for character in characters) > len(characters)
+
+
+def parse_artists(artists: str) -> list[str]:
+    """
+    Split the stored `artists` value, e.g. "['Artist A', 'Artist B']", into artist names.
+    """
+
+    return [artist.strip(' \'"') for artist in artists.strip('[]').split(',') if artist.strip(' \'"')]
+
+
+def trigrams(text: str) -> np.ndarray:
+    """
+    Distinct hashed trigrams of normalized `text` padded with spaces.
+    """
+
+    padded = f'  {text} '
+
+    return np.unique(np.fromiter(
+        (zlib.crc32(padded[i:i + 3].encode('utf-8')) % N_TRIGRAM_BUCKETS for i in range(len(padded) - 2)),
+        dtype=np.int32
+    ))
+
+
+class CatalogNameIndex():
+    """
+    Title and artist index over the track store.
+
+    Supports normalized exact lookup of "title", "title artist", and "artist title"
+    through sorted 64-bit hashes, and fuzzy lookup through a trigram inverted index
+    ranked by Jaccard similarity, which tolerates typos and small differences in
+    punctuation, but not partial titles.
+
+    Attributes
+    ----------
+    `store`: TrackStore
+        Indexed track store.
+    `key_hashes`: np.ndarray
+        Sorted hashes of normalized exact-match keys.
+    `key_rows`: np.ndarray
+        Track store row of every key in `key_hashes`.
+    `postings`: np.ndarray
+        Track store rows of every trigram bucket, bucket `b` is `postings[offsets[b]:offsets[b + 1]]`.
+    `offsets`: np.ndarray
+        Start of every trigram bucket in `postings`.
+    `n_trigrams`: np.ndarray
+        The amount of distinct trigrams of every title.
+    """
+
+    def __init__(
+        self,
+        store: TrackStore = None,
+        key_hashes: np.ndarray = None,
+        key_rows: np.ndarray = None,
+        postings: np.ndarray = None,
+        offsets: np.ndarray = None,
+        n_trigrams: np.ndarray = None
+    ) -> None:
+        """
+        Initialize `CatalogNameIndex` object, see `build` and `load`.
+        """
+
+        assert store is not None, (
+            '`store` must be specified.'
+        )
+
+        self.store = store
+        self.key_hashes = key_hashes
+        self.key_rows = key_rows
+        self.postings = postings
+        self.offsets = offsets
+        self.n_trigrams = n_trigrams
+
+    @classmethod
+    def build(cls, store: TrackStore = None) -> 'CatalogNameIndex':
+        """
+        Build the index from all titles and artists of the track store.
+
+        Parameters
+        ----------
+        `store`: TrackStore = None
+            Track store to index.
+
+        Returns
+        ----------
+        `index`: CatalogNameIndex
+            The built index.
+        """
+
+        assert store is not None, (
+            '`store` must be specified.'
+        )
+
+        key_hashes, key_rows = [], []
+        trigram_ids, trigram_rows = [], []
+        n_trigrams = np.zeros(len(store), dtype=np.int32)
+
+        chunk_size = 100_000
+        for start in range(0, len(store), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(store)))
+
+            for row, name, artists in zip(rows.tolist(), store.column('name', rows), store.column('artists', rows)):
+                name = normalize_text(name)
+                if not name:
+                    continue
+
+                keys = {name}
+                for artist in parse_artists(artists)[:1]:
+                    artist = normalize_text(artist)
+                    keys |= {f'{name} {artist}', f'{artist} {name}'}
+
+                key_hashes.extend(map(stable_hash, keys))
+                key_rows.extend([row] * len(keys))
+
+                grams = trigrams(name)
+                trigram_ids.append(grams)
+                trigram_rows.append(np.full(len(grams), row, dtype=np.int32))
+                n_trigrams[row] = len(grams)
+
+        key_hashes = np.asarray(key_hashes, dtype=np.int64)
+        key_rows = np.asarray(key_rows, dtype=np.int32)
+        order = np.lexsort((key_rows, key_hashes))
+
+        trigram_ids = np.concatenate(trigram_ids) if trigram_ids else np.zeros(0, dtype=np.int32)
+        trigram_rows = np.concatenate(trigram_rows) if trigram_rows else np.zeros(0, dtype=np.int32)
+        postings_order = np.argsort(trigram_ids, kind='stable')
+
+        offsets = np.zeros(N_TRIGRAM_BUCKETS + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(trigram_ids, minlength=N_TRIGRAM_BUCKETS))
+
+        return cls(store=store, key_hashes=key_hashes[order], key_rows=key_rows[order],
+                   postings=trigram_rows[postings_order], offsets=offsets, n_trigrams=n_trigrams)
+
+    @classmethod
+    def from_store(cls, store: TrackStore = None) -> 'CatalogNameIndex':
+        """
+        Load the index saved next to the track store or build and save it.
+        """
+
+        assert store is not None, (
+            '`store` must be specified.'
+        )
+
+        index_path = os.path.join(store.path, NAME_INDEX_DIR_NAME)
+        if os.path.exists(os.path.join(index_path, 'meta.json')):
+            with open(os.path.join(index_path, 'meta.json')) as f:
+                if json.load(f).get('format_version') == NAME_INDEX_FORMAT_VERSION:
+                    return cls.load(store, index_path)
+
+        index = cls.build(store)
+        try:
+            index.save(index_path)
+        except OSError:
+            # Read-only store, keep the index in memory
+            pass
+
+        return index
+
+    def save(self, path: str = None) -> None:
+        """
+        Save the index as raw arrays, so that `load` can memory-map it.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        os.makedirs(path, exist_ok=True)
+
+        self.key_hashes.tofile(os.path.join(path, 'key_hashes.i64'))
+        self.key_rows.tofile(os.path.join(path, 'key_rows.i32'))
+        self.postings.tofile(os.path.join(path, 'postings.i32'))
+        self.offsets.tofile(os.path.join(path, 'offsets.i64'))
+        self.n_trigrams.tofile(os.path.join(path, 'n_trigrams.i32'))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'format_version': NAME_INDEX_FORMAT_VERSION, 'n_tracks': len(self.n_trigrams), 'n_keys': len(self.key_hashes),
+                       'n_postings': len(self.postings), 'n_buckets': N_TRIGRAM_BUCKETS}, f, indent=4)
+
+    @classmethod
+    def load(cls, store: TrackStore = None, path: str = None) -> 'CatalogNameIndex':
+        """
+        Memory-map the index saved by `save`.
+        """
+
+        assert store is not None and path is not None, (
+            '`store` and `path` must be specified.'
+        )
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        assert meta.get('format_version') == NAME_INDEX_FORMAT_VERSION, (
+            f'Unsupported name index format version: {meta.get("format_version")}.'
+        )
+        assert meta['n_tracks'] == len(store) and meta['n_buckets'] == N_TRIGRAM_BUCKETS, (
+            'Name index does not match the track store.'
+        )
+
+        def open_array(file_name: str, dtype: type, count: int) -> np.ndarray:
+            if count == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(os.path.join(path, file_name), dtype=dtype, mode='r', shape=(count,))
+
+        return cls(store=store,
+                   key_hashes=open_array('key_hashes.i64', np.int64, meta['n_keys']),
+                   key_rows=open_array('key_rows.i32', np.int32, meta['n_keys']),
+                   postings=open_array('postings.i32', np.int32, meta['n_postings']),
+                   offsets=open_array('offsets.i64', np.int64, N_TRIGRAM_BUCKETS + 1),
+                   n_trigrams=open_array('n_trigrams.i32', np.int32, meta['n_tracks']))
+
+    def exact(self, text: str = None) -> np.ndarray:
+        """
+        Rows whose normalized "title", "title artist", or "artist title" equals normalized `text`.
+        """
+
+        assert text is not None, (
+            '`text` must be specified.'
+        )
+
+        text_key = stable_hash(normalize_text(text))
+        start = np.searchsorted(self.key_hashes, text_key, side='left')
+        end = np.searchsorted(self.key_hashes, text_key, side='right')
+
+        return np.unique(np.asarray(self.key_rows[start:end]))
+
+    def fuzzy(
+        self,
+        text: str = None,
+        limit: int = 10,
+        min_score: float = 0.5,
+        excluded: np.ndarray = None,
+        max_candidates: int = MAX_FUZZY_CANDIDATES
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows whose titles share the most trigrams with normalized `text`.
+
+        A row scores at least `min_score` only if it shares at least `min_score * n` of the
+        `n` trigrams of `text`, so it is in one of the `n - min_score * n + 1` rarest posting
+        lists. Only those are merged; the frequent ones are probed for the candidates they give.
+
+        Parameters
+        ----------
+        `text`: str = None
+            Search text.
+        `limit`: int = 10
+            The amount of rows to return.
+        `min_score`: float = 0.5
+            Minimum Jaccard similarity between trigram sets.
+        `excluded`: np.ndarray = None
+            Boolean mask of track store rows to skip, e.g. removed tracks.
+        `max_candidates`: int = MAX_FUZZY_CANDIDATES
+            Nothing is returned if the rarest posting lists still hold more rows than this.
+
+        Returns
+        ----------
+        `rows`: np.ndarray
+            Track store rows sorted by decreasing score.
+        `scores`: np.ndarray
+            Jaccard similarity of every row.
+        """
+
+        assert text is not None, (
+            '`text` must be specified.'
+        )
+
+        grams = trigrams(normalize_text(text))
+        # Rows of every bucket are sorted, see `build`
+        postings = sorted((self.postings[self.offsets[gram]:self.offsets[gram + 1]] for gram in grams.tolist()), key=len)
+        n_prefix = len(grams) - max(int(np.ceil(min_score * len(grams) - 1e-9)), 1) + 1
+
+        candidates = np.concatenate(postings[:n_prefix]) if n_prefix > 0 else np.zeros(0, dtype=np.int32)
+        if len(candidates) == 0 or len(candidates) > max_candidates:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        rows, shared = np.unique(candidates, return_counts=True)
+        for bucket in postings[n_prefix:]:
+            positions = np.minimum(np.searchsorted(bucket, rows), len(bucket) - 1)
+            shared += bucket[positions] == rows
+        scores = shared / (len(grams) + np.asarray(self.n_trigrams[rows]) - shared)
+
+        keep = scores >= min_score
+        if excluded is not None:
+            keep &= ~excluded[rows]
+        rows, scores = rows[keep], scores[keep]
+        order = np.lexsort((rows, -scores))[:limit]
+
+        return rows[order], scores[order]
+
+    def lookup(self, text: str = None, min_score: float = 0.9) -> int | None:
+        """
+        Resolve a user query to one track store row, or `None` if the match is not confident.
+
+        A normalized exact match wins when it is unambiguous; otherwise the best
+        fuzzy match is used only if it scores at least `min_score` and no other title
+        scores the same. Queries that are empty or mostly digits after normalization,
+        e.g. a year, are left to Spotify.
+
+        Parameters
+        ----------
+        `text`: str = None
+            Query, e.g. "title" or "title artist".
+        `min_score`: float = 0.9
+            Minimum Jaccard similarity of a fuzzy match.
+
+        Returns
+        ----------
+        `row`: int | None
+            Track store row of the matched track.
+        """
+
+        normalized = normalize_text(text)
+        if not normalized or is_mostly_digits(normalized):
+            return None
+
+        rows = self.exact(text)
+        if len(rows) == 1:
+            return int(rows[0])
+        if len(rows) > 1:
+            # The same title by several artists: let Spotify pick the popular one
+            return None
+
+        rows, scores = self.fuzzy(text, limit=2, min_score=min_score)
+        if len(rows) == 1 or (len(rows) == 2 and scores[0] > scores[1]):
+            return int(rows[0])
+
+        return None
@@ -0,0 +1,365 @@
+# Import necessary dependencies
+import bisect
+import collections
+import functools
+import inspect
+import sys
+import threading
+import time
+from typing import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of latency histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """
+    Cumulative latency histogram of one pipeline stage.
+
+    Attributes
+    ----------
+    `buckets`: tuple[float]
+        Upper bounds of the buckets in seconds.
+    `counts`: list[int]
+        Observations per bucket, the last one counts values above all bounds.
+    `sum`: float
+        Sum of all observations in seconds.
+    `count`: int
+        The amount of observations.
+    `errors`: int
+        The amount of observations that ended with an exception.
+    """
+
+    def __init__(self, buckets: tuple[float] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        bucket = bisect.bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += seconds
+            self.count += 1
+            self.errors += error
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket that holds quantile `q`, `inf` if it is above all buckets.
+        """
+
+        with self._lock:
+            counts, count = list(self.counts), self.count
+
+        if count == 0:
+            return float('nan')
+
+        rank, seen = q * count, 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+
+        return float('inf')
+
+
+class Span():
+    """
+    Context manager that records the wall time of a block into a stage histogram.
+    """
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.histogram.observe(time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class _NoopSpan():
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class MetricsRegistry():
+    """
+    In-process latency histograms of pipeline stages.
+
+    Disabled registries hand out a shared no-op span, so instrumented code
+    costs one attribute check per stage.
+
+    Attributes
+    ----------
+    `enabled`: bool
+        Whether spans are recorded.
+    `histograms`: dict[str, Histogram]
+        Histogram of every stage seen so far.
+    `gauges`: dict[str, tuple[Callable[[], float], str, str]]
+        Function, type ('gauge' or 'counter') and help text of every registered value.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: tuple[float] = BUCKETS) -> None:
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage: str = None) -> Span | _NoopSpan:
+        """
+        Time a block as `stage`: `with registry.span('preprocess'): ...`.
+        """
+
+        if not self.enabled:
+            return _NOOP_SPAN
+
+        return Span(self.histogram(stage))
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram(self.buckets))
+
+        return histogram
+
+    def observe(self, stage: str, seconds: float, error: bool = False) -> None:
+        self.histogram(stage).observe(seconds, error)
+
+    def gauge(self, name: str, function: Callable[[], float], kind: str = 'gauge', help: str = '') -> None:
+        """
+        Serve the value returned by `function` as `recsys_{name}` on every render.
+        """
+
+        assert kind in ('gauge', 'counter'), (
+            '`kind` must be either \'gauge\' or \'counter\'.'
+        )
+
+        with self._lock:
+            self.gauges[name] = (function, kind, help)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms = {}
+
+    def render(self) -> str:
+        """
+        Histograms and gauges in the Prometheus text exposition format.
+        """
+
+        lines = [
+            '# HELP recsys_stage_seconds Latency of recommendation pipeline stages.',
+            '# TYPE recsys_stage_seconds histogram'
+        ]
+        errors = [
+            '# HELP recsys_stage_errors_total Pipeline stages that ended with an exception.',
+            '# TYPE recsys_stage_errors_total counter'
+        ]
+
+        for stage, histogram in sorted(self.histograms.items()):
+            with histogram._lock:
+                counts, total, count, n_errors = list(histogram.counts), histogram.sum, histogram.count, histogram.errors
+
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'recsys_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'recsys_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'recsys_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'recsys_stage_seconds_count{{stage="{stage}"}} {count}')
+            errors.append(f'recsys_stage_errors_total{{stage="{stage}"}} {n_errors}')
+
+        values = []
+        for name, (function, kind, help) in sorted(self.gauges.items()):
+            values.extend([
+                f'# HELP recsys_{name} {help}',
+                f'# TYPE recsys_{name} {kind}',
+                f'recsys_{name} {function()}'
+            ])
+
+        return '\n'.join(lines + errors + values) + '\n'
+
+
+# Registry used by the instrumented modules
+REGISTRY = MetricsRegistry()
+
+
+def span(stage: str = None) -> Span | _NoopSpan:
+    """
+    Time a block as `stage` in `REGISTRY`.
+    """
+
+    return REGISTRY.span(stage)
+
+
+def timed(stage: str = None):
+    """
+    Decorator that times every call of a function or coroutine function as `stage` in `REGISTRY`.
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with REGISTRY.span(stage):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with REGISTRY.span(stage):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable() -> None:
+    REGISTRY.enabled = True
+
+
+def disable() -> None:
+    REGISTRY.enabled = False
+
+
+class SamplingProfiler():
+    """
+    Statistical profiler that samples the stacks of all threads of the process.
+
+    Samples are aggregated as collapsed stacks ("outer;inner count" lines),
+    the input format of flame graph tools.
+
+    Attributes
+    ----------
+    `interval`: float
+        Seconds between two samples.
+    `samples`: collections.Counter
+        The amount of samples of every collapsed stack.
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64) -> None:
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'SamplingProfiler':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                    frame = frame.f_back
+
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """
+        Collapsed stacks sorted by decreasing amount of samples.
+        """
+
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+class MetricsServer():
+    """
+    Local HTTP endpoint serving "/metrics" in the Prometheus text format,
+    and "/profile" with collapsed stacks if a profiler is attached.
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = '127.0.0.1', port: int = 9100, profiler: SamplingProfiler = None) -> None:
+        """
+        Initialize `MetricsServer` object, see `start`.
+
+        Parameters
+        ----------
+        `registry`: MetricsRegistry = REGISTRY
+            Registry to serve.
+        `host`: str = '127.0.0.1'
+            Address to listen on.
+        `port`: int = 9100
+            Port to listen on, 0 for any free port.
+        `profiler`: SamplingProfiler = None
+            Profiler served on "/profile", `None` to disable it.
+
+        Returns
+        ----------
+        `self`: MetricsServer
+            MetricsServer class object.
+        """
+
+        self.registry = registry
+        self.profiler = profiler
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == '/metrics':
+                    body = server.registry.render()
+                elif self.path == '/profile' and server.profiler is not None:
+                    body = server.profiler.collapsed()
+                else:
+                    self.send_error(404)
+                    return
+
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args) -> None:
+                # Scrapes are frequent, keep them out of the bot log
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self) -> 'MetricsServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,36 +1,108 @@
 # Import necessary dependencies
-import pandas as pd
+import argparse
+import hashlib
+import os
 import pickle
-
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from sklearn.cluster import KMeans
+from typing import TYPE_CHECKING
 
 import numpy as np
 
 from const import *
+from metrics import timed
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Version of the ".npz" model artifact layout, see `save_model_artifact`
+MODEL_FORMAT_VERSION = 3
+
+
+def model_artifact_path(pkl_path: str = None) -> str:
+    """
+    Path of the ".npz" model artifact that belongs to the ".pkl" model at `pkl_path`.
+    """
+
+    return os.path.splitext(pkl_path)[0] + '.npz'
+
+
+def model_digest(pkl_path: str = None) -> str:
+    """
+    Hash of the contents of the ".pkl" model, stored in its ".npz" model artifact
+    and only compared when the size or modification time of the model changed.
+    """
+
+    assert pkl_path is not None, (
+        '`pkl_path` must be specified.'
+    )
+
+    with open(pkl_path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def encode_columns(columns: dict = None) -> dict:
+    """
+    Encode `explicit`, `key`, and `time_signature` raw track features.
+    
+    Shared by `TrackPreprocessor` and `build_catalog.py`, so that the model is
+    trained on exactly the encoding used at query time.
+    
+    Parameters
+    ----------
+    `columns`: dict = None
+        Raw feature values by column name, at least `explicit`, `key`, and `time_signature`.
+    
+    Returns
+    ----------
+    `encoded`: dict
+        `explicit`, `key_sine`, `key_cosine`, and `time_signature` as float arrays.
+    """
+    
+    assert columns is not None, (
+        '`columns` must be specified.'
+    )
+    
+    key = np.asarray(columns['key'], dtype=np.float64)
+    
+    return {
+        'explicit': np.fromiter((1.0 if x else 0.0 for x in columns['explicit']), dtype=np.float64, count=len(columns['explicit'])),
+        'key_sine': np.sin(2 * np.pi * key / 12),
+        'key_cosine': np.cos(2 * np.pi * key / 12),
+        'time_signature': (np.asarray(columns['time_signature'], dtype=np.float64) != 4.0).astype(np.float64)
+    }
+
 
 class TrackPreprocessor():
     """
     Preprocess given track using K-Means clustering and Column Transformer.
     
+    The fitted models are compiled into plain arrays, which are also saved as a
+    ".npz" artifact next to the ".pkl" model. Later starts load the artifact
+    without importing sklearn, and unpickle the models only if `k_means` or
+    `column_transformer` are accessed.
+    
     Attributes
     ----------
     `k_means`: KMeans
-        Clustering model.
+        Clustering model, loaded on first access.
     `column_transformer`: ColumnTransformer
-        Standardizes specific track features.
+        Standardizes specific track features, loaded on first access.
+    `feature_names`: list[str]
+        Order of preprocessed features.
+    `centroids`: np.ndarray
+        Cluster centers of `k_means`.
     """
     
-    def __init__(self, pkl_path: str = None) -> None:
+    def __init__(self, pkl_path: str = None, use_artifact: bool = True) -> None:
         """
         Initialize `TrackPreprocessor` object.
         
         Parameters
         ----------
         `pkl_path`: str = None
-            Path to ".pkl" K-Means model and Column Transformer.
+            Path to ".pkl" K-Means model and Column Transformer, or to its ".npz" model artifact.
+        `use_artifact`: bool = True
+            Load the ".npz" model artifact if it was exported from the ".pkl" model with
+            the same contents, and write it after loading the ".pkl" model otherwise.
         
         Returns
         ----------
@@ -42,13 +114,123 @@ class TrackPreprocessor():
             '`pkl_path` must be specified.'
         )
         
-        with open(pkl_path, 'rb') as f:
-            tools_dict = pickle.load(f)
+        if pkl_path.endswith('.npz'):
+            self.pkl_path, artifact_path = None, pkl_path
+        else:
+            self.pkl_path, artifact_path = pkl_path, model_artifact_path(pkl_path)
+        self._tools = None
+        
+        if use_artifact and os.path.exists(artifact_path):
+            if self._load_artifact(artifact_path):
+                return
+        
+        assert self.pkl_path is not None, (
+            f'{artifact_path} has an unsupported format version.'
+        )
+        
+        self._compile()
+        
+        if use_artifact and self._compiled:
+            self._save_artifact(artifact_path)
+    
+    @property
+    def k_means(self):
+        return self._load_tools().get('k_means')
+    
+    @property
+    def column_transformer(self):
+        return self._load_tools().get('column_transformer')
+    
+    def _load_tools(self) -> dict:
+        if self._tools is None:
+            assert self.pkl_path is not None, (
+                '`pkl_path` to the ".pkl" model must be specified to use sklearn models.'
+            )
+            
+            with open(self.pkl_path, 'rb') as f:
+                self._tools = pickle.load(f)
+        
+        return self._tools
     
-        self.k_means = tools_dict.get('k_means')
-        self.column_transformer = tools_dict.get('column_transformer')
+    def _load_artifact(self, artifact_path: str) -> bool:
+        digest = None
         
-    def preprocess(self, track_data: dict = None) -> pd.DataFrame:
+        with np.load(artifact_path) as artifact:
+            if int(artifact['format_version']) != MODEL_FORMAT_VERSION:
+                return False
+            
+            # Without the ".pkl" model there is nothing to compare the artifact to
+            if self.pkl_path is not None and os.path.exists(self.pkl_path):
+                stat = os.stat(self.pkl_path)
+                if stat.st_size != int(artifact['pkl_size']):
+                    return False
+                # Copies and checkouts change the modification time only, so the contents decide then
+                if stat.st_mtime_ns != int(artifact['pkl_mtime_ns']):
+                    digest = model_digest(self.pkl_path)
+                    if digest != str(artifact['pkl_digest']):
+                        return False
+            
+            self.feature_names = artifact['feature_names'].tolist()
+            self._input_columns = artifact['input_columns'].tolist()
+            self._means = artifact['means']
+            self._scales = artifact['scales']
+            self.centroids = artifact['centroids']
+        
+        self._centroids_squared_norms = (self.centroids ** 2).sum(axis=1)
+        self._compiled = True
+        
+        # Record the new modification time, so the next start does not hash the model again
+        if digest is not None:
+            self._save_artifact(artifact_path, digest)
+        
+        return True
+    
+    def _save_artifact(self, artifact_path: str, digest: str = None) -> None:
+        try:
+            save_model_artifact(self, artifact_path, digest=digest)
+        except OSError:
+            # Read-only model directory, the next start compiles again
+            pass
+    
+    def _compile(self) -> None:
+        """
+        Extract plain arrays from fitted `column_transformer` and `k_means` once,
+        so that preprocessing is pure array math without pandas and sklearn calls.
+        """
+        
+        from sklearn.preprocessing import StandardScaler, FunctionTransformer
+        
+        self.feature_names = list(map(lambda x: x.split('__')[1], self.column_transformer.get_feature_names_out().tolist()))
+        self.centroids = np.asarray(self.k_means.cluster_centers_, dtype=np.float64)
+        self._centroids_squared_norms = (self.centroids ** 2).sum(axis=1)
+        
+        input_columns, means, scales = [], [], []
+        self._compiled = True
+        
+        for _, transformer, columns in self.column_transformer.transformers_:
+            if isinstance(transformer, str) and transformer == 'drop':
+                continue
+            
+            # Fitted `ColumnTransformer` replaces 'passthrough' with an identity `FunctionTransformer`
+            if (isinstance(transformer, str) and transformer == 'passthrough') or (isinstance(transformer, FunctionTransformer) and transformer.func is None):
+                means.append(np.zeros(len(columns)))
+                scales.append(np.ones(len(columns)))
+            elif isinstance(transformer, StandardScaler):
+                # `mean_` is fitted for the variance even if `with_mean=False`, `transform` does not subtract it then
+                means.append(transformer.mean_ if transformer.with_mean and transformer.mean_ is not None else np.zeros(len(columns)))
+                scales.append(transformer.scale_ if transformer.with_std and transformer.scale_ is not None else np.ones(len(columns)))
+            else:
+                # Unknown transformer, keep using `column_transformer` itself
+                self._compiled = False
+                return
+            
+            input_columns.extend(columns)
+        
+        self._input_columns = input_columns
+        self._means = np.concatenate(means).astype(np.float64)
+        self._scales = np.concatenate(scales).astype(np.float64)
+        
+    def preprocess(self, track_data: dict = None) -> 'pd.DataFrame':
         """
         Preprocess features of given track.
         
@@ -67,7 +249,110 @@ class TrackPreprocessor():
             '`track_data` must be specified.'
         )
         
-        target_track_df = pd.DataFrame(data=track_data)
+        if not self._compiled:
+            import pandas as pd
+            return self._preprocess_frame(pd.DataFrame(data=track_data))
+        
+        return self._to_frame(*self.preprocess_array(track_data))
+    
+    def preprocess_many(self, tracks: list[dict] = None) -> 'pd.DataFrame':
+        """
+        Preprocess features of several tracks in one vectorized pass.
+        
+        Parameters
+        ----------
+        `tracks`: list[dict] = None
+            List of dictionaries with all features of every track.
+        
+        Returns
+        ----------
+        `preprocessed_tracks_df`: pd.DataFrame
+            Data frame with all preprocessed track features, one row per track in the order of `tracks`.
+        """
+        
+        assert tracks is not None, (
+            '`tracks` must be specified.'
+        )
+        
+        if not self._compiled:
+            import pandas as pd
+            return self._preprocess_frame(pd.DataFrame.from_records(tracks))
+        
+        return self._to_frame(*self.preprocess_array(tracks))
+    
+    @timed('preprocess')
+    def preprocess_array(self, track_data: dict | list[dict] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Preprocess features of one or several tracks into plain arrays.
+        
+        Parameters
+        ----------
+        `track_data`: dict | list[dict] = None
+            Dictionary with all features of given track (single values or
+            equal-length lists of values), or list of such dictionaries.
+        
+        Returns
+        ----------
+        `features`: np.ndarray
+            Preprocessed features of shape (n_tracks, n_features) in `self.feature_names` order.
+        `clusters`: np.ndarray
+            Cluster of every track.
+        """
+        
+        assert track_data is not None, (
+            '`track_data` must be specified.'
+        )
+        
+        if not self._compiled:
+            import pandas as pd
+            if isinstance(track_data, list):
+                preprocessed_df = self._preprocess_frame(pd.DataFrame.from_records(track_data))
+            else:
+                preprocessed_df = self._preprocess_frame(pd.DataFrame(data=track_data))
+            
+            return preprocessed_df.loc[:, self.feature_names].values, preprocessed_df.loc[:, 'cluster'].values
+        
+        columns = self._to_columns(track_data)
+        
+        # Encode `explicit`, `key`, and `time_signature` the same way `_preprocess_frame` does
+        encoded = encode_columns(columns)
+        
+        features = np.column_stack([encoded[column] if column in encoded else np.asarray(columns[column], dtype=np.float64)
+                                    for column in self._input_columns])
+        features = (features - self._means) / self._scales
+        
+        if not np.isfinite(features).all():
+            raise ValueError('Input X contains NaN.')
+        
+        # Same as `k_means.predict`: the closest centroid in Euclidean distance
+        clusters = np.argmin(self._centroids_squared_norms - 2 * features @ self.centroids.T, axis=1).astype(np.int32)
+        
+        return features, clusters
+    
+    def _to_columns(self, track_data: dict | list[dict]) -> dict:
+        raw_columns = set(self._input_columns) - {'key_sine', 'key_cosine'} | {'key'}
+        
+        if isinstance(track_data, list):
+            return {column: [track.get(column) for track in track_data] for column in raw_columns}
+        
+        if np.ndim(track_data.get('danceability')) == 0:
+            return {column: [track_data.get(column)] for column in raw_columns}
+        
+        return {column: list(track_data.get(column)) for column in raw_columns}
+    
+    def _to_frame(self, features: np.ndarray, clusters: np.ndarray) -> 'pd.DataFrame':
+        # Data frames are only built for callers that ask for them, pandas is slow to import
+        import pandas as pd
+        
+        preprocessed_df = pd.DataFrame(data=features, columns=self.feature_names)
+        preprocessed_df['cluster'] = clusters
+        
+        return preprocessed_df
+    
+    @timed('preprocess_sklearn')
+    def _preprocess_frame(self, target_track_df: 'pd.DataFrame') -> 'pd.DataFrame':
+        # Reference implementation through `column_transformer` and `k_means` themselves
+        import pandas as pd
         
         # Encoder `explicit` column
         target_track_df['explicit'] = target_track_df.loc[:, 'explicit'].apply(lambda x: 1 if x else 0)
@@ -86,4 +371,79 @@ class TrackPreprocessor():
         # Acquire `cluster` for target track
         preprocessed_target_track_df['cluster'] = self.k_means.predict(preprocessed_target_track_df)
         
-        return preprocessed_target_track_df
\ No newline at end of file
+        return preprocessed_target_track_df
+
+
+def save_model_artifact(preprocessor: TrackPreprocessor = None, path: str = None, digest: str = None) -> str:
+    """
+    Save compiled arrays of `preprocessor` as a self-contained ".npz" model artifact,
+    which `TrackPreprocessor` loads without unpickling sklearn models.
+    
+    Parameters
+    ----------
+    `preprocessor`: TrackPreprocessor = None
+        Compiled preprocessor to save.
+    `path`: str = None
+        Path to ".npz" file, `model_artifact_path` of its ".pkl" model by default.
+    `digest`: str = None
+        `model_digest` of the ".pkl" model, computed from `preprocessor.pkl_path` by default.
+        Its size and modification time are stored as well, so that loading only hashes a changed model.
+    
+    Returns
+    ----------
+    `path`: str
+        Path of the saved artifact.
+    """
+    
+    assert preprocessor is not None, (
+        '`preprocessor` must be specified.'
+    )
+    assert preprocessor._compiled, (
+        '`preprocessor` uses a transformer that can not be compiled into plain arrays.'
+    )
+    
+    if path is None:
+        path = model_artifact_path(preprocessor.pkl_path)
+    
+    # Stat before hashing: a model replaced in between is hashed again on the next start
+    stat = os.stat(preprocessor.pkl_path) if preprocessor.pkl_path is not None else None
+    if digest is None and stat is not None:
+        digest = model_digest(preprocessor.pkl_path)
+    
+    # Replace the artifact atomically, like the ".pkl" model
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            format_version=np.int64(MODEL_FORMAT_VERSION),
+            pkl_digest=np.asarray(digest or ''),
+            pkl_size=np.int64(stat.st_size if stat is not None else -1),
+            pkl_mtime_ns=np.int64(stat.st_mtime_ns if stat is not None else -1),
+            input_columns=np.asarray(preprocessor._input_columns, dtype=str),
+            feature_names=np.asarray(preprocessor.feature_names, dtype=str),
+            means=preprocessor._means,
+            scales=preprocessor._scales,
+            centroids=preprocessor.centroids
+        )
+    os.replace(path + '.tmp', path)
+    
+    return path
+
+
+def export_model_artifact(pkl_path: str = None) -> str:
+    """
+    Compile the ".pkl" model at `pkl_path` and save its ".npz" model artifact next to it.
+    """
+    
+    assert pkl_path is not None, (
+        '`pkl_path` must be specified.'
+    )
+    
+    return save_model_artifact(TrackPreprocessor(pkl_path=pkl_path, use_artifact=False), model_artifact_path(pkl_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export ".npz" model artifact that loads without sklearn.')
+    parser.add_argument('--pkl', default='../models/k_means.pkl', help='Path to ".pkl" K-Means model and Column Transformer.')
+    args = parser.parse_args()
+    
+    print(export_model_artifact(args.pkl))
@@ -0,0 +1,484 @@
+# Import necessary dependencies
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Awaitable, Callable
+
+from metrics import REGISTRY
+
+# Scheduling lanes in the order they are served
+LANES = ['interactive', 'background']
+
+# HTTP statuses worth retrying: rate limited and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Lane and deadline of requests made in the current context, see `scheduling`
+_CONTEXT = contextvars.ContextVar('scheduling', default=(None, None))
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when a request is shed because its deadline passes before it can be sent or retried.
+    """
+
+
+def retry_after(status: int = None, headers: dict = None) -> float | None:
+    """
+    Seconds to wait before retrying a response with `status`.
+
+    Parameters
+    ----------
+    `status`: int = None
+        HTTP status of the response, `None` if there is no response.
+    `headers`: dict = None
+        Headers of the response.
+
+    Returns
+    ----------
+    `seconds`: float | None
+        `Retry-After` of a rate limited response, 0 to retry with backoff,
+        `None` if the request must not be retried.
+    """
+
+    if status not in RETRY_STATUSES:
+        return None
+
+    if status == 429:
+        try:
+            return max(float((headers or {}).get('Retry-After', 1)), 0.0)
+        except ValueError:
+            # HTTP-date form, Spotify sends seconds
+            return 1.0
+
+    return 0.0
+
+
+@contextlib.contextmanager
+def scheduling(lane: str = None, timeout: float = None):
+    """
+    Set the lane and deadline of requests made in this block, including coroutines
+    and `asyncio.to_thread` calls started from it. Nested blocks keep the earlier deadline.
+
+    Parameters
+    ----------
+    `lane`: str = None
+        One of `LANES`, `None` to keep the lane of the enclosing block ('interactive' by default).
+    `timeout`: float = None
+        Seconds until requests of this block are shed, `None` to keep the enclosing deadline.
+    """
+
+    assert lane is None or lane in LANES, (
+        f'`lane` must be one of {LANES}.'
+    )
+
+    outer_lane, deadline = _CONTEXT.get()
+    if timeout is not None:
+        deadline = min(deadline or float('inf'), time.monotonic() + timeout)
+
+    token = _CONTEXT.set((lane or outer_lane, deadline))
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+def current_scheduling() -> tuple[str | None, float | None]:
+    """
+    Lane and deadline (`time.monotonic()`) of requests made in the current context, see `scheduling`.
+    """
+
+    return _CONTEXT.get()
+
+
+def shared_scheduling(contexts: list[tuple] = None):
+    """
+    `scheduling` block of one request sent on behalf of several callers, e.g. a batch.
+
+    The request takes the most urgent lane of the callers and the latest deadline,
+    no deadline if any caller has none, so it is not shed while a caller still waits.
+
+    Parameters
+    ----------
+    `contexts`: list[tuple] = None
+        `current_scheduling` of every caller.
+    """
+
+    assert contexts is not None, (
+        '`contexts` must be specified.'
+    )
+
+    lanes = [lane or LANES[0] for lane, _ in contexts]
+    deadlines = [deadline for _, deadline in contexts]
+    deadline = None if not deadlines or None in deadlines else max(deadlines)
+
+    return scheduling(
+        lane=min(lanes, key=LANES.index) if lanes else None,
+        timeout=None if deadline is None else deadline - time.monotonic()
+    )
+
+
+class TokenBucket():
+    """
+    Token bucket that refills `rate` tokens per second up to `burst` tokens.
+
+    Not thread-safe, `RequestScheduler` guards it with its own lock.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 10) -> None:
+        assert rate > 0 and burst >= 1, (
+            '`rate` must be positive and `burst` at least 1.'
+        )
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """
+        Seconds until one token is available, 0 if it is available now.
+        """
+
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0.0) * self.rate)
+        self.updated = max(now, self.updated)
+
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def drain(self, until: float) -> None:
+        """
+        Start refilling from empty at `until`, so a pause does not end with a burst.
+        """
+
+        self.tokens = 0.0
+        self.updated = max(until, self.updated)
+
+
+class _Ticket():
+    __slots__ = ('lane', 'deadline', 'enqueued', 'wake', 'cancelled')
+
+    def __init__(self, lane: str, deadline: float, wake: Callable[[bool], None]) -> None:
+        self.lane = lane
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.wake = wake
+        self.cancelled = False
+
+
+class RequestScheduler():
+    """
+    Central scheduler of outgoing requests to one rate-limited API.
+
+    Requests wait in priority lanes and a dispatcher thread releases them one
+    token at a time, 'interactive' ahead of 'background' and in arrival order
+    within a lane. A rate limited response pauses all lanes for its `Retry-After`,
+    other transient errors are retried with jittered exponential backoff.
+    Requests whose deadline passes while they wait are shed instead of sent.
+
+    Attributes
+    ----------
+    `bucket`: TokenBucket
+        Rate limit of released requests.
+    `max_retries`: int
+        The amount of retries of one request.
+    `backoff`: float
+        Upper bound of the first retry delay in seconds, doubled on every retry.
+    `max_backoff`: float
+        Upper bound of any retry delay in seconds.
+    `depths`: dict[str, int]
+        The amount of waiting requests of every lane.
+    `n_requests`: int
+        The amount of released requests, retries included.
+    `n_shed`: int
+        The amount of requests shed on their deadline.
+    `n_throttled`: int
+        The amount of rate limited responses.
+    `n_retries`: int
+        The amount of retried requests.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: int = 10,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        name: str = 'spotify'
+    ) -> None:
+        """
+        Initialize `RequestScheduler` object, its dispatcher thread starts on the first request.
+
+        Parameters
+        ----------
+        `rate`: float = 10.0
+            Requests per second released on average.
+        `burst`: int = 10
+            Requests released at once after an idle period.
+        `max_retries`: int = 3
+            The amount of retries of one request.
+        `backoff`: float = 0.5
+            Upper bound of the first retry delay in seconds, doubled on every retry.
+        `max_backoff`: float = 30.0
+            Upper bound of any retry delay in seconds.
+        `name`: str = 'spotify'
+            Prefix of the queue metrics in `metrics.REGISTRY`.
+
+        Returns
+        ----------
+        `self`: RequestScheduler
+            RequestScheduler class object.
+        """
+
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name
+
+        self.depths = dict.fromkeys(LANES, 0)
+        self.n_requests = 0
+        self.n_shed = 0
+        self.n_throttled = 0
+        self.n_retries = 0
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+        for lane in LANES:
+            REGISTRY.gauge(f'{name}_queue_depth_{lane}', lambda lane=lane: self.depths[lane], 'gauge', f'Requests waiting in the {lane} lane.')
+        REGISTRY.gauge(f'{name}_requests_total', lambda: self.n_requests, 'counter', 'Released requests, retries included.')
+        REGISTRY.gauge(f'{name}_shed_total', lambda: self.n_shed, 'counter', 'Requests shed on their deadline.')
+        REGISTRY.gauge(f'{name}_throttled_total', lambda: self.n_throttled, 'counter', 'Rate limited responses.')
+        REGISTRY.gauge(f'{name}_retries_total', lambda: self.n_retries, 'counter', 'Retried requests.')
+
+    def stats(self) -> dict:
+        """
+        Queue depths and counters of the scheduler.
+        """
+
+        with self._cond:
+            return {
+                'depths': dict(self.depths),
+                'requests': self.n_requests,
+                'shed': self.n_shed,
+                'throttled': self.n_throttled,
+                'retries': self.n_retries,
+                'paused_for': max(self._paused_until - time.monotonic(), 0.0)
+            }
+
+    def pause(self, seconds: float = None) -> None:
+        """
+        Release nothing for `seconds`, e.g. the `Retry-After` of a rate limited response.
+        """
+
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.bucket.drain(self._paused_until)
+            self._cond.notify()
+
+    def acquire(self, lane: str = None, deadline: float = None) -> None:
+        """
+        Wait until the scheduler releases one request of `lane`.
+
+        Parameters
+        ----------
+        `lane`: str = None
+            One of `LANES`, 'interactive' by default.
+        `deadline`: float = None
+            `time.monotonic()` after which the request is shed, `None` to wait indefinitely.
+        """
+
+        released = threading.Event()
+        granted = []
+
+        def wake(result: bool) -> None:
+            granted.append(result)
+            released.set()
+
+        self._enqueue(lane, deadline, wake)
+        released.wait()
+
+        if not granted[0]:
+            raise DeadlineExceededError('Request was shed on its deadline.')
+
+    async def aacquire(self, lane: str = None, deadline: float = None) -> None:
+        """
+        Coroutine version of `acquire`, a cancelled waiter is shed.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result: bool) -> None:
+            if not future.done():
+                future.set_result(result)
+
+        def wake(result: bool) -> None:
+            try:
+                loop.call_soon_threadsafe(resolve, result)
+            except RuntimeError:
+                # The event loop of the waiter is already closed
+                pass
+
+        ticket = self._enqueue(lane, deadline, wake)
+
+        try:
+            granted = await future
+        except asyncio.CancelledError:
+            ticket.cancelled = True
+            with self._cond:
+                self._cond.notify()
+            raise
+
+        if not granted:
+            raise DeadlineExceededError('Request was shed on its deadline.')
+
+    def call(self, function: Callable[[], object] = None, retry_after: Callable[[Exception], float | None] = None):
+        """
+        Send a request in the lane and with the deadline of the current `scheduling` block.
+
+        Parameters
+        ----------
+        `function`: Callable[[], object] = None
+            Function that sends the request.
+        `retry_after`: Callable[[Exception], float | None] = None
+            Maps an error of `function` to seconds of `Retry-After`, 0 to retry with backoff
+            or `None` to raise it, see `rate_limit.retry_after`. `None` never retries.
+
+        Returns
+        ----------
+        `result`: object
+            Result of `function`.
+        """
+
+        assert function is not None, (
+            '`function` must be specified.'
+        )
+
+        lane, deadline = _CONTEXT.get()
+
+        for attempt in itertools.count():
+            self.acquire(lane, deadline)
+            try:
+                return function()
+            except Exception as e:
+                delay = self._retry_delay(e, retry_after, attempt, deadline)
+                if delay is None:
+                    raise
+
+            time.sleep(delay)
+
+    async def acall(self, function: Callable[[], Awaitable] = None, retry_after: Callable[[Exception], float | None] = None):
+        """
+        Coroutine version of `call`, `function` returns the awaitable that sends the request.
+        """
+
+        assert function is not None, (
+            '`function` must be specified.'
+        )
+
+        lane, deadline = _CONTEXT.get()
+
+        for attempt in itertools.count():
+            await self.aacquire(lane, deadline)
+            try:
+                return await function()
+            except Exception as e:
+                delay = self._retry_delay(e, retry_after, attempt, deadline)
+                if delay is None:
+                    raise
+
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, retry_after: Callable[[Exception], float | None], attempt: int, deadline: float) -> float | None:
+        wait = retry_after(error) if retry_after is not None else None
+        if wait is None or attempt >= self.max_retries:
+            return None
+
+        with self._cond:
+            if wait > 0:
+                # Rate limited: hold every lane, the request waits in the queue
+                self.n_throttled += 1
+                self.pause(wait)
+                delay = 0.0
+            else:
+                # Full jitter, so failed requests do not come back in lockstep
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+            if deadline is not None and time.monotonic() + max(wait, delay) >= deadline:
+                self.n_shed += 1
+                raise DeadlineExceededError('Request would be retried after its deadline.') from error
+
+            self.n_retries += 1
+
+        return delay
+
+    def _enqueue(self, lane: str, deadline: float, wake: Callable[[bool], None]) -> _Ticket:
+        lane = lane or LANES[0]
+
+        assert lane in LANES, (
+            f'`lane` must be one of {LANES}.'
+        )
+
+        ticket = _Ticket(lane, deadline, wake)
+
+        with self._cond:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._run, name=f'{self.name}-scheduler', daemon=True)
+                self._dispatcher.start()
+
+            heapq.heappush(self._queue, (LANES.index(lane), next(self._seq), ticket))
+            self.depths[lane] += 1
+            self._cond.notify()
+
+        return ticket
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic()
+                ticket = self._queue[0][2]
+
+                # The waiter gave up, or would only be released after its deadline
+                if ticket.cancelled or (ticket.deadline is not None and max(now, self._paused_until) >= ticket.deadline):
+                    heapq.heappop(self._queue)
+                    self.n_shed += 1
+                    self._release(ticket, False, now)
+                    continue
+
+                wait = self._paused_until - now
+                if wait <= 0:
+                    wait = self.bucket.wait_time(now)
+
+                if wait > 0:
+                    # New requests (of a higher lane) and cancellations wake the dispatcher earlier
+                    self._cond.wait(wait if ticket.deadline is None else min(wait, ticket.deadline - now))
+                    continue
+
+                self.bucket.take()
+                heapq.heappop(self._queue)
+                self.n_requests += 1
+                self._release(ticket, True, now)
+
+    def _release(self, ticket: _Ticket, granted: bool, now: float) -> None:
+        self.depths[ticket.lane] -= 1
+
+        if REGISTRY.enabled:
+            REGISTRY.observe(f'{self.name}_queue_wait_{ticket.lane}', now - ticket.enqueued, not granted)
+
+        ticket.wake(granted)
@@ -0,0 +1,234 @@
+# Import necessary dependencies
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+from search_cache import LRUCache, MISSING
+
+
+class RecommendationCache():
+    """
+    Cache of recommendation results with single-flight deduplication.
+
+    Concurrent requests with the same key wait on one computation instead of
+    running it once each. The cache is cleared automatically when any of the
+    watched files (model pickle, track store) changes.
+
+    Attributes
+    ----------
+    `results`: LRUCache
+        Cached results.
+    `n_computed`: int
+        The amount of computations actually run.
+    `n_coalesced`: int
+        The amount of requests that waited on a computation started by another request.
+    `n_invalidations`: int
+        The amount of times the cache was cleared because watched files changed.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 600, check_interval: float = 1.0) -> None:
+        """
+        Initialize `RecommendationCache` object.
+
+        Parameters
+        ----------
+        `max_size`: int = 10_000
+            The amount of cached results.
+        `ttl`: float = 600
+            Seconds a result stays valid.
+        `check_interval`: float = 1.0
+            Minimum seconds between two checks of watched files.
+
+        Returns
+        ----------
+        `self`: RecommendationCache
+            RecommendationCache class object.
+        """
+
+        self.results = LRUCache(max_size=max_size, ttl=ttl)
+        self.check_interval = check_interval
+        self.n_computed = 0
+        self.n_coalesced = 0
+        self.n_invalidations = 0
+
+        self._watched_paths = []
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._in_flight_async = {}
+
+    def watch(self, paths: list[str] = None) -> None:
+        """
+        Clear the cache whenever any of `paths` changes.
+
+        Parameters
+        ----------
+        `paths`: list[str] = None
+            Files or directories to watch, e.g. the model pickle and the track store.
+        """
+
+        assert paths is not None, (
+            '`paths` must be specified.'
+        )
+
+        self._watched_paths.extend(paths)
+        self._fingerprint = self._compute_fingerprint()
+
+    def clear(self) -> None:
+        self.results.clear()
+
+    def _compute_fingerprint(self) -> tuple:
+        fingerprint = []
+        for path in self._watched_paths:
+            entries = os.scandir(path) if os.path.isdir(path) else [path]
+            for entry in entries:
+                try:
+                    stat = os.stat(entry)
+                except FileNotFoundError:
+                    continue
+                fingerprint.append((os.fspath(entry), stat.st_mtime_ns, stat.st_size))
+
+        return tuple(sorted(fingerprint))
+
+    def _check_watched_paths(self) -> None:
+        now = time.monotonic()
+        if not self._watched_paths or now - self._checked_at < self.check_interval:
+            return
+
+        self._checked_at = now
+        fingerprint = self._compute_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.n_invalidations += 1
+            self.clear()
+
+    def get_or_compute(self, key, compute: Callable = None):
+        """
+        Return the cached result for `key` or compute it once for all concurrent callers.
+
+        Parameters
+        ----------
+        `key`: Hashable
+            Cache key, e.g. (track id, top_k, options).
+        `compute`: Callable = None
+            Function without arguments that computes the result.
+
+        Returns
+        ----------
+        `result`
+            Cached or computed result.
+        """
+
+        assert compute is not None, (
+            '`compute` must be specified.'
+        )
+
+        self._check_watched_paths()
+
+        # Looked up under the lock, so a computation that finishes in between is not started again
+        with self._lock:
+            result = self.results.get(key)
+            if result is not MISSING:
+                return result
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                self.n_computed += 1
+            else:
+                self.n_coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+            self.results.set(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def aget_or_compute(self, key, compute: Callable[[], Awaitable] = None, store: bool = True):
+        """
+        Coroutine version of `get_or_compute`.
+
+        Parameters
+        ----------
+        `key`: Hashable
+            Cache key, e.g. (track id, top_k, options).
+        `compute`: Callable[[], Awaitable] = None
+            Coroutine function without arguments that computes the result.
+        `store`: bool = True
+            `False` to only deduplicate concurrent computations without caching the result.
+
+        Returns
+        ----------
+        `result`
+            Cached or computed result.
+        """
+
+        assert compute is not None, (
+            '`compute` must be specified.'
+        )
+
+        if store:
+            self._check_watched_paths()
+
+            result = self.results.get(key)
+            if result is not MISSING:
+                return result
+
+        task = self._in_flight_async.get(key)
+        if task is not None:
+            self.n_coalesced += 1
+        else:
+            # The computation runs in a task of its own, so cancelling the caller that started it
+            # does not cancel it for the callers that joined later, and in a fresh context, so it
+            # is not shed with the deadline of that caller
+            task = self._in_flight_async[key] = asyncio.get_running_loop().create_task(
+                self._acompute(key, compute, store), context=contextvars.Context()
+            )
+            # Mark the exception as retrieved when nobody waits on it anymore
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        # `shield`, so a cancelled waiter does not cancel the shared computation
+        return await asyncio.shield(task)
+
+    async def _acompute(self, key, compute: Callable[[], Awaitable], store: bool):
+        try:
+            self.n_computed += 1
+            result = await compute()
+            if store:
+                self.results.set(key, result)
+            return result
+        finally:
+            del self._in_flight_async[key]
+
+    def stats(self) -> dict:
+        """
+        Hit ratio and saved computation counters.
+        """
+
+        lookups = self.results.hits + self.results.misses
+
+        return {
+            'hits': self.results.hits,
+            'misses': self.results.misses,
+            'hit_ratio': self.results.hits / lookups if lookups else 0.0,
+            'computed': self.n_computed,
+            'coalesced': self.n_coalesced,
+            'saved': self.results.hits + self.n_coalesced,
+            'invalidations': self.n_invalidations,
+            'size': len(self.results)
+        }
@@ -1,10 +1,35 @@
 # Import necessary dependencies
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+import asyncio
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
 
 from search import TrackSearchEngine
+from async_search import AsyncTrackSearchEngine
+from scoring_pool import ScoringPool
+from recommendation_cache import RecommendationCache
+from search_cache import SpotifyCache
+from rate_limit import RequestScheduler, scheduling
+from user_profiles import UserProfile, UserProfileStore
+from catalog_search import normalize_text, parse_artists
 from const import *
 from preprocessor import TrackPreprocessor
+from catalog import Catalog, CatalogSnapshot, BackgroundCompactor
+from retrieval import open_snapshot, ann_index_path
+from metrics import span, timed
+from track_index import probe_clusters, normalize, normalize_rows, mmr_rerank, top_k_positions
+from track_store import track_hashes
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Candidates per recommended track re-ranked by the taste of the user
+PERSONAL_CANDIDATES = 4
+# Upper bound of extra candidates that replace tracks the user has already seen
+MAX_SKIPPED_CANDIDATES = 256
+
 
 class RecSys():
     """
@@ -18,12 +43,42 @@ class RecSys():
         Client Secret from Spotify.
     `pkl_path`: str = '../models/k_means.pkl'
         Path to ".pkl" K-Means model and Column Transformer.
-    `db_path`: str = '../data/preprocessed_audio_features_clusters.csv'
-        Path to ".csv" file that contains all preprocessed tracks.
+    `db_path`: str = '../data/track_store'
+        Path to the track store that contains all preprocessed tracks (see `track_store.py`).
+    `spotify_cache`: SpotifyCache = None
+        Cache of Spotify lookups.
+    `spotify_batch_window`: float = None
+        Seconds to collect concurrent audio feature requests into one Spotify call.
+    `spotify_scheduler`: RequestScheduler
+        Rate limits and retries Spotify requests of both search engines.
+    `scoring_pool`: ScoringPool = None
+        Workers that score `arecommend` queries off the event loop.
+    `recommendation_cache`: RecommendationCache = None
+        Cache of results keyed on resolved track id and options.
+    `profile_store`: UserProfileStore = None
+        Taste and recently recommended tracks of every user.
+    `personalization`: float = 0.3
+        Weight of the taste of the user against similarity to the seed track.
+    `retrieval`: str = 'cluster_scan'
+        Retrieval backend, one of `retrieval.RETRIEVAL_BACKENDS`.
+    `catalog`: Catalog
+        Versioned track catalog at `db_path`.
+    `compactor`: BackgroundCompactor
+        Compacts `catalog` in the background, `None` if this process does not compact.
+    `snapshot`: CatalogSnapshot
+        Catalog version used by new requests, swapped atomically when the catalog changes.
+    `track_store`: TrackStore
+        Memory-mapped features, clusters and metadata of all preprocessed tracks of `snapshot`.
+    `track_index`: ClusterIndex
+        L2-normalized features of all tracks of `snapshot` grouped by cluster.
+    `name_index`: CatalogNameIndex
+        Title index of `snapshot`, `None` if local lookup is disabled.
     `track_preprocessor`: TrackPreprocessor
         Module for preprocessing new tracks.
     `search_engine`: TrackSearchEngine
         Search engine to retrieve features for new tracks based on Spotify API.
+    `async_search_engine`: AsyncTrackSearchEngine
+        Non-blocking search engine used by `arecommend`.
     """
     
     def __init__(
@@ -31,7 +86,21 @@ class RecSys():
         client_id: str = None,
         client_secret: str = None,
         pkl_path: str = '../models/k_means.pkl',
-        db_path: str = '../data/preprocessed_audio_features_clusters.csv'
+        db_path: str = '../data/track_store',
+        spotify_cache: SpotifyCache = None,
+        spotify_batch_window: float = None,
+        spotify_scheduler: RequestScheduler = None,
+        scoring_pool: ScoringPool = None,
+        recommendation_cache: RecommendationCache = None,
+        profile_store: UserProfileStore = None,
+        personalization: float = 0.3,
+        local_lookup: bool = True,
+        refresh_interval: float = 1.0,
+        compaction_interval: float = None,
+        retrieval: str = 'cluster_scan',
+        ann_path: str = None,
+        retrieval_options: dict = None,
+        precision: str = 'float32'
     ) -> None:
         """
         Initialize `RecSys` class.
@@ -44,8 +113,41 @@ class RecSys():
             Client Secret from Spotify.
         `pkl_path`: str = '../models/k_means.pkl'
             Path to ".pkl" K-Means model and Column Transformer.
-        `db_path`: str = '../data/preprocessed_audio_features_clusters.csv'
-            Path to ".csv" file that contains all preprocessed tracks.
+        `db_path`: str = '../data/track_store'
+            Path to the track store that contains all preprocessed tracks (see `track_store.py`).
+        `spotify_cache`: SpotifyCache = None
+            Cache of Spotify lookups, `None` to disable caching.
+        `spotify_batch_window`: float = None
+            Seconds to collect concurrent audio feature requests into one Spotify call, `None` to disable batching.
+        `spotify_scheduler`: RequestScheduler = None
+            Scheduler of all Spotify requests, `None` for a default `RequestScheduler`.
+        `scoring_pool`: ScoringPool = None
+            Workers that score `arecommend` queries off the event loop, `None` to score in the calling thread.
+        `recommendation_cache`: RecommendationCache = None
+            Cache of results keyed on resolved track id and options, `None` to disable caching.
+            It is cleared whenever `pkl_path` or `db_path` changes.
+        `profile_store`: UserProfileStore = None
+            Per-user profiles used by requests with `user_id`, `None` to disable personalization.
+        `personalization`: float = 0.3
+            Weight of the taste of the user against similarity to the seed track, between 0 and 1.
+        `local_lookup`: bool = True
+            Resolve track names that are confidently found in the track store locally,
+            using their stored features instead of calling Spotify.
+        `refresh_interval`: float = 1.0
+            Minimum seconds between two checks for a new catalog version.
+        `compaction_interval`: float = None
+            Seconds between two checks whether the catalog needs compaction, `None` to not
+            compact in this process. Only one process may update a catalog.
+        `retrieval`: str = 'cluster_scan'
+            'cluster_scan' to scan the K-Means clusters of the query exactly,
+            'ivf_pq' to search the approximate nearest neighbour index (see `retrieval.py`).
+        `ann_path`: str = None
+            Path to the ANN index, `None` for "ann_index" next to `pkl_path`.
+        `retrieval_options`: dict = None
+            Options of the retrieval backend, e.g. `{'n_probe': 8, 'rerank': 4}` for 'ivf_pq'.
+        `precision`: str = 'float32'
+            'float32' to scan clusters in full precision, 'int8' to scan quantized
+            features and re-rank only the shortlist in full precision.
         
         Returns
         ----------
@@ -58,15 +160,194 @@ class RecSys():
         )
         
         self.track_preprocessor = TrackPreprocessor(pkl_path=pkl_path)
-        self.track_db = pd.read_csv(db_path, index_col='Unnamed: 0')
-        self.track_db_features = self.track_db.drop(labels=['id', 'name', 'album', 'album_id', 'artists', 'artist_ids', 'track_number'], axis=1)
+        self.scoring_pool = scoring_pool
+        
+        self.profile_store = profile_store
+        self.personalization = personalization
+        
+        self.recommendation_cache = recommendation_cache
+        if recommendation_cache is not None:
+            recommendation_cache.watch([pkl_path, db_path])
+        
+        self.local_lookup = local_lookup
+        self.refresh_interval = refresh_interval
+        self.retrieval = retrieval
+        self.ann_path = ann_path or ann_index_path(pkl_path)
+        self.retrieval_options = retrieval_options or {}
+        self.precision = precision
+        self.catalog = Catalog(db_path, centroids=self.track_preprocessor.centroids)
+        self.snapshot = self._open_snapshot()
+        self._refreshed_at = time.monotonic()
+        self._refresh_lock = threading.Lock()
+        
+        # New versions are picked up by `refresh` like any other update
+        self.compactor = BackgroundCompactor(self.catalog, interval=compaction_interval).start() if compaction_interval is not None else None
+        
+        assert self.track_preprocessor.feature_names == self.track_store.feature_names, (
+            'Features of the model and the track store must be in the same order.'
+        )
+        
+        # One scheduler for both engines, so they share the Spotify rate limit
+        self.spotify_scheduler = spotify_scheduler if spotify_scheduler is not None else RequestScheduler()
         
         self.search_engine = TrackSearchEngine(
             client_id=client_id,
-            client_secret=client_secret
+            client_secret=client_secret,
+            cache=spotify_cache,
+            batch_window=spotify_batch_window,
+            scheduler=self.spotify_scheduler
+        )
+        
+        self.async_search_engine = AsyncTrackSearchEngine(
+            client_id=client_id,
+            client_secret=client_secret,
+            cache=spotify_cache,
+            batch_window=spotify_batch_window,
+            scheduler=self.spotify_scheduler
         )
+    
+    @property
+    def track_store(self):
+        return self.snapshot.store
+    
+    @property
+    def track_index(self):
+        return self.snapshot.index
+    
+    @property
+    def name_index(self):
+        return self.snapshot.name_index
+    
+    def _open_snapshot(self, version: int = None) -> CatalogSnapshot:
+        return open_snapshot(
+            self.catalog, version, name_index=self.local_lookup, precision=self.precision,
+            retrieval=self.retrieval, ann_path=self.ann_path, **self.retrieval_options
+        )
+    
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Switch to the current catalog version if it changed.
+        
+        Requests already running keep the snapshot they started with, new ones
+        use the new snapshot, so no request sees a mix of two versions.
+        
+        Parameters
+        ----------
+        `force`: bool = False
+            Check now even if `refresh_interval` has not passed since the last check.
+        
+        Returns
+        ----------
+        `swapped`: bool
+            Whether a new version was loaded.
+        """
+        
+        if not self._refresh_due(force) or self.catalog.current_version() == self.snapshot.version:
+            return False
+        
+        with self._refresh_lock:
+            snapshot = self._newer_snapshot()
+            if snapshot is None:
+                return False
+            
+            self._swap(snapshot)
         
-    def recommend(self, track_name: str = None, top_k: int = 5) -> pd.DataFrame:
+        return True
+    
+    async def arefresh(self, force: bool = False) -> bool:
+        """
+        Coroutine version of `refresh`. The new version is loaded in a thread and only swapped in on the event loop.
+        """
+        
+        if not self._refresh_due(force):
+            return False
+        
+        snapshot = await asyncio.to_thread(self._newer_snapshot)
+        # A newer version may have been swapped in meanwhile, e.g. by `add_tracks`
+        if snapshot is None or snapshot.version <= self.snapshot.version:
+            return False
+        
+        self._swap(snapshot)
+        
+        return True
+    
+    def _refresh_due(self, force: bool) -> bool:
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < self.refresh_interval:
+            return False
+        self._refreshed_at = now
+        
+        return True
+    
+    def _newer_snapshot(self) -> CatalogSnapshot | None:
+        version = self.catalog.current_version()
+        if version == self.snapshot.version:
+            return None
+        
+        try:
+            return self._open_snapshot(version)
+        except FileNotFoundError:
+            # Pruned by a compaction between reading `CURRENT` and loading it, retry on the next check
+            return None
+    
+    def close(self) -> None:
+        """
+        Stop background compaction, waiting for a compaction in progress to finish.
+        """
+        
+        if self.compactor is not None:
+            self.compactor.stop()
+    
+    def _swap(self, snapshot: CatalogSnapshot) -> None:
+        self.snapshot = snapshot
+        
+        if self.recommendation_cache is not None:
+            self.recommendation_cache.clear()
+    
+    def add_tracks(self, tracks: list[dict] = None) -> int:
+        """
+        Add tracks to the catalog (replacing tracks with the same ids) and switch to the new version.
+        
+        Parameters
+        ----------
+        `tracks`: list[dict] = None
+            Tracks in the format of `TrackSearchEngine.format_track`.
+        
+        Returns
+        ----------
+        `version`: int
+            The new catalog version.
+        """
+        
+        with self._refresh_lock:
+            snapshot = self.catalog.add_tracks(tracks, preprocessor=self.track_preprocessor)
+            self._swap(self._open_snapshot(snapshot.version))
+        
+        return snapshot.version
+    
+    def remove_tracks(self, track_ids: list[str] = None) -> int:
+        """
+        Remove tracks from the catalog by Spotify id and switch to the new version.
+        
+        Parameters
+        ----------
+        `track_ids`: list[str] = None
+            Spotify ids of tracks to remove.
+        
+        Returns
+        ----------
+        `version`: int
+            The new catalog version.
+        """
+        
+        with self._refresh_lock:
+            snapshot = self.catalog.remove_tracks(track_ids)
+            self._swap(self._open_snapshot(snapshot.version))
+        
+        return snapshot.version
+    
+    @timed('recommend')
+    def recommend(self, track_name: str = None, top_k: int = 5, n_probe: int = 1, user_id: int = None) -> 'pd.DataFrame':
         """
         Recommend `top_k` tracks from `self.db_path` using K-Means clustering.
         
@@ -76,6 +357,12 @@ class RecSys():
             The name of the track.
         `top_k`: int = 5
             The amount of most similar tracks to retrieve.
+        `n_probe`: int = 1
+            The amount of closest K-Means clusters to search in.
+        `user_id`: int = None
+            ID of the user to personalize for with `profile_store`: candidates are re-ranked by
+            the taste of the user, tracks already recommended to the user are skipped, and the
+            seed track and the recommended tracks are added to the profile.
         
         Returns
         ----------
@@ -87,17 +374,545 @@ class RecSys():
             "`track_name` must be specified."
         )
         
-        f = self.search_engine.find_track_features(track_name)
+        self.refresh()
+        snapshot = self.snapshot
+        
+        seed = self._local_seed(snapshot, track_name)
+        if seed is None:
+            f = self.search_engine.find_track_features(track_name)
+            seed = self._spotify_seed(self.search_engine.format_track(f))
+        
+        track_id, query, cluster = seed
+        
+        if user_id is not None and self.profile_store is not None:
+            profile = self.profile_store.get(user_id)
+            rows, similarity = self._candidates(snapshot, track_id, query, cluster, top_k, n_probe)
+            rows, track_ids = self._personalize(snapshot, profile, query, rows, similarity, top_k)
+            self.profile_store.update(user_id, features=query, seen=track_ids)
+            
+            with span('metadata'):
+                return snapshot.store.metadata(rows, columns=['name', 'album', 'artists', 'track_number'])
+        
+        if self.recommendation_cache is None:
+            return self._recommend_track(snapshot, query, cluster, top_k, n_probe)
+        
+        return self.recommendation_cache.get_or_compute(
+            key=(snapshot.version, track_id, top_k, n_probe),
+            compute=lambda: self._recommend_track(snapshot, query, cluster, top_k, n_probe)
+        ).copy()
+    
+    @timed('arecommend')
+    async def arecommend(self, track_name: str = None, top_k: int = 5, n_probe: int = 1, user_id: int = None) -> 'pd.DataFrame':
+        """
+        Coroutine version of `recommend` that does not block the event loop on Spotify lookups.
+        With `scoring_pool` set, scoring runs in its workers as well.
+        
+        Parameters
+        ----------
+        `track_name`: str = None
+            The name of the track.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve.
+        `n_probe`: int = 1
+            The amount of closest K-Means clusters to search in.
+        `user_id`: int = None
+            ID of the user to personalize for with `profile_store`: candidates are re-ranked by
+            the taste of the user, tracks already recommended to the user are skipped, and the
+            seed track and the recommended tracks are added to the profile.
+        
+        Returns
+        ----------
+        `result`: pd.DataFrame
+            A Data frame that contains `name`, `album`, `artists`, and `track_number` of retrieved tracks.
+        """
+        
+        assert track_name is not None, (
+            "`track_name` must be specified."
+        )
+        
+        await self.arefresh()
+        snapshot = self.snapshot
+        
+        if user_id is not None and self.profile_store is not None:
+            return await self._arecommend_personal(snapshot, track_name, top_k, n_probe, user_id)
+        
+        if self.recommendation_cache is None:
+            return await self._arecommend(snapshot, track_name, top_k, n_probe)
+        
+        # Identical concurrent requests share one Spotify lookup as well
+        result = await self.recommendation_cache.aget_or_compute(
+            key=('query', snapshot.version, ' '.join(track_name.lower().split()), top_k, n_probe),
+            compute=lambda: self._arecommend(snapshot, track_name, top_k, n_probe),
+            store=False
+        )
+        
+        return result.copy()
+    
+    async def _aseed(self, snapshot: CatalogSnapshot, track_name: str) -> tuple[str, np.ndarray, int]:
+        # The fuzzy lookup of a miss reads posting lists of the name index
+        seed = await asyncio.to_thread(self._local_seed, snapshot, track_name)
+        if seed is None:
+            f = await self.async_search_engine.find_track_features(track_name)
+            seed = self._spotify_seed(self.async_search_engine.format_track(f))
+        
+        return seed
+    
+    async def _arecommend(self, snapshot: CatalogSnapshot, track_name: str, top_k: int, n_probe: int) -> 'pd.DataFrame':
+        track_id, query, cluster = await self._aseed(snapshot, track_name)
+        
+        if self.recommendation_cache is None:
+            return await self._arecommend_track(snapshot, query, cluster, top_k, n_probe)
+        
+        return await self.recommendation_cache.aget_or_compute(
+            key=(snapshot.version, track_id, top_k, n_probe),
+            compute=lambda: self._arecommend_track(snapshot, query, cluster, top_k, n_probe)
+        )
+    
+    async def _arecommend_track(self, snapshot: CatalogSnapshot, query: np.ndarray, cluster: int, top_k: int, n_probe: int) -> 'pd.DataFrame':
+        if self.scoring_pool is None:
+            return self._recommend_track(snapshot, query, cluster, top_k, n_probe)
+        
+        clusters = self._clusters(query, cluster, n_probe)
+        with span('scoring'):
+            top_k_tracks_ids, _ = await self.scoring_pool.score(query=query, clusters=clusters, top_k=top_k, version=snapshot.version)
+        
+        with span('metadata'):
+            return snapshot.store.metadata(top_k_tracks_ids, columns=['name', 'album', 'artists', 'track_number'])
+    
+    async def _arecommend_personal(self, snapshot: CatalogSnapshot, track_name: str, top_k: int, n_probe: int, user_id: int) -> 'pd.DataFrame':
+        """
+        Coroutine version of the personalized part of `recommend`. Only the re-ranking depends
+        on the user, the seed lookup and the candidates are shared with other requests.
+        """
+        
+        if self.recommendation_cache is None:
+            seed = await self._aseed(snapshot, track_name)
+        else:
+            seed = await self.recommendation_cache.aget_or_compute(
+                key=('seed', snapshot.version, ' '.join(track_name.lower().split())),
+                compute=lambda: self._aseed(snapshot, track_name),
+                store=False
+            )
+        
+        track_id, query, cluster = seed
+        
+        # SQLite reads and writes block, they run in a thread instead of on the event loop
+        profile = await asyncio.to_thread(self.profile_store.get, user_id)
+        rows, similarity = await self._acandidates(snapshot, track_id, query, cluster, top_k, n_probe)
+        rows, track_ids = self._personalize(snapshot, profile, query, rows, similarity, top_k)
+        await asyncio.to_thread(self.profile_store.update, user_id, features=query, seen=track_ids)
+        
+        with span('metadata'):
+            return snapshot.store.metadata(rows, columns=['name', 'album', 'artists', 'track_number'])
+    
+    async def aadd_preference(self, user_id: int = None, track_name: str = None) -> dict:
+        """
+        Add a track the user likes to the profile of the user.
+        
+        Parameters
+        ----------
+        `user_id`: int = None
+            ID of the user.
+        `track_name`: str = None
+            The name of the track, looked up in the track store first and on Spotify otherwise.
+        
+        Returns
+        ----------
+        `track`: dict
+            `name` and `artists` of the found track, and `count` of tracks in the profile.
+        """
+        
+        assert user_id is not None and track_name is not None, (
+            "`user_id` and `track_name` must be specified."
+        )
+        assert self.profile_store is not None, (
+            "`profile_store` must be specified to store preferences."
+        )
+        
+        await self.arefresh()
+        snapshot = self.snapshot
+        
+        row = await asyncio.to_thread(self._local_row, snapshot, track_name)
+        if row is not None:
+            query = np.asarray(snapshot.store.features[row], dtype=np.float64)
+            track = {'name': snapshot.store.column('name', [row])[0], 'artists': list(parse_artists(snapshot.store.column('artists', [row])[0]))}
+        else:
+            form = self.async_search_engine.format_track(await self.async_search_engine.find_track_features(track_name))
+            _, query, _ = self._spotify_seed(form)
+            track = {'name': form['name'], 'artists': form['artists']}
+        
+        profile = await asyncio.to_thread(self.profile_store.update, user_id, features=query)
+        
+        return track | {'count': profile.count}
+    
+    def preference_summary(self, user_id: int = None, n_features: int = 3) -> dict:
+        """
+        Summary of the taste of the user.
+        
+        Parameters
+        ----------
+        `user_id`: int = None
+            ID of the user.
+        `n_features`: int = 3
+            The amount of audio features listed as most above and most below average.
+        
+        Returns
+        ----------
+        `summary`: dict
+            `count` of tracks in the profile, `seen` amount of remembered recommendations,
+            and `high` and `low` audio features of the taste compared to the whole catalog.
+        """
+        
+        assert user_id is not None, (
+            "`user_id` must be specified."
+        )
+        assert self.profile_store is not None, (
+            "`profile_store` must be specified to store preferences."
+        )
+        
+        profile = self.profile_store.get(user_id)
+        summary = {'count': profile.count, 'seen': len(profile.seen), 'high': [], 'low': []}
+        
+        taste = profile.mean
+        if taste is None or len(taste) != len(self.track_preprocessor.feature_names):
+            return summary
+        
+        # Audio features are standardized, so their sign compares the taste to the average track
+        positions = [self.track_preprocessor.feature_names.index(feature) for feature in AUDIO_FEATURES]
+        order = sorted(zip(taste[positions], AUDIO_FEATURES))
+        summary['high'] = [feature for value, feature in order[::-1][:n_features] if value > 0]
+        summary['low'] = [feature for value, feature in order[:n_features] if value < 0]
+        
+        return summary
+    
+    async def apreference_summary(self, user_id: int = None, n_features: int = 3) -> dict:
+        """
+        Coroutine version of `preference_summary`, the profile is read in a thread.
+        """
+        
+        return await asyncio.to_thread(self.preference_summary, user_id, n_features)
+    
+    def _n_candidates(self, profile: UserProfile, top_k: int) -> int:
+        # Enough candidates to re-rank by taste, and to replace the tracks the user has already seen
+        return top_k * PERSONAL_CANDIDATES + min(len(profile.seen), MAX_SKIPPED_CANDIDATES)
+    
+    def _candidates(self, snapshot: CatalogSnapshot, track_id: str, query: np.ndarray, cluster: int, top_k: int, n_probe: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Candidates of a seed track for personalized requests, sorted by decreasing similarity.
+        Enough for any user, so they are cached and shared, see `_n_candidates`.
+        """
+        
+        n_candidates = top_k * PERSONAL_CANDIDATES + MAX_SKIPPED_CANDIDATES
+        
+        if self.recommendation_cache is None:
+            return self._score_candidates(snapshot, query, cluster, n_candidates, n_probe)
+        
+        return self.recommendation_cache.get_or_compute(
+            key=('candidates', snapshot.version, track_id, n_candidates, n_probe),
+            compute=lambda: self._score_candidates(snapshot, query, cluster, n_candidates, n_probe)
+        )
+    
+    async def _acandidates(self, snapshot: CatalogSnapshot, track_id: str, query: np.ndarray, cluster: int, top_k: int, n_probe: int) -> tuple[np.ndarray, np.ndarray]:
+        n_candidates = top_k * PERSONAL_CANDIDATES + MAX_SKIPPED_CANDIDATES
+        
+        if self.recommendation_cache is None:
+            return await self._ascore_candidates(snapshot, query, cluster, n_candidates, n_probe)
+        
+        return await self.recommendation_cache.aget_or_compute(
+            key=('candidates', snapshot.version, track_id, n_candidates, n_probe),
+            compute=lambda: self._ascore_candidates(snapshot, query, cluster, n_candidates, n_probe)
+        )
+    
+    def _score_candidates(self, snapshot: CatalogSnapshot, query: np.ndarray, cluster: int, n_candidates: int, n_probe: int) -> tuple[np.ndarray, np.ndarray]:
+        clusters = self._clusters(query, cluster, n_probe)
+        
+        with span('scoring'):
+            return snapshot.backend.search(query=query, cluster=clusters, top_k=n_candidates)
+    
+    async def _ascore_candidates(self, snapshot: CatalogSnapshot, query: np.ndarray, cluster: int, n_candidates: int, n_probe: int) -> tuple[np.ndarray, np.ndarray]:
+        if self.scoring_pool is None:
+            return self._score_candidates(snapshot, query, cluster, n_candidates, n_probe)
+        
+        clusters = self._clusters(query, cluster, n_probe)
+        
+        with span('scoring'):
+            return await self.scoring_pool.score(query=query, clusters=clusters, top_k=n_candidates, version=snapshot.version)
+    
+    def _personalize(self, snapshot: CatalogSnapshot, profile: UserProfile, query: np.ndarray, rows: np.ndarray, similarity: np.ndarray, top_k: int) -> tuple[np.ndarray, list[str]]:
+        """
+        Re-rank candidates of a seed track by the taste of the user and skip tracks the user
+        has already seen. Returns rows and ids of the recommended tracks, the caller adds them
+        and the seed to the profile.
+        """
+        
+        with span('personalize'):
+            # The same prefix of the shared candidates as a search for `_n_candidates` alone
+            n_candidates = self._n_candidates(profile, top_k)
+            rows = np.asarray(rows[:n_candidates], dtype=np.int64)
+            scores = np.asarray(similarity[:n_candidates], dtype=np.float32)
+            
+            taste = profile.mean
+            if taste is not None and self.personalization > 0 and len(taste) == len(query):
+                # One matrix-vector product scores all candidates against the taste of the user
+                affinity = normalize_rows(snapshot.store.features[rows]) @ normalize(taste)
+                scores = (1 - self.personalization) * scores + self.personalization * affinity
+            
+            track_ids = snapshot.store.column('id', rows)
+            if len(profile.seen):
+                scores = np.where(np.isin(track_hashes(track_ids), profile.seen), -np.inf, scores)
+            
+            picked = top_k_positions(scores, top_k)
+            picked = picked[np.isfinite(scores[picked])]
+        
+        return rows[picked], [track_ids[i] for i in picked]
+    
+    def _local_row(self, snapshot: CatalogSnapshot, track_name: str) -> int | None:
+        if snapshot.name_index is None:
+            return None
+        
+        return snapshot.name_index.lookup(track_name)
+    
+    @timed('local_lookup')
+    def _local_seed(self, snapshot: CatalogSnapshot, track_name: str) -> tuple[str, np.ndarray, int] | None:
+        """
+        Track id, stored features and cluster of `track_name` if it is confidently found in the track store.
+        """
+        
+        row = self._local_row(snapshot, track_name)
+        if row is None:
+            return None
+        
+        track_id = snapshot.store.column('id', [row])[0]
+        
+        return track_id, np.asarray(snapshot.store.features[row], dtype=np.float64), int(snapshot.store.clusters[row])
+    
+    def _spotify_seed(self, form: dict) -> tuple[str, np.ndarray, int]:
+        features, clusters = self.track_preprocessor.preprocess_array(form)
+        
+        return form['id'], features[0], int(clusters[0])
+    
+    def _clusters(self, query: np.ndarray, cluster: int, n_probe: int) -> int | np.ndarray:
+        if n_probe > 1:
+            with span('cluster_filter'):
+                return probe_clusters(query=query, centroids=self.track_preprocessor.centroids, n_probe=n_probe)
+        
+        return cluster
+    
+    def _recommend_track(self, snapshot: CatalogSnapshot, query: np.ndarray, cluster: int, top_k: int, n_probe: int) -> 'pd.DataFrame':
+        clusters = self._clusters(query, cluster, n_probe)
+        
+        with span('scoring'):
+            top_k_tracks_ids, _ = snapshot.backend.search(query=query, cluster=clusters, top_k=top_k)
+        
+        with span('metadata'):
+            return snapshot.store.metadata(top_k_tracks_ids, columns=['name', 'album', 'artists', 'track_number'])
+    
+    @timed('recommend_many')
+    def recommend_many(self, track_names: list[str] = None, top_k: int = 5, n_probe: int = 1, chunk_size: int = 10_000, lane: str = 'background') -> 'pd.DataFrame':
+        """
+        Recommend `top_k` tracks for every seed track in bulk.
+        
+        Seeds found in the track store use their stored features, the rest are
+        looked up on Spotify and preprocessed in one vectorized pass per chunk.
+        Seeds are grouped by cluster and scored with one matrix-matrix product per cluster.
+        Seeds that are not found on Spotify are left out of the result.
+        
+        Parameters
+        ----------
+        `track_names`: list[str] = None
+            The names of the seed tracks.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve for every seed.
+        `n_probe`: int = 1
+            The amount of closest K-Means clusters to search in.
+        `chunk_size`: int = 10_000
+            The amount of seeds processed at once.
+        `lane`: str = 'background'
+            Scheduling lane of Spotify lookups, bulk requests yield to interactive ones by default.
+        
+        Returns
+        ----------
+        `result`: pd.DataFrame
+            A long-format Data frame with `seed` (position in `track_names`), `rank`, `name`, `album`,
+            `artists`, `track_number`, and `similarity` of retrieved tracks.
+        """
+        
+        assert track_names is not None, (
+            "`track_names` must be specified."
+        )
+        
+        self.refresh()
+        snapshot = self.snapshot
+        
+        results = []
+        for start in range(0, len(track_names), chunk_size):
+            with scheduling(lane=lane):
+                seeds, _, queries, clusters = self._resolve_many(snapshot, track_names[start:start + chunk_size])
+            
+            if len(seeds):
+                result = self._recommend_batch(snapshot, queries, clusters, 0, top_k, n_probe)
+                result['seed'] = start + seeds[result.loc[:, 'seed'].values]
+                results.append(result)
+        
+        import pandas as pd
+        
+        return pd.concat(results, ignore_index=True) if results else pd.DataFrame(
+            columns=['seed', 'rank', 'name', 'album', 'artists', 'track_number', 'similarity'])
 
-        form = self.search_engine.format_track(f)
+    @timed('resolve')
+    def _resolve_many(self, snapshot: CatalogSnapshot, track_names: list[str]) -> tuple[np.ndarray, list[tuple], np.ndarray, np.ndarray]:
+        """
+        Resolve seed tracks locally where possible and on Spotify otherwise.
+        
+        Returns positions of the found seeds in `track_names`, their (id, title, first artist)
+        keys, and their preprocessed features and clusters, all ordered by position.
+        """
+        
+        rows = [self._local_row(snapshot, name) for name in track_names]
+        
+        local_seeds = [seed for seed, row in enumerate(rows) if row is not None]
+        local_rows = np.asarray([rows[seed] for seed in local_seeds], dtype=np.int64)
+        queries = [np.asarray(snapshot.store.features[local_rows], dtype=np.float64)]
+        clusters = [np.asarray(snapshot.store.clusters[local_rows], dtype=np.int32)]
+        keys = list(zip(
+            snapshot.store.column('id', local_rows),
+            map(normalize_text, snapshot.store.column('name', local_rows)),
+            [normalize_text(next(iter(parse_artists(artists)), '')) for artists in snapshot.store.column('artists', local_rows)]
+        ))
+        
+        remote_seeds, tracks = [], []
+        missing = [seed for seed, row in enumerate(rows) if row is None]
+        if missing:
+            found = self.search_engine.find_many_track_features([track_names[seed] for seed in missing])
+            for seed, features in zip(missing, found):
+                if features is not None:
+                    tracks.append(self.search_engine.format_track(features))
+                    remote_seeds.append(seed)
+        
+        if tracks:
+            remote_queries, remote_clusters = self.track_preprocessor.preprocess_array(tracks)
+            queries.append(remote_queries)
+            clusters.append(remote_clusters)
+            keys.extend((track['id'], normalize_text(track['name']), normalize_text(next(iter(track['artists']), '')))
+                        for track in tracks)
+        
+        seeds = np.asarray(local_seeds + remote_seeds, dtype=np.int64)
+        order = np.argsort(seeds, kind='stable')
+        
+        return seeds[order], [keys[i] for i in order], np.concatenate(queries)[order], np.concatenate(clusters)[order]
+    
+    @timed('recommend_playlist')
+    def recommend_playlist(
+        self,
+        track_names: list[str] = None,
+        top_k: int = 5,
+        n_candidates: int = 200,
+        diversity: float = 0.3
+    ) -> 'pd.DataFrame':
+        """
+        Recommend `top_k` tracks for a whole playlist of seed tracks.
+        
+        All seeds are preprocessed in one batch. The query profile is the centroid
+        of all seeds plus one centroid per cluster the seeds fall into; each of these
+        clusters is searched once with its own centroid for a share of `n_candidates`
+        proportional to its share of seeds. Candidates are scored by the mean of
+        their similarity to the playlist centroid and to the closest cluster centroid,
+        seeds and duplicates (same title and artist) are removed, and the result is
+        re-ranked with Maximal Marginal Relevance for diversity.
+        
+        Parameters
+        ----------
+        `track_names`: list[str] = None
+            The names of the seed tracks.
+        `top_k`: int = 5
+            The amount of tracks to retrieve.
+        `n_candidates`: int = 200
+            The amount of candidates to re-rank.
+        `diversity`: float = 0.3
+            Trade-off between relevance (0.0) and diversity (1.0) of the result.
+        
+        Returns
+        ----------
+        `result`: pd.DataFrame
+            A Data frame that contains `name`, `album`, `artists`, `track_number`, and `similarity` of retrieved tracks.
+        """
+        
+        assert track_names is not None, (
+            "`track_names` must be specified."
+        )
+        
+        columns = ['name', 'album', 'artists', 'track_number']
+        
+        self.refresh()
+        snapshot = self.snapshot
+        
+        _, seed_keys, queries, clusters = self._resolve_many(snapshot, track_names)
+        if not seed_keys:
+            import pandas as pd
+            return pd.DataFrame(columns=columns + ['similarity'])
+        
+        vectors = normalize_rows(queries)
+        centroid = normalize(vectors.mean(axis=0))
+        
+        touched, labels = np.unique(clusters, return_inverse=True)
+        mixture = np.zeros((len(touched), vectors.shape[1]))
+        np.add.at(mixture, labels, vectors)
+        mixture = normalize_rows(mixture)
+        shares = np.bincount(labels) / len(labels)
+        
+        # Seeds and their duplicates come back as their own best matches, so ask for more
+        budget = np.maximum(np.ceil(shares * n_candidates).astype(np.int64), top_k) + len(seed_keys)
+        row_ids, _ = snapshot.backend.search_many(queries=mixture, clusters=touched, top_k=int(budget.max()))
+        row_ids = np.where(np.arange(row_ids.shape[1]) < budget[:, None], row_ids, -1)
+        rows = np.unique(row_ids[row_ids >= 0])
+        
+        candidates = normalize_rows(np.asarray(snapshot.store.features[rows], dtype=np.float64))
+        relevance = (candidates @ centroid + (candidates @ mixture.T).max(axis=1)) / 2
+        
+        # Only the best candidates are decoded, which keeps metadata reads independent of the playlist size
+        shortlist = top_k_positions(relevance, n_candidates + len(seed_keys))
+        rows, candidates, relevance = rows[shortlist], candidates[shortlist], relevance[shortlist]
+        
+        # Best scoring version of every (title, first artist) that is not a seed
+        seed_ids = {track_id for track_id, _, _ in seed_keys}
+        seen = {(name, artist) for _, name, artist in seed_keys}
+        keep = []
+        candidate_keys = list(zip(
+            snapshot.store.column('id', rows),
+            map(normalize_text, snapshot.store.column('name', rows)),
+            [normalize_text(next(iter(parse_artists(artists)), '')) for artists in snapshot.store.column('artists', rows)]
+        ))
+        for position in range(len(rows)):
+            track_id, name, artist = candidate_keys[position]
+            if track_id in seed_ids or (name, artist) in seen:
+                continue
+            seen.add((name, artist))
+            keep.append(position)
+        
+        keep = np.asarray(keep, dtype=np.int64)
+        picked = keep[mmr_rerank(vectors=candidates[keep], relevance=relevance[keep], top_k=top_k, diversity=diversity)]
+        
+        result = snapshot.store.metadata(rows[picked], columns=columns)
+        result['similarity'] = relevance[picked]
+        
+        return result
+    
+    def _recommend_batch(self, snapshot: CatalogSnapshot, queries: np.ndarray, clusters: np.ndarray, first_seed: int, top_k: int, n_probe: int) -> 'pd.DataFrame':
+        if n_probe > 1:
+            with span('cluster_filter'):
+                clusters = probe_clusters(query=queries, centroids=self.track_preprocessor.centroids, n_probe=n_probe)
         
-        target_track_preprocessed = self.track_preprocessor.preprocess(form)
+        with span('scoring'):
+            row_ids, similarity = snapshot.backend.search_many(queries=queries, clusters=clusters, top_k=top_k)
         
-        retrieved_track_features = self.track_db_features.loc[self.track_db_features.loc[:, 'cluster'] ==
-                                                              target_track_preprocessed.loc[:, 'cluster'].values[0], :].drop(labels=['cluster'], axis=1)
+        # Long format: one row per (seed, rank), clusters smaller than `top_k` leave padding out
+        found = row_ids >= 0
+        seeds, ranks = np.nonzero(found)
         
-        retrieved_track_features['similarity'] = cosine_similarity(X=target_track_preprocessed.drop(labels=['cluster'], axis=1).values, Y=retrieved_track_features.values)[0]
-        top_k_tracks = retrieved_track_features.nlargest(top_k, 'similarity')
-        top_k_tracks_ids = top_k_tracks.index.values
+        with span('metadata'):
+            result = snapshot.store.metadata(row_ids[found], columns=['name', 'album', 'artists', 'track_number'])
+        result.insert(0, 'seed', first_seed + seeds)
+        result.insert(1, 'rank', ranks + 1)
+        result['similarity'] = similarity[found]
         
-        return self.track_db.loc[top_k_tracks_ids, ['name', 'album', 'artists', 'track_number']].reset_index(drop=True)
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -1,10 +1,12 @@
 # Import necessary dependencies
+import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 
 from search import TrackSearchEngine
 from const import *
 from preprocessor import TrackPreprocessor
+from catalog import Catalog
+from track_index import probe_clusters
 
 class RecSys():
     """
@@ -14,8 +16,12 @@ class RecSys():
     ----------
     `pkl_path`: str = '../models/k_means.pkl'
         Path to ".pkl" K-Means model and Column Transformer.
-    `db_path`: str = '../data/preprocessed_audio_features_clusters.csv'
-        Path to ".csv" file that contains all preprocessed tracks.
+    `db_path`: str = '../data/track_store'
+        Path to the track store that contains all preprocessed tracks (see `track_store.py`).
+    `track_store`: TrackStore
+        Memory-mapped features, clusters and metadata of all preprocessed tracks.
+    `track_index`: ClusterIndex
+        L2-normalized features of all tracks grouped by cluster.
     `track_preprocessor`: TrackPreprocessor
         Module for preprocessing new tracks.
     `search_engine`: TrackSearchEngine
@@ -25,7 +31,7 @@ class RecSys():
     def __init__(
         self,
         pkl_path: str = '../models/k_means.pkl',
-        db_path: str = '../data/preprocessed_audio_features_clusters.csv'
+        db_path: str = '../data/track_store'
     ) -> None:
         """
         Initialize `RecSys` class.
@@ -34,8 +40,8 @@ class RecSys():
         ----------
         `pkl_path`: str = '../models/k_means.pkl'
             Path to ".pkl" K-Means model and Column Transformer.
-        `db_path`: str = '../data/preprocessed_audio_features_clusters.csv'
-            Path to ".csv" file that contains all preprocessed tracks.
+        `db_path`: str = '../data/track_store'
+            Path to the track store that contains all preprocessed tracks (see `track_store.py`).
         
         Returns
         ----------
@@ -44,10 +50,16 @@ class RecSys():
         """
         
         self.track_preprocessor = TrackPreprocessor(pkl_path=pkl_path)
-        self.track_db = pd.read_csv(db_path, index_col='Unnamed: 0')
-        self.track_db_features = self.track_db.drop(labels=['id', 'name', 'album', 'album_id', 'artists', 'artist_ids', 'track_number'], axis=1)
+        # Latest catalog version at start-up, see `catalog.py`
+        snapshot = Catalog(db_path).snapshot(name_index=False)
+        self.track_store = snapshot.store
+        self.track_index = snapshot.index
         
-    def recommend(self, spotify_call: dict[str], top_k: int = 5) -> pd.DataFrame:
+        assert self.track_preprocessor.feature_names == self.track_store.feature_names, (
+            'Features of the model and the track store must be in the same order.'
+        )
+        
+    def recommend(self, spotify_call: dict[str], top_k: int = 5, n_probe: int = 1) -> pd.DataFrame:
         """
         Recommend `top_k` tracks from `self.db_path` using K-Means clustering.
         
@@ -57,6 +69,8 @@ class RecSys():
             Dictionary that contains the information we recieve from one Spotify API call.
         `top_k`: int = 5
             The amount of most similar tracks to retrieve.
+        `n_probe`: int = 1
+            The amount of closest K-Means clusters to search in.
         
         Returns
         ----------
@@ -64,13 +78,64 @@ class RecSys():
             A Data frame that contains `name`, `album`, `artists`, and `track_number` of retrieved tracks.
         """
         
-        target_track_preprocessed = self.track_preprocessor.preprocess(spotify_call)
+        features, clusters = self.track_preprocessor.preprocess_array(spotify_call)
+        query = features[0]
+        
+        if n_probe > 1:
+            clusters = probe_clusters(query=query, centroids=self.track_preprocessor.centroids, n_probe=n_probe)
+        else:
+            clusters = clusters[0]
+        
+        top_k_tracks_ids, _ = self.track_index.search(query=query, cluster=clusters, top_k=top_k)
+        
+        return self.track_store.metadata(top_k_tracks_ids, columns=['name', 'album', 'artists', 'track_number'])
+    
+    def recommend_many(self, spotify_calls: list[dict[str]], top_k: int = 5, n_probe: int = 1, chunk_size: int = 10_000) -> pd.DataFrame:
+        """
+        Recommend `top_k` tracks for every seed track in bulk.
+        
+        Seeds are preprocessed in one vectorized pass per chunk, grouped by
+        cluster and scored with one matrix-matrix product per cluster.
+        
+        Parameters
+        ----------
+        `spotify_calls`: list[dict[str]]
+            Dictionaries that contain the information we recieve from one Spotify API call, one per seed track.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve for every seed.
+        `n_probe`: int = 1
+            The amount of closest K-Means clusters to search in.
+        `chunk_size`: int = 10_000
+            The amount of seeds processed at once.
+        
+        Returns
+        ----------
+        `result`: pd.DataFrame
+            A long-format Data frame with `seed` (position in `spotify_calls`), `rank`, `name`, `album`,
+            `artists`, `track_number`, and `similarity` of retrieved tracks.
+        """
+        
+        results = [self._recommend_batch(spotify_calls[start:start + chunk_size], start, top_k, n_probe)
+                   for start in range(0, len(spotify_calls), chunk_size)]
+        
+        return pd.concat(results, ignore_index=True) if results else pd.DataFrame(
+            columns=['seed', 'rank', 'name', 'album', 'artists', 'track_number', 'similarity'])
+
+    def _recommend_batch(self, tracks: list[dict], first_seed: int, top_k: int, n_probe: int) -> pd.DataFrame:
+        queries, clusters = self.track_preprocessor.preprocess_array(tracks)
+        
+        if n_probe > 1:
+            clusters = probe_clusters(query=queries, centroids=self.track_preprocessor.centroids, n_probe=n_probe)
+        
+        row_ids, similarity = self.track_index.search_many(queries=queries, clusters=clusters, top_k=top_k)
         
-        retrieved_track_features = self.track_db_features.loc[self.track_db_features.loc[:, 'cluster'] ==
-                                                              target_track_preprocessed.loc[:, 'cluster'].values[0], :].drop(labels=['cluster'], axis=1)
+        # Long format: one row per (seed, rank), clusters smaller than `top_k` leave padding out
+        found = row_ids >= 0
+        seeds, ranks = np.nonzero(found)
         
-        retrieved_track_features['similarity'] = cosine_similarity(X=target_track_preprocessed.drop(labels=['cluster'], axis=1).values, Y=retrieved_track_features.values)[0]
-        top_k_tracks = retrieved_track_features.nlargest(top_k, 'similarity')
-        top_k_tracks_ids = top_k_tracks.index.values
+        result = self.track_store.metadata(row_ids[found], columns=['name', 'album', 'artists', 'track_number'])
+        result.insert(0, 'seed', first_seed + seeds)
+        result.insert(1, 'rank', ranks + 1)
+        result['similarity'] = similarity[found]
         
-        return self.track_db.loc[top_k_tracks_ids, ['name', 'album', 'artists', 'track_number']].reset_index(drop=True)
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -0,0 +1,628 @@
+# Import necessary dependencies
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from catalog import Catalog, CatalogSnapshot
+from track_index import normalize, normalize_rows, top_k_positions
+
+logger = logging.getLogger(__name__)
+
+ANN_INDEX_DIR_NAME = 'ann_index'
+
+RETRIEVAL_BACKENDS = ['cluster_scan', 'ivf_pq']
+
+
+def kmeans(data: np.ndarray = None, n_clusters: int = 256, n_iter: int = 20, seed: int = 42, chunk_size: int = 16_384) -> np.ndarray:
+    """
+    Lloyd's K-Means in plain NumPy, used to train the IVF and PQ codebooks.
+
+    Parameters
+    ----------
+    `data`: np.ndarray = None
+        Training vectors of shape (n, d).
+    `n_clusters`: int = 256
+        The amount of centroids.
+    `n_iter`: int = 20
+        The amount of iterations.
+    `seed`: int = 42
+        Random seed of the initial centroids.
+    `chunk_size`: int = 16_384
+        Amount of vectors assigned at once, bounds the distance matrix size.
+
+    Returns
+    ----------
+    `centroids`: np.ndarray
+        `float32` centroids of shape (n_clusters, d).
+    """
+
+    assert data is not None, (
+        '`data` must be specified.'
+    )
+
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = assign(data, centroids, chunk_size)
+
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, labels, data)
+
+        empty = counts == 0
+        centroids[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        # Re-seed empty centroids with random vectors
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 16_384) -> np.ndarray:
+    """
+    Index of the closest centroid in Euclidean distance of every vector.
+    """
+
+    squared_norms = (centroids.astype(np.float32) ** 2).sum(axis=1)
+    labels = np.empty(len(data), dtype=np.int64)
+
+    for start in range(0, len(data), chunk_size):
+        chunk = np.asarray(data[start:start + chunk_size], dtype=np.float32)
+        labels[start:start + chunk_size] = np.argmin(squared_norms - 2 * chunk @ centroids.T, axis=1)
+
+    return labels
+
+
+class IVFPQIndex():
+    """
+    Inverted file index with product quantization over L2-normalized features.
+
+    Every vector is assigned to the closest of `n_lists` coarse centroids and
+    its residual is split into `n_subspaces` parts, each encoded as one byte.
+    A query scores only the vectors of its `n_probe` best lists, as the inner
+    product with the coarse centroid plus table lookups for the residual codes.
+
+    Attributes
+    ----------
+    `coarse`: np.ndarray
+        Coarse centroids of shape (n_lists, d).
+    `codebooks`: np.ndarray
+        Residual codebooks of shape (n_subspaces, 256, d / n_subspaces).
+    `codes`: np.ndarray
+        `uint8` codes of shape (n_vectors, n_subspaces) grouped by list.
+    `row_ids`: np.ndarray
+        Track store row of every code.
+    `offsets`: np.ndarray
+        List `l` is `codes[offsets[l]:offsets[l + 1]]`.
+    `delta_lists`, `delta_codes`, `delta_row_ids`: np.ndarray
+        List, codes and track store row of every vector added by `add`. They are
+        kept apart and scanned next to the lists, so the memory-mapped codes are never copied.
+    `meta`: dict
+        Catalog version and base segment the index was built for.
+    """
+
+    def __init__(
+        self,
+        coarse: np.ndarray = None,
+        codebooks: np.ndarray = None,
+        codes: np.ndarray = None,
+        row_ids: np.ndarray = None,
+        offsets: np.ndarray = None,
+        meta: dict = None
+    ) -> None:
+        """
+        Initialize `IVFPQIndex` object, see `build` and `load`.
+        """
+
+        assert coarse is not None and codebooks is not None, (
+            '`coarse` and `codebooks` must be specified.'
+        )
+
+        self.coarse = coarse
+        self.codebooks = codebooks
+        self.codes = codes
+        self.row_ids = row_ids
+        self.offsets = offsets
+        self.meta = meta or {}
+
+        self.delta_lists = np.zeros(0, dtype=np.int64)
+        self.delta_codes = np.zeros((0, len(codebooks)), dtype=np.uint8)
+        self.delta_row_ids = np.zeros(0, dtype=np.int64)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.coarse)
+
+    @property
+    def n_subspaces(self) -> int:
+        return len(self.codebooks)
+
+    @property
+    def n_vectors(self) -> int:
+        return len(self.row_ids) + len(self.delta_row_ids)
+
+    @classmethod
+    def build(
+        cls,
+        features: np.ndarray = None,
+        n_lists: int = None,
+        n_subspaces: int = 8,
+        n_iter: int = 20,
+        sample_size: int = 100_000,
+        chunk_size: int = 100_000,
+        seed: int = 42
+    ) -> 'IVFPQIndex':
+        """
+        Train codebooks on a sample of `features` and encode all of them.
+
+        Parameters
+        ----------
+        `features`: np.ndarray = None
+            Preprocessed features of shape (n_tracks, n_features), row `i` is track store row `i`.
+        `n_lists`: int = None
+            The amount of inverted lists, `None` for about `4 * sqrt(n_tracks)`.
+        `n_subspaces`: int = 8
+            The amount of one-byte codes per vector, must divide the amount of features.
+        `n_iter`: int = 20
+            K-Means iterations of every codebook.
+        `sample_size`: int = 100_000
+            The amount of vectors the codebooks are trained on.
+        `chunk_size`: int = 100_000
+            The amount of vectors encoded at once.
+        `seed`: int = 42
+            Random seed.
+
+        Returns
+        ----------
+        `index`: IVFPQIndex
+            The built index.
+        """
+
+        assert features is not None, (
+            '`features` must be specified.'
+        )
+        assert features.shape[1] % n_subspaces == 0, (
+            '`n_subspaces` must divide the amount of features.'
+        )
+
+        n_tracks = len(features)
+        n_lists = n_lists or max(1, min(n_tracks, int(4 * np.sqrt(n_tracks))))
+
+        rng = np.random.default_rng(seed)
+        sample = normalize_rows(np.asarray(features[np.sort(rng.choice(n_tracks, min(sample_size, n_tracks), replace=False))], dtype=np.float32))
+
+        coarse = kmeans(sample, n_clusters=n_lists, n_iter=n_iter, seed=seed)
+        residuals = sample - coarse[assign(sample, coarse)]
+
+        sub_dim = features.shape[1] // n_subspaces
+        codebooks = np.stack([
+            _pad_codebook(kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], n_clusters=256, n_iter=n_iter, seed=seed + j))
+            for j in range(n_subspaces)
+        ])
+
+        return cls(coarse=coarse, codebooks=codebooks).reindex(features, chunk_size=chunk_size)
+
+    def reindex(self, features: np.ndarray = None, chunk_size: int = 100_000) -> 'IVFPQIndex':
+        """
+        New index of `features` encoded with the trained coarse centroids and codebooks.
+
+        Parameters
+        ----------
+        `features`: np.ndarray = None
+            Preprocessed features of shape (n_tracks, n_features), row `i` is track store row `i`.
+        `chunk_size`: int = 100_000
+            The amount of vectors encoded at once.
+
+        Returns
+        ----------
+        `index`: IVFPQIndex
+            The new index, with the `meta` of this one.
+        """
+
+        assert features is not None, (
+            '`features` must be specified.'
+        )
+
+        index = IVFPQIndex(coarse=self.coarse, codebooks=self.codebooks, meta=self.meta)
+        lists, codes = [np.zeros(0, dtype=np.int64)], [np.zeros((0, self.n_subspaces), dtype=np.uint8)]
+        for start in range(0, len(features), chunk_size):
+            chunk_lists, chunk_codes = index.encode(features[start:start + chunk_size])
+            lists.append(chunk_lists)
+            codes.append(chunk_codes)
+
+        index._set_lists(np.concatenate(lists), np.concatenate(codes), np.arange(len(features), dtype=np.int64))
+
+        return index
+
+    def encode(self, features: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Inverted list and PQ codes of every vector.
+        """
+
+        vectors = normalize_rows(np.asarray(features, dtype=np.float32))
+        lists = assign(vectors, self.coarse)
+        residuals = vectors - self.coarse[lists]
+
+        sub_dim = vectors.shape[1] // self.n_subspaces
+        codes = np.column_stack([
+            assign(residuals[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j]) for j in range(self.n_subspaces)
+        ]).astype(np.uint8)
+
+        return lists, codes
+
+    def add(self, features: np.ndarray = None, row_ids: np.ndarray = None) -> None:
+        """
+        Encode `features` with the trained codebooks and add them to their lists.
+        """
+
+        assert features is not None and row_ids is not None, (
+            '`features` and `row_ids` must be specified.'
+        )
+
+        lists, codes = self.encode(features)
+
+        self.delta_lists = np.concatenate([self.delta_lists, lists])
+        self.delta_codes = np.concatenate([self.delta_codes, codes])
+        self.delta_row_ids = np.concatenate([self.delta_row_ids, np.asarray(row_ids, dtype=np.int64)])
+
+    def _set_lists(self, lists: np.ndarray, codes: np.ndarray, row_ids: np.ndarray) -> None:
+        order = np.argsort(lists, kind='stable')
+
+        self.codes = codes[order]
+        self.row_ids = row_ids[order]
+        self.offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(lists, minlength=self.n_lists))
+
+        self.delta_lists = np.zeros(0, dtype=np.int64)
+        self.delta_codes = np.zeros((0, self.n_subspaces), dtype=np.uint8)
+        self.delta_row_ids = np.zeros(0, dtype=np.int64)
+
+    def search(self, query: np.ndarray = None, top_k: int = 5, n_probe: int = 8, excluded: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Retrieve `top_k` tracks with the highest approximate cosine similarity to `query`.
+
+        Parameters
+        ----------
+        `query`: np.ndarray = None
+            Preprocessed features of the query track.
+        `top_k`: int = 5
+            The amount of tracks to retrieve.
+        `n_probe`: int = 8
+            The amount of inverted lists to scan.
+        `excluded`: np.ndarray = None
+            Boolean mask of track store rows to skip, e.g. removed tracks.
+
+        Returns
+        ----------
+        `row_ids`: np.ndarray
+            Track store rows sorted by decreasing approximate similarity.
+        `similarity`: np.ndarray
+            Approximate cosine similarity.
+        """
+
+        assert query is not None, (
+            '`query` must be specified.'
+        )
+
+        query = normalize(np.asarray(query, dtype=np.float32))
+
+        coarse_scores = self.coarse @ query
+        probed = top_k_positions(coarse_scores, min(n_probe, self.n_lists))
+
+        # Lookup table of inner products between every query part and every codeword
+        sub_dim = len(query) // self.n_subspaces
+        table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.n_subspaces, sub_dim)).ravel()
+
+        positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probed])
+        delta = np.flatnonzero(np.isin(self.delta_lists, probed))
+        if len(positions) + len(delta) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        list_scores = np.concatenate([np.repeat(coarse_scores[probed], np.diff(self.offsets)[probed]), coarse_scores[self.delta_lists[delta]]])
+        codes = np.concatenate([self.codes[positions], self.delta_codes[delta]]).astype(np.int64) + np.arange(self.n_subspaces) * 256
+        similarity = list_scores + table[codes].sum(axis=1)
+
+        row_ids = np.concatenate([self.row_ids[positions], self.delta_row_ids[delta]])
+        if excluded is not None:
+            similarity[excluded[row_ids]] = -np.inf
+
+        top = top_k_positions(similarity, top_k)
+        top = top[np.isfinite(similarity[top])]
+
+        return row_ids[top], similarity[top]
+
+    def save(self, path: str = None, meta: dict = None) -> None:
+        """
+        Save the index as raw arrays, so that `load` can memory-map the codes.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        os.makedirs(path, exist_ok=True)
+
+        if len(self.delta_row_ids):
+            # Saved into the lists, so `load` maps all of them
+            self._set_lists(np.concatenate([np.repeat(np.arange(self.n_lists), np.diff(self.offsets)), self.delta_lists]),
+                            np.concatenate([np.asarray(self.codes), self.delta_codes]),
+                            np.concatenate([np.asarray(self.row_ids), self.delta_row_ids]))
+
+        self.coarse.astype(np.float32).tofile(os.path.join(path, 'coarse.f32'))
+        self.codebooks.astype(np.float32).tofile(os.path.join(path, 'codebooks.f32'))
+        np.asarray(self.codes, dtype=np.uint8).tofile(os.path.join(path, 'codes.u8'))
+        np.asarray(self.row_ids, dtype=np.int64).tofile(os.path.join(path, 'row_ids.i64'))
+        self.offsets.astype(np.int64).tofile(os.path.join(path, 'offsets.i64'))
+
+        self.meta = {**self.meta, **(meta or {}),
+                     'n_lists': self.n_lists, 'n_subspaces': self.n_subspaces,
+                     'dim': self.coarse.shape[1], 'n_vectors': self.n_vectors}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=4)
+
+    @classmethod
+    def load(cls, path: str = None) -> 'IVFPQIndex':
+        """
+        Load the index saved by `save`.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        n_lists, n_subspaces, dim, n_vectors = meta['n_lists'], meta['n_subspaces'], meta['dim'], meta['n_vectors']
+
+        def open_array(file_name: str, dtype: type, shape: tuple) -> np.ndarray:
+            if np.prod(shape) == 0:
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(os.path.join(path, file_name), dtype=dtype, mode='r', shape=shape)
+
+        return cls(
+            coarse=np.fromfile(os.path.join(path, 'coarse.f32'), dtype=np.float32).reshape(n_lists, dim),
+            codebooks=np.fromfile(os.path.join(path, 'codebooks.f32'), dtype=np.float32).reshape(n_subspaces, 256, dim // n_subspaces),
+            codes=open_array('codes.u8', np.uint8, (n_vectors, n_subspaces)),
+            row_ids=open_array('row_ids.i64', np.int64, (n_vectors,)),
+            offsets=np.fromfile(os.path.join(path, 'offsets.i64'), dtype=np.int64),
+            meta=meta
+        )
+
+
+def _pad_codebook(codebook: np.ndarray) -> np.ndarray:
+    # Tiny training samples give less than 256 codewords, repeat the last one so codes stay one byte
+    if len(codebook) < 256:
+        codebook = np.concatenate([codebook, np.repeat(codebook[-1:], 256 - len(codebook), axis=0)])
+
+    return codebook
+
+
+class ClusterScanBackend():
+    """
+    Retrieval by exact scan of the K-Means clusters of the query, see `ClusterIndex`.
+    """
+
+    name = 'cluster_scan'
+
+    def __init__(self, snapshot: CatalogSnapshot = None) -> None:
+        assert snapshot is not None, (
+            '`snapshot` must be specified.'
+        )
+
+        self.index = snapshot.index
+
+    def search(self, query: np.ndarray = None, cluster: int | list[int] = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        return self.index.search(query=query, cluster=cluster, top_k=top_k)
+
+    def search_many(self, queries: np.ndarray = None, clusters: np.ndarray = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        return self.index.search_many(queries=queries, clusters=clusters, top_k=top_k)
+
+
+class IVFPQBackend():
+    """
+    Retrieval through `IVFPQIndex`, independent of K-Means cluster sizes.
+
+    The index returns a shortlist of `rerank * top_k` candidates, which are
+    re-ranked by exact cosine similarity on the stored features. `cluster`
+    arguments are ignored: the index probes its own inverted lists.
+    """
+
+    name = 'ivf_pq'
+
+    def __init__(self, snapshot: CatalogSnapshot = None, index: IVFPQIndex = None, n_probe: int = 8, rerank: int = 4) -> None:
+        assert snapshot is not None and index is not None, (
+            '`snapshot` and `index` must be specified.'
+        )
+
+        self.store = snapshot.store
+        self.index = index
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.removed = snapshot.removed_rows()
+        # Removed tracks are skipped inside the scan, so they never take the place of live candidates
+        self.excluded = None
+        if len(self.removed):
+            self.excluded = np.zeros(len(self.store), dtype=bool)
+            self.excluded[self.removed] = True
+
+    def search(self, query: np.ndarray = None, cluster: int | list[int] = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        assert query is not None, (
+            '`query` must be specified.'
+        )
+
+        candidates, _ = self.index.search(query=query, top_k=self.rerank * top_k, n_probe=self.n_probe, excluded=self.excluded)
+
+        similarity = normalize_rows(np.asarray(self.store.features[candidates], dtype=np.float32)) @ normalize(np.asarray(query, dtype=np.float32))
+        top = top_k_positions(similarity, top_k)
+
+        return candidates[top], similarity[top]
+
+    def search_many(self, queries: np.ndarray = None, clusters: np.ndarray = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        assert queries is not None, (
+            '`queries` must be specified.'
+        )
+
+        row_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        similarity = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+        for i, query in enumerate(queries):
+            query_row_ids, query_similarity = self.search(query=query, top_k=top_k)
+            row_ids[i, :len(query_row_ids)] = query_row_ids
+            similarity[i, :len(query_similarity)] = query_similarity
+
+        return row_ids, similarity
+
+
+def ann_index_path(pkl_path: str = None) -> str:
+    """
+    Default location of the ANN index: next to the model pickle.
+    """
+
+    return os.path.join(os.path.dirname(os.path.abspath(pkl_path)), ANN_INDEX_DIR_NAME)
+
+
+def base_fingerprint(snapshot: CatalogSnapshot = None) -> dict:
+    """
+    Identity of the base segment of `snapshot`, whose rows the ANN index numbers.
+
+    The base segment only changes on a full rebuild or a compaction, delta
+    segments added on top of it keep the numbering of its rows.
+    """
+
+    base = snapshot.store.stores[0] if hasattr(snapshot.store, 'stores') else snapshot.store
+    features_path = os.path.join(base.path, 'features.f32')
+
+    return {
+        'base_segment': snapshot.manifest['segments'][0],
+        'base_mtime_ns': os.stat(features_path).st_mtime_ns,
+        'base_tracks': len(base)
+    }
+
+
+def build_ann_index(snapshot: CatalogSnapshot = None, path: str = None, **options) -> IVFPQIndex:
+    """
+    Build an `IVFPQIndex` over all rows of `snapshot` and save it to `path`.
+
+    `options` are passed to `IVFPQIndex.build`.
+    """
+
+    assert snapshot is not None and path is not None, (
+        '`snapshot` and `path` must be specified.'
+    )
+
+    index = IVFPQIndex.build(features=snapshot.store.features, **options)
+    index.save(path, meta={'catalog_version': snapshot.version, **base_fingerprint(snapshot)})
+
+    return index
+
+
+def make_backend(name: str = 'cluster_scan', snapshot: CatalogSnapshot = None, ann_path: str = None, **options):
+    """
+    Create the retrieval backend `name` for `snapshot`.
+
+    The ANN index is loaded from `ann_path`. Tracks added to the catalog since
+    it was built are encoded with its codebooks on the fly. A compaction
+    renumbers rows, so then all tracks are encoded with its codebooks again
+    until the index is rebuilt (`python retrieval.py`).
+
+    Parameters
+    ----------
+    `name`: str = 'cluster_scan'
+        One of `RETRIEVAL_BACKENDS`.
+    `snapshot`: CatalogSnapshot = None
+        Catalog version to search.
+    `ann_path`: str = None
+        Path to the saved `IVFPQIndex`, required by 'ivf_pq'.
+    `options`
+        Backend options, e.g. `n_probe` and `rerank` of 'ivf_pq'.
+
+    Returns
+    ----------
+    `backend`: ClusterScanBackend | IVFPQBackend
+        Object with `search` and `search_many` methods of `ClusterIndex`.
+    """
+
+    assert name in RETRIEVAL_BACKENDS, (
+        f'`name` must be one of {RETRIEVAL_BACKENDS}.'
+    )
+    assert snapshot is not None, (
+        '`snapshot` must be specified.'
+    )
+
+    if name == 'cluster_scan':
+        return ClusterScanBackend(snapshot)
+
+    assert ann_path is not None, (
+        '`ann_path` must be specified.'
+    )
+
+    if not os.path.exists(os.path.join(ann_path, 'meta.json')):
+        logger.warning('ANN index %s is missing, using the cluster scan', ann_path)
+        return ClusterScanBackend(snapshot)
+
+    index = IVFPQIndex.load(ann_path)
+    if index.coarse.shape[1] != snapshot.store.features.shape[1]:
+        logger.warning('ANN index %s was built for other features, using the cluster scan', ann_path)
+        return ClusterScanBackend(snapshot)
+
+    fingerprint = base_fingerprint(snapshot)
+    if any(index.meta.get(key) != value for key, value in fingerprint.items()) or index.n_vectors > len(snapshot.store):
+        logger.warning('ANN index %s was built for another base segment, encoding %d tracks with its codebooks. '
+                       'Rebuild it with `python retrieval.py`', ann_path, len(snapshot.store))
+        index = index.reindex(snapshot.store.features)
+    elif index.n_vectors < len(snapshot.store):
+        rows = np.arange(index.n_vectors, len(snapshot.store))
+        index.add(features=snapshot.store.features[rows], row_ids=rows)
+
+    return IVFPQBackend(snapshot, index, **options)
+
+
+def open_snapshot(
+    catalog: Catalog = None,
+    version: int = None,
+    name_index: bool = True,
+    precision: str = 'float32',
+    retrieval: str = 'cluster_scan',
+    ann_path: str = None,
+    **options
+) -> CatalogSnapshot:
+    """
+    Load catalog `version` (see `Catalog.snapshot`) and attach its retrieval backend (see `make_backend`).
+    """
+
+    assert catalog is not None, (
+        '`catalog` must be specified.'
+    )
+
+    snapshot = catalog.snapshot(version, name_index=name_index, precision=precision)
+    snapshot.backend = make_backend(retrieval, snapshot, ann_path, **options)
+
+    return snapshot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the ANN index of the track catalog.')
+    parser.add_argument('--pkl', default='../models/k_means.pkl', help='Path to ".pkl" K-Means model, the index is saved next to it.')
+    parser.add_argument('--db', default='../data/track_store', help='Path to the track catalog.')
+    parser.add_argument('--n-lists', type=int, default=None, help='The amount of inverted lists.')
+    parser.add_argument('--n-subspaces', type=int, default=8, help='The amount of one-byte codes per track.')
+    parser.add_argument('--sample-size', type=int, default=100_000, help='The amount of tracks the codebooks are trained on.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = build_ann_index(
+        snapshot=Catalog(args.db).snapshot(name_index=False),
+        path=ann_index_path(args.pkl),
+        n_lists=args.n_lists,
+        n_subspaces=args.n_subspaces,
+        sample_size=args.sample_size
+    )
+
+    print(f'Indexed {index.n_vectors} tracks in {index.n_lists} lists in {time.perf_counter() - start:.1f} s')
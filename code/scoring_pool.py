@@ -0,0 +1,172 @@
+# Import necessary dependencies
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from catalog import Catalog
+from retrieval import open_snapshot
+from track_store import TrackStore
+from track_index import ClusterIndex, INDEX_DIR_NAME
+
+# Catalog of the current worker process, its loaded snapshot and retrieval options, see `_init_worker`
+_worker_catalog = None
+_worker_snapshot = None
+_worker_retrieval = {}
+_worker_lock = threading.Lock()
+
+
+class PoolBusyError(Exception):
+    """
+    Raised when `ScoringPool` already holds `max_pending` requests.
+    """
+
+
+def _init_worker(db_path: str, retrieval: dict = None) -> None:
+    global _worker_catalog, _worker_snapshot, _worker_retrieval
+
+    # Memory-mapped, so every worker shares the same page cache instead of holding a copy
+    _worker_catalog = Catalog(db_path)
+    _worker_retrieval = retrieval or {}
+    _worker_snapshot = open_snapshot(_worker_catalog, name_index=False, **_worker_retrieval)
+
+
+def _score(query: np.ndarray, clusters: int | np.ndarray, top_k: int, version: int = None) -> tuple[np.ndarray, np.ndarray]:
+    global _worker_snapshot
+
+    snapshot = _worker_snapshot
+
+    # Score against the catalog version the request started with
+    if version is not None and version != snapshot.version:
+        with _worker_lock:
+            if version != _worker_snapshot.version:
+                _worker_snapshot = open_snapshot(_worker_catalog, version, name_index=False, **_worker_retrieval)
+            snapshot = _worker_snapshot
+
+    return snapshot.backend.search(query=query, cluster=clusters, top_k=top_k)
+
+
+class ScoringPool():
+    """
+    Pool of workers that score queries against the cluster index off the event loop.
+
+    Attributes
+    ----------
+    `kind`: str
+        'process' or 'thread'.
+    `max_workers`: int
+        The amount of workers.
+    `max_pending`: int
+        The amount of requests queued or running before new ones are rejected with `PoolBusyError`.
+    `n_pending`: int
+        The amount of requests queued or running now.
+    `n_rejected`: int
+        The amount of requests rejected so far.
+    """
+
+    def __init__(
+        self,
+        db_path: str = '../data/track_store',
+        kind: str = 'process',
+        max_workers: int = None,
+        max_pending: int = 256,
+        retrieval: str = 'cluster_scan',
+        ann_path: str = None,
+        retrieval_options: dict = None,
+        precision: str = 'float32'
+    ) -> None:
+        """
+        Initialize `ScoringPool` object and start its workers.
+
+        Parameters
+        ----------
+        `db_path`: str = '../data/track_store'
+            Path to the catalog root. Workers follow the catalog version of every request.
+        `kind`: str = 'process'
+            'process' to score in worker processes, 'thread' to score in threads of this process.
+        `max_workers`: int = None
+            The amount of workers, `None` for the amount of CPU cores.
+        `max_pending`: int = 256
+            The amount of requests queued or running before new ones are rejected.
+        `retrieval`: str = 'cluster_scan'
+            Retrieval backend of the workers, see `RecSys`.
+        `ann_path`: str = None
+            Path to the ANN index, required by 'ivf_pq'.
+        `retrieval_options`: dict = None
+            Options of the retrieval backend.
+        `precision`: str = 'float32'
+            Scan precision of the cluster index, see `RecSys`.
+
+        Returns
+        ----------
+        `self`: ScoringPool
+            ScoringPool class object.
+        """
+
+        assert kind in ('process', 'thread'), (
+            "`kind` must be 'process' or 'thread'."
+        )
+
+        # Save the cluster index next to the store if it is missing, so workers only map it
+        index_path = os.path.join(db_path, INDEX_DIR_NAME)
+        if Catalog(db_path).current_version() == 0 and not os.path.exists(os.path.join(index_path, 'meta.json')):
+            store = TrackStore(db_path)
+            ClusterIndex.build(features=store.features, clusters=store.clusters).save(index_path)
+
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.n_pending = 0
+        self.n_rejected = 0
+
+        retrieval = {'precision': precision, 'retrieval': retrieval, 'ann_path': ann_path, **(retrieval_options or {})}
+
+        if kind == 'process':
+            # Forking a process that already runs threads can copy a lock some thread holds, so workers
+            # are started from a clean server process instead. Like with 'spawn', they import the main module
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_worker, initargs=(db_path, retrieval)
+            )
+        else:
+            # NumPy releases the GIL in matrix products, so threads share one index and still run in parallel
+            _init_worker(db_path, retrieval)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scoring')
+
+    async def score(
+        self,
+        query: np.ndarray = None,
+        clusters: int | np.ndarray = None,
+        top_k: int = 5,
+        version: int = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score `query` against `clusters` of catalog `version` in a worker, see `ClusterIndex.search`.
+        `None` uses the version the worker has loaded.
+
+        Raises
+        ----------
+        `PoolBusyError`
+            If `max_pending` requests are already queued or running.
+        """
+
+        assert query is not None and clusters is not None, (
+            '`query` and `clusters` must be specified.'
+        )
+
+        if self.n_pending >= self.max_pending:
+            self.n_rejected += 1
+            raise PoolBusyError(f'{self.n_pending} scoring requests are already pending.')
+
+        self.n_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, _score, query, clusters, top_k, version)
+        finally:
+            self.n_pending -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
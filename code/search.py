@@ -1,5 +1,22 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import threading
+
+from search_cache import SpotifyCache, MISSING
+from search_batching import AudioFeatureBatcher, chunked
+from rate_limit import RequestScheduler, retry_after
+from metrics import span
+
+SPOTIFY_API_URL = 'https://api.spotify.com/v1/'
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+
+def _spotipy_retry_after(error: Exception) -> float | None:
+    # `SpotifyException` keeps the status and headers of the response, connection errors have none
+    import requests
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return 0.0
+
+    return retry_after(getattr(error, 'http_status', None), getattr(error, 'headers', None))
 
 
 class TrackSearchEngine():
@@ -12,9 +29,26 @@ class TrackSearchEngine():
         Spotify client id
     `client_secret`: str = None
         Spotify client secret
+    `cache`: SpotifyCache = None
+        Cache of search results and audio features
+    `batcher`: AudioFeatureBatcher = None
+        Batches audio feature requests of concurrent callers
+    `scheduler`: RequestScheduler
+        Rate limits and retries all Spotify requests
+    `sp`: spotipy.Spotify
+        Spotify client, created (and spotipy imported) on first use
     """
 
-    def __init__(self, client_id: str = None, client_secret: str = None) -> None:
+    def __init__(
+        self,
+        client_id: str = None,
+        client_secret: str = None,
+        cache: SpotifyCache = None,
+        batch_window: float = None,
+        scheduler: RequestScheduler = None,
+        api_url: str = SPOTIFY_API_URL,
+        token_url: str = SPOTIFY_TOKEN_URL
+    ) -> None:
         """
         Implementation of the Track Search Engine
         
@@ -24,6 +58,16 @@ class TrackSearchEngine():
             Spotify client id
         `client_secret`: str = None
             Spotify client secret
+        `cache`: SpotifyCache = None
+            Cache of search results and audio features, `None` to disable caching
+        `batch_window`: float = None
+            Seconds to collect concurrent audio feature requests into one call, `None` to disable batching
+        `scheduler`: RequestScheduler = None
+            Scheduler shared with other Spotify clients, `None` for a scheduler of its own
+        `api_url`: str = SPOTIFY_API_URL
+            Base URL of Spotify Web API
+        `token_url`: str = SPOTIFY_TOKEN_URL
+            URL of Spotify token endpoint
 
         Returns
         ----------
@@ -38,9 +82,42 @@ class TrackSearchEngine():
         
         self.client_id = client_id
         self.client_secret = client_secret
+        self.api_url = api_url
+        self.token_url = token_url
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
         
-        self.client_credentials_manager = SpotifyClientCredentials(client_id=self.client_id, client_secret=self.client_secret)
-        self.sp = spotipy.Spotify(client_credentials_manager=self.client_credentials_manager)
+        self.client_credentials_manager = None
+        self._sp = None
+        self._sp_lock = threading.Lock()
+        self.cache = cache
+        self.batcher = AudioFeatureBatcher(fetch=self._audio_features, max_wait=batch_window) if batch_window is not None else None
+
+    @property
+    def sp(self):
+        # Tracks found in the local catalog never need Spotify, so startup does not import spotipy
+        if self._sp is None:
+            with self._sp_lock:
+                if self._sp is None:
+                    import requests
+                    import spotipy
+                    from spotipy.oauth2 import SpotifyClientCredentials
+
+                    self.client_credentials_manager = SpotifyClientCredentials(client_id=self.client_id, client_secret=self.client_secret)
+                    self.client_credentials_manager.OAUTH_TOKEN_URL = self.token_url
+
+                    # A plain session has no retrying adapter: spotipy would sleep through
+                    # `Retry-After` in the calling thread, `scheduler` retries instead
+                    sp = spotipy.Spotify(client_credentials_manager=self.client_credentials_manager, requests_session=requests.Session())
+                    sp.prefix = self.api_url
+                    self._sp = sp
+
+        return self._sp
+
+    def _search(self, query: str) -> dict:
+        return self.scheduler.call(lambda: self.sp.search(q=query, type='track', limit=1), _spotipy_retry_after)
+
+    def _audio_features(self, track_ids: list[str]) -> list[dict]:
+        return self.scheduler.call(lambda: self.sp.audio_features(track_ids), _spotipy_retry_after)
 
     def search_track(self, query):
         """
@@ -56,8 +133,23 @@ class TrackSearchEngine():
         `result`: dict
             The dictionary containing features of a first track.
         """
-        results = self.sp.search(q=query, type='track', limit=1)
-        return results['tracks']['items'][0]
+        if self.cache is not None:
+            cache_key = ' '.join(query.lower().split())
+            track_id = self.cache.get('query', cache_key)
+            if track_id is not MISSING:
+                track = self.cache.get('track', track_id)
+                if track is not MISSING:
+                    return track
+
+        with span('spotify_search'):
+            results = self._search(query)
+        track = results['tracks']['items'][0]
+
+        if self.cache is not None:
+            self.cache.set('query', cache_key, track['id'])
+            self.cache.set('track', track['id'], track)
+
+        return track
 
     def get_audio_features(self, track_id):
         """
@@ -73,9 +165,56 @@ class TrackSearchEngine():
         `features`: dict
             Dictionary containing features.
         """
-        audio_info = self.sp.audio_features([track_id])[0]
+        if self.cache is not None:
+            audio_info = self.cache.get('features', track_id)
+            if audio_info is not MISSING:
+                return audio_info
+
+        with span('spotify_audio_features'):
+            if self.batcher is not None:
+                audio_info = self.batcher.get(track_id)
+            else:
+                audio_info = self._audio_features([track_id])[0]
+
+        # Tracks without audio features are not cached, they may get them later
+        if self.cache is not None and audio_info is not None:
+            self.cache.set('features', track_id, audio_info)
+
         return audio_info
 
+    def get_many_audio_features(self, track_ids):
+        """
+        Extracting numerical audio features of several tracks with as few calls as possible.
+        
+        Parameters
+        ----------
+        `track_ids`: list[str]
+            IDs of the tracks on Spotify
+        
+        Returns
+        ----------
+        `features`: list[dict]
+            Dictionaries containing features, `None` for tracks without features.
+        """
+        features = {}
+        if self.cache is not None:
+            for track_id in track_ids:
+                audio_info = self.cache.get('features', track_id)
+                if audio_info is not MISSING:
+                    features[track_id] = audio_info
+
+        # One call per `AUDIO_FEATURES_MAX_IDS` distinct ids that are not cached
+        missing_ids = list(dict.fromkeys(track_id for track_id in track_ids if track_id not in features))
+        for chunk in chunked(missing_ids):
+            with span('spotify_audio_features'):
+                chunk_features = self._audio_features(chunk)
+            for track_id, audio_info in zip(chunk, chunk_features):
+                features[track_id] = audio_info
+                if self.cache is not None and audio_info is not None:
+                    self.cache.set('features', track_id, audio_info)
+
+        return [features.get(track_id) for track_id in track_ids]
+
     def find_track_features(self, title, artist=None):
         """
         Combination of `search_track` and `get_audio_features`.
@@ -101,6 +240,45 @@ class TrackSearchEngine():
         features = features | self.get_audio_features(features['id'])
         return features
 
+    def find_many_track_features(self, titles, artists=None):
+        """
+        Bulk version of `find_track_features`: one search per title and
+        audio features of all found tracks in chunks of 100 ids.
+        
+        Parameters
+        ----------
+        `titles`: list[str]
+            Titles of tracks
+        `artists`: list[str] = None
+            Names of the artists, one per title.
+        
+        Returns
+        ----------
+        `features`: list[dict]
+            Dictionaries containing alphanumerical features, `None` for tracks
+            that are not found or have no audio features.
+        """
+        if artists is None:
+            artists = [None] * len(titles)
+
+        tracks = []
+        for title, artist in zip(titles, artists):
+            query = f'track:{title} artist:{artist}' if artist else f'track:{title}'
+            try:
+                tracks.append(self.search_track(query))
+            except IndexError:
+                tracks.append(None)
+
+        audio_infos = self.get_many_audio_features([track['id'] for track in tracks if track is not None])
+        audio_infos = iter(audio_infos)
+
+        features = []
+        for track in tracks:
+            audio_info = next(audio_infos) if track is not None else None
+            features.append(track | audio_info if audio_info is not None else None)
+
+        return features
+
     def format_track(self, info):
         """
         Formatting of features to the same format as in DataFrame.
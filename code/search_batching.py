@@ -0,0 +1,327 @@
+# Import necessary dependencies
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+from rate_limit import current_scheduling, shared_scheduling
+
+# Maximum amount of track ids accepted by one Spotify `audio-features` call
+AUDIO_FEATURES_MAX_IDS = 100
+
+
+def chunked(items: list, chunk_size: int = AUDIO_FEATURES_MAX_IDS) -> list[list]:
+    """
+    Split `items` into consecutive chunks of at most `chunk_size` elements.
+    """
+
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+
+class AudioFeatureBatcher():
+    """
+    Collect audio feature requests from concurrent callers and fetch them in batches.
+
+    The first pending request opens a window of `max_wait` seconds; every request
+    that arrives within the window (up to `max_batch_size` distinct ids) is sent
+    to Spotify in one call and each caller gets its own result back. The call is
+    scheduled for all callers of the batch, see `rate_limit.shared_scheduling`.
+
+    Attributes
+    ----------
+    `fetch`: Callable[[list[str]], list[dict]]
+        Function that fetches audio features of several track ids, e.g. `spotipy.Spotify.audio_features`.
+    `max_batch_size`: int
+        The amount of distinct track ids sent in one call.
+    `max_wait`: float
+        Seconds to wait for more requests after the first one.
+    `n_requests`: int
+        The amount of requested track ids.
+    `n_calls`: int
+        The amount of calls made to `fetch`.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[list[str]], list[dict]] = None,
+        max_batch_size: int = AUDIO_FEATURES_MAX_IDS,
+        max_wait: float = 0.005
+    ) -> None:
+        """
+        Initialize `AudioFeatureBatcher` object and start its worker thread.
+
+        Parameters
+        ----------
+        `fetch`: Callable[[list[str]], list[dict]] = None
+            Function that fetches audio features of several track ids.
+        `max_batch_size`: int = AUDIO_FEATURES_MAX_IDS
+            The amount of distinct track ids sent in one call.
+        `max_wait`: float = 0.005
+            Seconds to wait for more requests after the first one.
+
+        Returns
+        ----------
+        `self`: AudioFeatureBatcher
+            AudioFeatureBatcher class object.
+        """
+
+        assert fetch is not None, (
+            '`fetch` must be specified.'
+        )
+        assert 0 < max_batch_size <= AUDIO_FEATURES_MAX_IDS, (
+            f'`max_batch_size` must be between 1 and {AUDIO_FEATURES_MAX_IDS}.'
+        )
+
+        self.fetch = fetch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_requests = 0
+        self.n_calls = 0
+
+        self._pending = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='audio-feature-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, track_id: str = None) -> Future:
+        """
+        Request audio features of one track.
+
+        Parameters
+        ----------
+        `track_id`: str = None
+            ID of the track on Spotify.
+
+        Returns
+        ----------
+        `future`: Future
+            Future resolved with the audio features dictionary (or `None`).
+        """
+
+        assert track_id is not None, (
+            '`track_id` must be specified.'
+        )
+        assert not self._closed, (
+            'Batcher is closed.'
+        )
+
+        future = Future()
+        # The worker thread does not see the `scheduling` block of the caller
+        self._pending.put((track_id, future, current_scheduling()))
+
+        return future
+
+    def get(self, track_id: str = None, timeout: float = None) -> dict:
+        """
+        Request audio features of one track and wait for them.
+        """
+
+        return self.submit(track_id).result(timeout=timeout)
+
+    def close(self) -> None:
+        """
+        Flush pending requests and stop the worker thread.
+        """
+
+        self._closed = True
+        self._pending.put(None)
+        self._worker.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+
+            batch = {item[0]: [item[1]]}
+            contexts = [item[2]]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+
+            # Collect requests until the window closes or the batch is full
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    stop = True
+                    break
+
+                batch.setdefault(item[0], []).append(item[1])
+                contexts.append(item[2])
+
+            self._dispatch(batch, contexts)
+
+            if stop:
+                return
+
+    def _dispatch(self, batch: dict[str, list[Future]], contexts: list[tuple]) -> None:
+        track_ids = list(batch)
+        self.n_requests += sum(map(len, batch.values()))
+        self.n_calls += 1
+
+        try:
+            with shared_scheduling(contexts):
+                results = self.fetch(track_ids)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        # Spotify returns `None` for unknown ids, pad in case the list is short
+        results = list(results or []) + [None] * (len(track_ids) - len(results or []))
+
+        for track_id, result in zip(track_ids, results):
+            for future in batch[track_id]:
+                future.set_result(result)
+
+
+class AsyncAudioFeatureBatcher():
+    """
+    Asyncio version of `AudioFeatureBatcher` for coroutines on one event loop.
+
+    The first pending request schedules a flush in `max_wait` seconds, a full
+    batch is flushed at once. Every batch is fetched in a task of its own, so a
+    cancelled caller only drops its own result.
+
+    Attributes
+    ----------
+    `fetch`: Callable[[list[str]], Awaitable[list[dict]]]
+        Coroutine function that fetches audio features of several track ids.
+    `max_batch_size`: int
+        The amount of distinct track ids sent in one call.
+    `max_wait`: float
+        Seconds to wait for more requests after the first one.
+    `n_requests`: int
+        The amount of requested track ids.
+    `n_calls`: int
+        The amount of calls made to `fetch`.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[list[str]], Awaitable[list[dict]]] = None,
+        max_batch_size: int = AUDIO_FEATURES_MAX_IDS,
+        max_wait: float = 0.005
+    ) -> None:
+        """
+        Initialize `AsyncAudioFeatureBatcher` object.
+
+        Parameters
+        ----------
+        `fetch`: Callable[[list[str]], Awaitable[list[dict]]] = None
+            Coroutine function that fetches audio features of several track ids.
+        `max_batch_size`: int = AUDIO_FEATURES_MAX_IDS
+            The amount of distinct track ids sent in one call.
+        `max_wait`: float = 0.005
+            Seconds to wait for more requests after the first one.
+
+        Returns
+        ----------
+        `self`: AsyncAudioFeatureBatcher
+            AsyncAudioFeatureBatcher class object.
+        """
+
+        assert fetch is not None, (
+            '`fetch` must be specified.'
+        )
+        assert 0 < max_batch_size <= AUDIO_FEATURES_MAX_IDS, (
+            f'`max_batch_size` must be between 1 and {AUDIO_FEATURES_MAX_IDS}.'
+        )
+
+        self.fetch = fetch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_requests = 0
+        self.n_calls = 0
+
+        self._batch = {}
+        self._contexts = []
+        self._flush = None
+        self._tasks = set()
+
+    async def get(self, track_id: str = None) -> dict:
+        """
+        Request audio features of one track and wait for them.
+
+        Parameters
+        ----------
+        `track_id`: str = None
+            ID of the track on Spotify.
+
+        Returns
+        ----------
+        `features`: dict
+            Audio features dictionary, `None` if the track has none.
+        """
+
+        assert track_id is not None, (
+            '`track_id` must be specified.'
+        )
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.setdefault(track_id, []).append(future)
+        self._contexts.append(current_scheduling())
+
+        if len(self._batch) >= self.max_batch_size:
+            self._send()
+        elif self._flush is None:
+            self._flush = loop.call_later(self.max_wait, self._send)
+
+        return await future
+
+    async def aclose(self) -> None:
+        """
+        Flush pending requests and wait for all batches in flight.
+        """
+
+        self._send()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _send(self) -> None:
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+
+        batch, self._batch = self._batch, {}
+        contexts, self._contexts = self._contexts, []
+        if not batch:
+            return
+
+        # A fresh context, so the batch is scheduled for all its callers and not with the deadline of whichever came first
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch, contexts), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: dict[str, list[asyncio.Future]], contexts: list[tuple]) -> None:
+        track_ids = list(batch)
+        self.n_requests += sum(map(len, batch.values()))
+        self.n_calls += 1
+
+        try:
+            with shared_scheduling(contexts):
+                results = await self.fetch(track_ids)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        # Spotify returns `None` for unknown ids, pad in case the list is short
+        results = list(results or []) + [None] * (len(track_ids) - len(results or []))
+
+        for track_id, result in zip(track_ids, results):
+            for future in batch[track_id]:
+                # Callers that were cancelled meanwhile already have a done future
+                if not future.done():
+                    future.set_result(result)
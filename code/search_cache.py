@@ -0,0 +1,300 @@
+# Import necessary dependencies
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Marks a cache miss, because `None` is a valid cached value
+MISSING = object()
+
+
+class LRUCache():
+    """
+    Thread-safe in-memory LRU cache with time-to-live.
+
+    Attributes
+    ----------
+    `max_size`: int
+        The amount of entries kept before the least recently used one is evicted.
+    `ttl`: float
+        Seconds an entry stays valid, `None` to keep entries forever.
+    `hits`: int
+        The amount of lookups that found a valid entry.
+    `misses`: int
+        The amount of lookups that found nothing or an expired entry.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = None) -> None:
+        """
+        Initialize `LRUCache` object.
+
+        Parameters
+        ----------
+        `max_size`: int = 10_000
+            The amount of entries kept before the least recently used one is evicted.
+        `ttl`: float = None
+            Seconds an entry stays valid, `None` to keep entries forever.
+
+        Returns
+        ----------
+        `self`: LRUCache
+            LRUCache class object.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        """
+        Return the value cached for `key` or `default`.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[1] > self.ttl):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        """
+        Cache `value` for `key`, evicting the least recently used entries over `max_size`.
+        """
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache():
+    """
+    Persistent key-value cache in a SQLite database with time-to-live and size-based eviction.
+
+    Values must be JSON serializable. Keys live in separate namespaces.
+
+    Attributes
+    ----------
+    `path`: str
+        Path to the SQLite database file.
+    `max_size`: int
+        The amount of entries kept before the least recently used ones are evicted.
+    `ttl`: float
+        Seconds an entry stays valid, `None` to keep entries forever.
+    `hits`: int
+        The amount of lookups that found a valid entry.
+    `misses`: int
+        The amount of lookups that found nothing or an expired entry.
+    """
+
+    def __init__(self, path: str = None, max_size: int = 1_000_000, ttl: float = None) -> None:
+        """
+        Initialize `SQLiteCache` object.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the SQLite database file. Created if it does not exist.
+        `max_size`: int = 1_000_000
+            The amount of entries kept before the least recently used ones are evicted.
+        `ttl`: float = None
+            Seconds an entry stays valid, `None` to keep entries forever.
+
+        Returns
+        ----------
+        `self`: SQLiteCache
+            SQLiteCache class object.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, key))'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        self._size = self._connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get(self, namespace: str, key: str, default=MISSING):
+        """
+        Return the value cached for `key` in `namespace` or `default`.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, created FROM cache WHERE namespace = ? AND key = ?', (namespace, key)
+            ).fetchone()
+
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self._connection.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (namespace, key))
+                    self._size -= 1
+                self.misses += 1
+                return default
+
+            self._connection.execute('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?', (now, namespace, key))
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value) -> None:
+        """
+        Cache `value` for `key` in `namespace`, evicting the least recently used entries over `max_size`.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            inserted = self._connection.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?, ?)', (namespace, key, json.dumps(value), now, now)
+            ).rowcount
+            if inserted:
+                self._size += 1
+            else:
+                self._connection.execute(
+                    'UPDATE cache SET value = ?, created = ?, accessed = ? WHERE namespace = ? AND key = ?',
+                    (json.dumps(value), now, now, namespace, key)
+                )
+
+            # Evict a tenth of the cache at once, so eviction does not run on every insert
+            if self._size > self.max_size:
+                evicted = self._connection.execute(
+                    'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY accessed LIMIT ?)',
+                    (self._size - self.max_size + self.max_size // 10,)
+                ).rowcount
+                self._size -= evicted
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class SpotifyCache():
+    """
+    Two-level cache of Spotify lookups: in-memory LRU in front of an optional SQLite store.
+
+    Namespaces used by `TrackSearchEngine`:
+
+    - `query`: normalized search query -> track id;
+    - `track`: track id -> track object returned by search;
+    - `features`: track id -> audio features.
+
+    Attributes
+    ----------
+    `memory`: LRUCache
+        First level cache.
+    `disk`: SQLiteCache
+        Second level cache, `None` if `path` is not specified.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        memory_size: int = 10_000,
+        memory_ttl: float = 3600,
+        disk_size: int = 1_000_000,
+        disk_ttl: float = 30 * 24 * 3600
+    ) -> None:
+        """
+        Initialize `SpotifyCache` object.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the SQLite database file, `None` to keep the cache in memory only.
+        `memory_size`: int = 10_000
+            The amount of entries kept in memory.
+        `memory_ttl`: float = 3600
+            Seconds an entry stays valid in memory.
+        `disk_size`: int = 1_000_000
+            The amount of entries kept on disk.
+        `disk_ttl`: float = 30 * 24 * 3600
+            Seconds an entry stays valid on disk.
+
+        Returns
+        ----------
+        `self`: SpotifyCache
+            SpotifyCache class object.
+        """
+
+        self.memory = LRUCache(max_size=memory_size, ttl=memory_ttl)
+        self.disk = SQLiteCache(path=path, max_size=disk_size, ttl=disk_ttl) if path is not None else None
+
+    def get(self, namespace: str, key: str, default=MISSING):
+        """
+        Return the value cached for `key` in `namespace` or `default`.
+        """
+
+        value = self.memory.get((namespace, key))
+        if value is not MISSING:
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(namespace, key)
+            if value is not MISSING:
+                # Promote to the first level
+                self.memory.set((namespace, key), value)
+                return value
+
+        return default
+
+    def set(self, namespace: str, key: str, value) -> None:
+        """
+        Cache `value` for `key` in `namespace` on both levels.
+        """
+
+        self.memory.set((namespace, key), value)
+
+        if self.disk is not None:
+            self.disk.set(namespace, key, value)
+
+    def stats(self) -> dict:
+        """
+        Hit and miss counters and sizes of both levels.
+        """
+
+        stats = {'memory_hits': self.memory.hits, 'memory_misses': self.memory.misses, 'memory_size': len(self.memory)}
+
+        if self.disk is not None:
+            stats |= {'disk_hits': self.disk.hits, 'disk_misses': self.disk.misses, 'disk_size': len(self.disk)}
+
+        return stats
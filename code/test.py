@@ -1,7 +1,13 @@
-from search import find_track_features, format_track
+from search import TrackSearchEngine
 
-f = find_track_features('FUKUROU')
+# Manual check of the Spotify search with real credentials, see `benchmark_suite.py` for offline benchmarks
+CLIENT_ID = open('clientID.txt').read().strip()
+CLIENT_SECRET = open('clientSecret.txt').read().strip()
 
-form = format_track(f)
+search_engine = TrackSearchEngine(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+
+f = search_engine.find_track_features('FUKUROU')
+
+form = search_engine.format_track(f)
 for elem in form:
     print(f'{elem}:\t{form[elem]}')
\ No newline at end of file
@@ -0,0 +1,32 @@
+# Import necessary dependencies
+import os
+import sys
+
+import pytest
+
+# Modules of the bot are imported by name, like in `code/`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def synthetic_catalog(tmp_path_factory) -> dict:
+    """
+    A small model and track store fitted on synthetic tracks, shared by all tests.
+    """
+
+    from benchmark_suite import make_synthetic_catalog
+
+    return make_synthetic_catalog(str(tmp_path_factory.mktemp('synthetic')), n_tracks=3000, max_workers=1)
+
+
+@pytest.fixture
+def fake_spotify():
+    """
+    Local fake Spotify server, see `fake_spotify.FakeSpotify`.
+    """
+
+    from fake_spotify import FakeSpotify
+
+    server = FakeSpotify()
+    yield server
+    server.close()
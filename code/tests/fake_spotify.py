@@ -0,0 +1,104 @@
+# Import necessary dependencies
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def fake_track(query: str) -> dict:
+    track_id = 'id_' + ''.join(c for c in query.split(':')[-1] if c.isalnum())
+
+    return {
+        'id': track_id, 'name': query, 'track_number': 1, 'disc_number': 1, 'explicit': False, 'popularity': 1,
+        'duration_ms': 200_000, 'album': {'name': 'Album', 'id': 'album', 'release_date': '2001-02-03'},
+        'artists': [{'name': 'Artist', 'id': 'artist'}]
+    }
+
+
+def fake_audio_features(track_id: str) -> dict | None:
+    # Ids starting with `none` have no audio features, like some tracks on Spotify
+    if track_id.startswith('none'):
+        return None
+
+    return {'id': track_id, 'danceability': 0.5, 'energy': 0.5, 'tempo': 120.0}
+
+
+class FakeSpotify():
+    """
+    Local HTTP server with the token, `search` and `audio-features` endpoints of Spotify.
+
+    Attributes
+    ----------
+    `url`: str
+        Base URL of the server.
+    `requests`: list[tuple]
+        `(time, path, params)` of every API request, answered or not.
+    `responses`: list[tuple]
+        Scripted `(status, headers)` answers given to the next API requests before normal ones.
+    `delay`: float
+        Seconds every answer is delayed.
+    """
+
+    def __init__(self) -> None:
+        self.requests = []
+        self.responses = []
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._reply(200, {'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                path = url.path.rstrip('/').rsplit('/', 1)[-1]
+
+                with fake._lock:
+                    fake.requests.append((time.monotonic(), path, params))
+                    scripted = fake.responses.pop(0) if fake.responses else None
+
+                time.sleep(fake.delay)
+
+                if scripted is not None:
+                    status, headers = scripted
+                    return self._reply(status, {'error': {'status': status}}, headers)
+                if path == 'search':
+                    return self._reply(200, {'tracks': {'items': [fake_track(params['q'])]}})
+                if path == 'audio-features':
+                    return self._reply(200, {'audio_features': [fake_audio_features(track_id) for track_id in params['ids'].split(',')]})
+
+                self._reply(404, {})
+
+            def _reply(self, status: int, body: dict, headers: dict = {}) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def api_requests(self, path: str) -> list[dict]:
+        """
+        Params of requests to `path`, in the order they arrived.
+        """
+
+        with self._lock:
+            return [params for _, request_path, params in self.requests if request_path == path]
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
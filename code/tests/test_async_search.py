@@ -0,0 +1,87 @@
+# Import necessary dependencies
+import asyncio
+
+from async_search import AsyncTrackSearchEngine
+from fake_spotify import fake_audio_features
+from search_cache import SpotifyCache
+
+
+def make_engine(fake_spotify, **kwargs) -> AsyncTrackSearchEngine:
+    return AsyncTrackSearchEngine(
+        client_id='id', client_secret='secret', api_url=fake_spotify.url, token_url=fake_spotify.url + 'api/token', **kwargs
+    )
+
+
+def test_concurrent_audio_features_share_one_call(fake_spotify):
+    async def run():
+        engine = make_engine(fake_spotify, cache=SpotifyCache(), batch_window=0.05)
+        try:
+            results = await asyncio.gather(*[engine.get_audio_features(track_id) for track_id in ['a', 'b', 'a', 'none1']])
+            # Cached now, no more calls
+            cached = await engine.get_audio_features('a')
+        finally:
+            await engine.aclose()
+        return results, cached
+
+    results, cached = asyncio.run(run())
+
+    assert results == [fake_audio_features('a'), fake_audio_features('b'), fake_audio_features('a'), None]
+    assert cached == fake_audio_features('a')
+    assert [params['ids'] for params in fake_spotify.api_requests('audio-features')] == ['a,b,none1']
+
+
+def test_full_batch_is_sent_without_waiting(fake_spotify):
+    async def run():
+        engine = make_engine(fake_spotify, batch_window=60)
+        engine.batcher.max_batch_size = 3
+        try:
+            return await asyncio.wait_for(asyncio.gather(*[engine.get_audio_features(f't{i}') for i in range(3)]), 5)
+        finally:
+            await engine.aclose()
+
+    assert len(asyncio.run(run())) == 3
+    assert len(fake_spotify.api_requests('audio-features')) == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_batch(fake_spotify):
+    fake_spotify.delay = 0.1
+
+    async def run():
+        engine = make_engine(fake_spotify, batch_window=0.01)
+        try:
+            cancelled = asyncio.create_task(engine.get_audio_features('a'))
+            other = asyncio.create_task(engine.get_audio_features('b'))
+            await asyncio.sleep(0.05)
+            cancelled.cancel()
+            return await other
+        finally:
+            await engine.aclose()
+
+    assert asyncio.run(run()) == fake_audio_features('b')
+
+
+def test_without_batching_every_lookup_is_a_call(fake_spotify):
+    async def run():
+        engine = make_engine(fake_spotify)
+        try:
+            return await asyncio.gather(*[engine.get_audio_features(track_id) for track_id in ['a', 'b']])
+        finally:
+            await engine.aclose()
+
+    assert asyncio.run(run()) == [fake_audio_features('a'), fake_audio_features('b')]
+    assert sorted(params['ids'] for params in fake_spotify.api_requests('audio-features')) == ['a', 'b']
+
+
+def test_fetch_error_reaches_every_caller(fake_spotify):
+    fake_spotify.responses = [(404, {})]
+
+    async def run():
+        engine = make_engine(fake_spotify, batch_window=0.01)
+        try:
+            return await asyncio.gather(*[engine.get_audio_features(track_id) for track_id in ['a', 'b']], return_exceptions=True)
+        finally:
+            await engine.aclose()
+
+    import httpx
+    results = asyncio.run(run())
+    assert all(isinstance(result, httpx.HTTPStatusError) for result in results)
@@ -0,0 +1,56 @@
+# Import necessary dependencies
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmark_suite import compare_to_baseline
+
+SUITE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark_suite.py')
+
+
+def run_suite_cli(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, SUITE, *args], cwd=os.path.dirname(SUITE), capture_output=True, text=True, timeout=300)
+
+
+def test_compare_to_baseline():
+    baseline = {'meta': {'n_tracks': 100}, 'metrics': {'recommend_local_p50_ms': 2.0, 'recommend_many_tracks_per_s': 1000.0, 'startup_s': 1.0}}
+    results = {'meta': {'n_tracks': 100}, 'metrics': {'recommend_local_p50_ms': 3.0, 'recommend_many_tracks_per_s': 900.0, 'new_metric': 1.0}}
+
+    comparison = compare_to_baseline(results, baseline, tolerance=0.2).set_index('metric')
+
+    # Metrics missing from either side are left out
+    assert comparison.index.tolist() == ['recommend_local_p50_ms', 'recommend_many_tracks_per_s']
+    assert comparison.loc['recommend_local_p50_ms', 'change'] == pytest.approx(0.5)
+    # Lower throughput is worse
+    assert comparison.loc['recommend_many_tracks_per_s', 'change'] == pytest.approx(0.1)
+    assert comparison['regression'].tolist() == [True, False]
+
+    with pytest.raises(AssertionError):
+        compare_to_baseline(results, baseline | {'meta': {'n_tracks': 200}})
+
+
+def test_cli_generates_runs_and_fails_on_regressions(tmp_path):
+    generated = run_suite_cli('generate', '--out', str(tmp_path / 'catalog'), '--tracks', '500', '--workers', '1')
+    assert generated.returncode == 0, generated.stderr
+    paths = ['--pkl', str(tmp_path / 'catalog' / 'k_means.pkl'), '--db', str(tmp_path / 'catalog' / 'track_store')]
+
+    # Impossible to match, so every latency is a regression
+    with open(tmp_path / 'baseline.json', 'w') as f:
+        json.dump({'meta': {'n_tracks': 500}, 'metrics': {'recommend_local_p50_ms': 1e-9, 'recommend_many_tracks_per_s': 1e12}}, f)
+
+    run = run_suite_cli('run', *paths, '--queries', '20', '--batch', '50', '--out', str(tmp_path / 'results.json'),
+                        '--baseline', str(tmp_path / 'baseline.json'))
+
+    assert run.returncode == 1, run.stderr
+    with open(tmp_path / 'results.json') as f:
+        results = json.load(f)
+    assert results['meta']['n_tracks'] == 500 and results['meta']['n_queries'] == 20
+    assert set(results['metrics']) >= {
+        'startup_s', 'startup_rss_mb', 'peak_rss_mb', 'preprocess_p50_ms', 'preprocess_p99_ms', 'recommend_local_p50_ms',
+        'recommend_local_p99_ms', 'recommend_remote_p50_ms', 'recommend_remote_p99_ms', 'recommend_many_tracks_per_s'
+    }
+    assert all(value > 0 for value in results['metrics'].values())
+    assert 'recommend_many_tracks_per_s' in run.stdout and 'True' in run.stdout
@@ -0,0 +1,74 @@
+# Import necessary dependencies
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import build_catalog
+from benchmark_suite import synthetic_tracks
+from build_catalog import build_catalog as build
+from catalog import Catalog
+from preprocessor import TrackPreprocessor
+
+
+@pytest.fixture(scope='module')
+def tracks_path(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp('raw') / 'tracks_features.csv')
+    synthetic_tracks(1000, seed=7).to_csv(path, index=False)
+
+    return path
+
+
+def test_chunked_build_matches_one_chunk(tracks_path, tmp_path):
+    whole = build(tracks_path=tracks_path, pkl_path=str(tmp_path / 'whole.pkl'), store_path=str(tmp_path / 'whole'),
+                  chunk_size=10_000, max_workers=1, seed=1)
+    chunked = build(tracks_path=tracks_path, pkl_path=str(tmp_path / 'chunked.pkl'), store_path=str(tmp_path / 'chunked'),
+                    chunk_size=128, max_workers=2, seed=1)
+
+    assert len(whole) == len(chunked) == 1000
+    assert whole.column('id', np.arange(1000)) == chunked.column('id', np.arange(1000))
+    # Only the incrementally fitted scaler differs, by rounding
+    assert np.allclose(whole.features, chunked.features, atol=1e-5)
+
+    # Stored features are what the saved model computes for the raw tracks
+    preprocessor = TrackPreprocessor(pkl_path=str(tmp_path / 'chunked.pkl'))
+    features, clusters = preprocessor.preprocess_array(synthetic_tracks(1000, seed=7).to_dict(orient='records'))
+    assert np.allclose(features, chunked.features, atol=1e-5)
+    assert np.mean(clusters == np.asarray(chunked.clusters)) > 0.99
+
+
+def test_rebuild_replaces_an_updated_catalog(synthetic_catalog, tracks_path, tmp_path):
+    root = str(tmp_path / 'catalog')
+    shutil.copytree(synthetic_catalog['db'], root)
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+    catalog = Catalog(root, centroids=preprocessor.centroids)
+    old = catalog.add_tracks(synthetic_tracks(5, start=100_000).to_dict(orient='records'), preprocessor=preprocessor)
+
+    store = build(tracks_path=tracks_path, pkl_path=str(tmp_path / 'k_means.pkl'), store_path=root, max_workers=1)
+
+    snapshot = catalog.snapshot()
+    assert snapshot.version == old.version + 1 and len(snapshot.store) == len(store) == 1000
+    # Readers of the previous version can still load it
+    assert len(catalog.snapshot(old.version).store) == 3005
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('build_catalog_')]
+
+
+def test_failed_build_keeps_the_catalog(synthetic_catalog, tracks_path, tmp_path, monkeypatch):
+    root = str(tmp_path / 'catalog')
+    shutil.copytree(synthetic_catalog['db'], root)
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+    catalog = Catalog(root, centroids=preprocessor.centroids)
+    version = catalog.add_tracks(synthetic_tracks(5, start=100_000).to_dict(orient='records'), preprocessor=preprocessor).version
+    files = sorted(os.listdir(root))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('interrupted')
+
+    monkeypatch.setattr(build_catalog.TrackStoreWriter, 'append', fail)
+    with pytest.raises(RuntimeError):
+        build(tracks_path=tracks_path, pkl_path=str(tmp_path / 'k_means.pkl'), store_path=root, max_workers=1)
+
+    assert sorted(os.listdir(root)) == files
+    assert catalog.current_version() == version and len(catalog.snapshot().store) == 3005
+    assert not os.path.exists(tmp_path / 'k_means.pkl')
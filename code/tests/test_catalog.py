@@ -0,0 +1,118 @@
+# Import necessary dependencies
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+from benchmark_suite import synthetic_tracks
+from catalog import BackgroundCompactor, Catalog
+from preprocessor import TrackPreprocessor
+from track_index import normalize, normalize_rows, probe_clusters
+from track_store import TrackStore
+
+
+@pytest.fixture
+def catalog(synthetic_catalog, tmp_path):
+    root = str(tmp_path / 'catalog')
+    shutil.copytree(synthetic_catalog['db'], root)
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+
+    return Catalog(root, centroids=preprocessor.centroids), preprocessor
+
+
+def new_tracks(n_tracks: int, start: int = 100_000) -> list[dict]:
+    return synthetic_tracks(n_tracks, start=start).to_dict(orient='records')
+
+
+def test_find_rows_by_id(catalog):
+    catalog, _ = catalog
+    store = TrackStore(catalog.root)
+    ids = store.column('id', np.array([5, 17, 2999]))
+
+    assert store.find(ids + ['unknown']).tolist() == [5, 17, 2999]
+    assert store.find([]).tolist() == []
+
+
+def test_added_track_replaces_the_old_one(catalog):
+    catalog, preprocessor = catalog
+    old_id = TrackStore(catalog.root).column('id', np.array([7]))[0]
+    track = new_tracks(1)[0] | {'id': old_id, 'name': 'Replacement'}
+
+    snapshot = catalog.add_tracks([track] + new_tracks(2, start=200_000), preprocessor=preprocessor)
+
+    assert snapshot.manifest['removed'] == {'.': [7]}
+    assert snapshot.name_index.lookup('Replacement') == 3000
+
+    snapshot = catalog.remove_tracks([old_id])
+    assert sorted(snapshot.removed_rows().tolist()) == [7, 3000]
+
+
+def test_last_of_duplicate_ids_in_one_batch_is_added(catalog):
+    catalog, preprocessor = catalog
+    first, other = new_tracks(2)
+    duplicate = first | {'name': 'Second version'}
+
+    snapshot = catalog.add_tracks([first, other, duplicate], preprocessor=preprocessor)
+
+    assert len(snapshot.store) == 3002
+    assert snapshot.store.column('name', np.array([3000, 3001])) == [other['name'], 'Second version']
+
+
+def test_removed_tracks_do_not_crowd_out_live_ones(catalog):
+    catalog, preprocessor = catalog
+    catalog.add_tracks(new_tracks(50), preprocessor=preprocessor)
+
+    query = np.asarray(catalog.snapshot().store.features[0], dtype=np.float64)
+    cluster = int(probe_clusters(query=query, centroids=preprocessor.centroids, n_probe=1)[0])
+
+    # Remove all but 3 tracks of the query's cluster
+    snapshot = catalog.snapshot()
+    in_cluster = np.flatnonzero(np.asarray(snapshot.store.clusters[np.arange(len(snapshot.store))]) == cluster)
+    snapshot = catalog.remove_tracks(snapshot.store.column('id', in_cluster[3:]))
+    alive = np.setdiff1d(np.arange(len(snapshot.store)), snapshot.removed_rows())
+
+    vectors = normalize_rows(np.asarray(snapshot.store.features[alive], dtype=np.float64))
+    expected = alive[np.lexsort((alive, -(vectors @ normalize(query))))]
+
+    row_ids, similarity = snapshot.index.search(query=query, cluster=cluster, top_k=10)
+    assert set(row_ids.tolist()) == set(in_cluster[:3].tolist())
+    assert np.isfinite(similarity).all()
+
+    row_ids, _ = snapshot.index.search_exact(query=query, top_k=10)
+    assert row_ids.tolist() == expected[:10].tolist()
+
+    row_ids, similarity = snapshot.index.search_many(queries=query[None], clusters=np.array([cluster]), top_k=10)
+    assert set(row_ids[0, :3].tolist()) == set(in_cluster[:3].tolist())
+    assert (row_ids[0, 3:] == -1).all() and np.isneginf(similarity[0, 3:]).all()
+
+
+def test_background_compactor_compacts_and_stops(catalog):
+    catalog, preprocessor = catalog
+    catalog.add_tracks(new_tracks(10), preprocessor=preprocessor)
+    catalog.remove_tracks(TrackStore(catalog.root).column('id', np.array([0])))
+
+    compactor = BackgroundCompactor(catalog, interval=0.01, max_segments=1, max_removed=0).start()
+    deadline = time.monotonic() + 10
+    while compactor.n_compactions == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    compactor.stop()
+
+    snapshot = catalog.snapshot()
+    assert compactor.n_compactions == 1
+    assert len(snapshot.manifest['segments']) == 1 and snapshot.manifest['removed'] == {}
+    assert len(snapshot.store) == 3009
+
+
+def test_rec_sys_runs_the_compactor(catalog, synthetic_catalog):
+    from recsys import RecSys
+
+    catalog, preprocessor = catalog
+    catalog.add_tracks(new_tracks(10), preprocessor=preprocessor)
+
+    rec_sys = RecSys('id', 'secret', pkl_path=synthetic_catalog['pkl'], db_path=catalog.root, compaction_interval=60)
+    assert rec_sys.compactor._thread.is_alive()
+
+    rec_sys.close()
+    assert not rec_sys.compactor._thread.is_alive()
+    assert RecSys('id', 'secret', pkl_path=synthetic_catalog['pkl'], db_path=catalog.root).compactor is None
@@ -0,0 +1,109 @@
+# Import necessary dependencies
+import numpy as np
+import pandas as pd
+
+from catalog_search import CatalogNameIndex, normalize_text, trigrams
+from track_store import TrackStore, TrackStoreWriter
+
+TITLES = [
+    ('Лето 2020', 'Кино'),
+    ('夜に駆ける', 'YOASOBI'),
+    ('Halo', 'Beyoncé'),
+    ('2020', 'Someone'),
+    ('Bohemian Rhapsody', 'Queen'),
+    ('Ｆｕｌｌｗｉｄｔｈ Song', 'Band')
+]
+
+
+def make_store(path: str) -> TrackStore:
+    metadata = pd.DataFrame({
+        'id': [f'id{i}' for i in range(len(TITLES))],
+        'name': [name for name, _ in TITLES],
+        'album': 'Album',
+        'artists': [str([artist]) for _, artist in TITLES],
+        'track_number': 1
+    })
+
+    with TrackStoreWriter(path, features=['a']) as writer:
+        writer.append(features=np.zeros((len(TITLES), 1)), clusters=np.zeros(len(TITLES)), metadata=metadata)
+
+    return TrackStore(path)
+
+
+def test_normalize_text_keeps_every_script():
+    assert normalize_text('Лето 2020') == 'лето 2020'
+    assert normalize_text('夜に駆ける') == '夜に駆ける'
+    assert normalize_text('  Beyoncé — HALO!! ') == 'beyoncé halo'
+    assert normalize_text('ＳＴＲＡẞＥ_mix') == 'strasse mix'
+
+
+def test_lookup_non_latin_titles(tmp_path):
+    index = CatalogNameIndex.build(make_store(str(tmp_path / 'store')))
+
+    assert index.lookup('лето 2020') == 0
+    assert index.lookup('Кино Лето 2020') == 0
+    assert index.lookup('夜に駆ける') == 1
+    assert index.lookup('halo beyoncé') == 2
+    assert index.lookup('fullwidth song') == 5
+
+
+def test_lookup_rejects_digit_queries(tmp_path):
+    index = CatalogNameIndex.build(make_store(str(tmp_path / 'store')))
+
+    # A year is ambiguous even when a title matches it exactly
+    assert index.lookup('2020') is None
+    assert index.lookup('!!!') is None
+
+
+def test_fuzzy_lookup_tolerates_typos_but_not_prefixes(tmp_path):
+    index = CatalogNameIndex.build(make_store(str(tmp_path / 'store')))
+
+    assert index.lookup('Bohemian Rhapsody!') == 4
+    assert index.lookup('Bohemian Rhapsodyy', min_score=0.8) == 4
+    assert index.lookup('Bohemian') is None
+
+
+def test_stale_saved_index_is_rebuilt(tmp_path):
+    import json
+    import os
+
+    store = make_store(str(tmp_path / 'store'))
+    CatalogNameIndex.from_store(store)
+
+    meta_path = os.path.join(store.path, 'name_index', 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    del meta['format_version']
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    assert CatalogNameIndex.from_store(store).lookup('夜に駆ける') == 1
+    with open(meta_path) as f:
+        assert 'format_version' in json.load(f)
+
+
+def test_fuzzy_matches_brute_force(synthetic_catalog):
+    store = TrackStore(synthetic_catalog['db'])
+    index = CatalogNameIndex.build(store)
+    names = store.column('name', np.arange(len(store)))
+    title_grams = [set(trigrams(normalize_text(name)).tolist()) if normalize_text(name) else set() for name in names]
+
+    for name in names[:20]:
+        query = name[:-1] + 'x'
+        grams = set(trigrams(normalize_text(query)).tolist())
+        scores = np.array([len(grams & other) / len(grams | other) if other else 0.0 for other in title_grams])
+
+        for min_score in [0.2, 0.5, 0.9]:
+            rows, found = index.fuzzy(query, limit=len(store), min_score=min_score)
+
+            expected = np.flatnonzero(scores >= min_score - 1e-9)
+            np.testing.assert_array_equal(np.sort(rows), expected)
+            np.testing.assert_allclose(found, scores[rows])
+
+
+def test_fuzzy_gives_up_on_too_many_candidates(synthetic_catalog):
+    index = CatalogNameIndex.build(TrackStore(synthetic_catalog['db']))
+    name = index.store.column('name', [0])[0]
+
+    assert len(index.fuzzy(name, min_score=0.2)[0]) > 0
+    assert len(index.fuzzy(name, min_score=0.2, max_candidates=1)[0]) == 0
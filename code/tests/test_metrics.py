@@ -0,0 +1,112 @@
+# Import necessary dependencies
+import asyncio
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry, MetricsServer, SamplingProfiler
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def parse(text: str) -> dict:
+    """
+    Samples of the Prometheus text format as {(name, labels): value}.
+    """
+
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        samples[name, labels or ''] = float(value)
+
+    return samples
+
+
+def test_render_histograms_and_gauges():
+    registry = MetricsRegistry(enabled=True, buckets=(0.001, 0.01, 0.1))
+    for seconds in [0.0005, 0.005, 0.005, 0.05, 2.0]:
+        registry.observe('scoring', seconds)
+    registry.observe('preprocess', 0.002, error=True)
+    registry.gauge('pending', lambda: 3, help='Pending requests.')
+    registry.gauge('rejected_total', lambda: 7, kind='counter', help='Rejected requests.')
+
+    text = registry.render()
+    samples = parse(text)
+
+    assert [samples['recsys_stage_seconds_bucket', f'stage="scoring",le="{bound}"'] for bound in ['0.001', '0.01', '0.1', '+Inf']] == [1, 3, 4, 5]
+    assert samples['recsys_stage_seconds_count', 'stage="scoring"'] == 5
+    assert samples['recsys_stage_seconds_sum', 'stage="scoring"'] == pytest.approx(2.0605)
+    assert samples['recsys_stage_errors_total', 'stage="scoring"'] == 0
+    assert samples['recsys_stage_errors_total', 'stage="preprocess"'] == 1
+    assert samples['recsys_pending', ''] == 3 and samples['recsys_rejected_total', ''] == 7
+
+    assert '# TYPE recsys_stage_seconds histogram' in text
+    assert '# TYPE recsys_rejected_total counter' in text and '# HELP recsys_pending Pending requests.' in text
+    # Every family is declared once, before its samples
+    assert text.count('# TYPE recsys_stage_errors_total counter') == 1
+    assert text.index('# TYPE recsys_stage_errors_total') < text.index('recsys_stage_errors_total{')
+    assert text.endswith('\n')
+
+
+def test_quantile_is_the_upper_bound_of_its_bucket():
+    registry = MetricsRegistry(enabled=True, buckets=(0.001, 0.01, 0.1))
+    for seconds in [0.0005] * 50 + [0.05] * 49 + [1.0]:
+        registry.observe('scoring', seconds)
+
+    histogram = registry.histograms['scoring']
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1.0) == float('inf')
+
+
+def test_spans_are_only_recorded_when_enabled(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, 'REGISTRY', registry)
+
+    @metrics.timed('sync')
+    def work(fail: bool = False):
+        if fail:
+            raise ValueError('failed')
+        return 1
+
+    @metrics.timed('async')
+    async def awork():
+        return 2
+
+    assert work() == 1 and asyncio.run(awork()) == 2
+    assert registry.histograms == {}
+
+    metrics.enable()
+    assert work() == 1 and asyncio.run(awork()) == 2
+    with pytest.raises(ValueError):
+        work(fail=True)
+    metrics.disable()
+
+    assert registry.histograms['sync'].count == 2 and registry.histograms['sync'].errors == 1
+    assert registry.histograms['async'].count == 1
+    assert parse(registry.render())['recsys_stage_errors_total', 'stage="sync"'] == 1
+
+
+def test_server_serves_metrics_and_profile():
+    registry = MetricsRegistry(enabled=True)
+    registry.observe('scoring', 0.003)
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.samples['tg_bot.py:main;recsys.py:recommend'] = 2
+    server = MetricsServer(registry=registry, port=0, profiler=profiler).start()
+    url = f'http://127.0.0.1:{server.port}'
+
+    try:
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert parse(response.read().decode())['recsys_stage_seconds_count', 'stage="scoring"'] == 1
+        with urllib.request.urlopen(url + '/profile') as response:
+            assert response.read().decode() == 'tg_bot.py:main;recsys.py:recommend 2\n'
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        server.stop()
@@ -0,0 +1,99 @@
+# Import necessary dependencies
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pytest
+
+import preprocessor
+from benchmark import preprocess_parity_report
+from benchmark_suite import synthetic_tracks
+from preprocessor import TrackPreprocessor, model_artifact_path
+from track_index import ClusterIndex, normalize, normalize_rows, top_k_positions
+from track_store import TrackStore
+
+
+def test_compiled_preprocessing_matches_sklearn(synthetic_catalog):
+    report = preprocess_parity_report(
+        preprocessor=TrackPreprocessor(pkl_path=synthetic_catalog['pkl'], use_artifact=False),
+        tracks=synthetic_tracks(200, start=10_000)
+    )
+
+    assert report['max_abs_diff'] < 1e-9
+    assert report['max_abs_diff_batch'] < 1e-9
+    assert report['cluster_agreement'] > 0.999
+
+
+def test_cluster_index_matches_brute_force(synthetic_catalog):
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+    store = TrackStore(synthetic_catalog['db'])
+    index = ClusterIndex.build(features=store.features, clusters=store.clusters)
+    vectors = normalize_rows(np.asarray(store.features, dtype=np.float64))
+
+    queries, _ = preprocessor.preprocess_array(synthetic_tracks(20, start=10_000).to_dict(orient='records'))
+    for query in queries:
+        expected = top_k_positions(vectors @ normalize(query), 10)
+
+        row_ids, similarity = index.search(query=query, cluster=list(range(index.n_clusters)), top_k=10)
+        np.testing.assert_array_equal(row_ids, expected)
+        np.testing.assert_allclose(similarity, vectors[expected] @ normalize(query), atol=1e-5)
+
+        row_ids, _ = index.search_exact(query=query, top_k=10)
+        np.testing.assert_array_equal(row_ids, expected)
+
+
+def test_artifact_is_recompiled_for_changed_model(synthetic_catalog, tmp_path):
+    pkl_path = str(tmp_path / 'k_means.pkl')
+    shutil.copyfile(synthetic_catalog['pkl'], pkl_path)
+    centroids = TrackPreprocessor(pkl_path=pkl_path).centroids
+    assert os.path.exists(model_artifact_path(pkl_path))
+
+    with open(pkl_path, 'rb') as f:
+        tools = pickle.load(f)
+    tools['k_means'].cluster_centers_ = tools['k_means'].cluster_centers_ * 2
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(tools, f)
+    # A copied or checked out model can be older than the artifact of the previous one
+    artifact_mtime = os.path.getmtime(model_artifact_path(pkl_path))
+    os.utime(pkl_path, (artifact_mtime - 60, artifact_mtime - 60))
+
+    assert np.allclose(TrackPreprocessor(pkl_path=pkl_path).centroids, centroids * 2)
+    # The recompiled artifact is loaded without the ".pkl" model
+    assert np.allclose(TrackPreprocessor(pkl_path=model_artifact_path(pkl_path)).centroids, centroids * 2)
+
+
+
+def test_artifact_is_checked_by_hash_only_after_the_model_changed(synthetic_catalog, tmp_path, monkeypatch):
+    pkl_path = str(tmp_path / 'k_means.pkl')
+    shutil.copyfile(synthetic_catalog['pkl'], pkl_path)
+    centroids = TrackPreprocessor(pkl_path=pkl_path).centroids
+    hashed = []
+    monkeypatch.setattr(preprocessor, 'model_digest', lambda path, digest=preprocessor.model_digest: hashed.append(path) or digest(path))
+
+    TrackPreprocessor(pkl_path=pkl_path)
+    assert hashed == []
+
+    # Same contents, e.g. a fresh checkout: the artifact is kept and the new time recorded
+    os.utime(pkl_path, (1_000_000, 1_000_000))
+    assert np.array_equal(TrackPreprocessor(pkl_path=pkl_path).centroids, centroids)
+    assert TrackPreprocessor(pkl_path=pkl_path)._tools is None
+    assert hashed == [pkl_path]
+
+
+@pytest.mark.parametrize('option', ['with_mean', 'with_std'])
+def test_compiled_preprocessing_follows_scaler_options(synthetic_catalog, tmp_path, option):
+    with open(synthetic_catalog['pkl'], 'rb') as f:
+        tools = pickle.load(f)
+    setattr(tools['column_transformer'].named_transformers_['num'], option, False)
+    pkl_path = str(tmp_path / 'k_means.pkl')
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(tools, f)
+
+    report = preprocess_parity_report(
+        preprocessor=TrackPreprocessor(pkl_path=pkl_path, use_artifact=False),
+        tracks=synthetic_tracks(200, start=10_000)
+    )
+
+    assert report['max_abs_diff'] < 1e-9
+    assert report['cluster_agreement'] > 0.999
@@ -0,0 +1,191 @@
+# Import necessary dependencies
+import asyncio
+import threading
+import time
+
+# Imported up front, so creating a client does not delay the first request of a test
+import httpx  # noqa: F401
+import pytest
+import spotipy  # noqa: F401
+
+import rate_limit
+from async_search import AsyncTrackSearchEngine
+from rate_limit import RequestScheduler, current_scheduling, scheduling
+from search import TrackSearchEngine
+from search_batching import AsyncAudioFeatureBatcher, AudioFeatureBatcher
+
+
+@pytest.fixture(autouse=True)
+def token_cache_dir(tmp_path, monkeypatch):
+    # spotipy caches the client credentials token of the fake server in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def search_all(kind: str, fake_spotify, scheduler: RequestScheduler, jobs: list[tuple]) -> list:
+    """
+    Search `(start, lane, query)` jobs concurrently with the engine of `kind`, each started `start` seconds in.
+    Returns found tracks, or the errors of failed searches.
+    """
+
+    kwargs = dict(
+        client_id='id', client_secret='secret', scheduler=scheduler,
+        api_url=fake_spotify.url, token_url=fake_spotify.url + 'api/token'
+    )
+    results = [None] * len(jobs)
+
+    if kind == 'call':
+        engine = TrackSearchEngine(**kwargs)
+
+        def search(i, start, lane, query):
+            time.sleep(start)
+            with scheduling(lane):
+                try:
+                    results[i] = engine.search_track(query)
+                except Exception as e:
+                    results[i] = e
+
+        threads = [threading.Thread(target=search, args=(i, *job)) for i, job in enumerate(jobs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        return results
+
+    async def run():
+        engine = AsyncTrackSearchEngine(**kwargs)
+
+        async def search(i, start, lane, query):
+            await asyncio.sleep(start)
+            with scheduling(lane):
+                try:
+                    results[i] = await engine.search_track(query)
+                except Exception as e:
+                    results[i] = e
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*[search(i, *job) for i, job in enumerate(jobs)]), 10)
+        finally:
+            await engine.aclose()
+
+    asyncio.run(run())
+
+    return results
+
+
+def search_times(fake_spotify) -> list[float]:
+    return [request_time for request_time, path, _ in fake_spotify.requests if path == 'search']
+
+
+@pytest.mark.parametrize('kind', ['call', 'acall'])
+def test_retry_after_pauses_requests(kind, fake_spotify):
+    fake_spotify.responses = [(429, {'Retry-After': '0.3'})]
+    scheduler = RequestScheduler(rate=100, burst=10)
+
+    results = search_all(kind, fake_spotify, scheduler, [(0, 'interactive', 'a'), (0.15, 'interactive', 'b')])
+
+    assert [track['name'] for track in results] == ['a', 'b']
+    # The retry and the request that came in meanwhile both wait out `Retry-After`
+    first, *rest = search_times(fake_spotify)
+    assert len(rest) == 2 and min(rest) - first >= 0.28
+    assert scheduler.stats()['throttled'] == 1
+    assert scheduler.stats()['retries'] == 1
+
+
+@pytest.mark.parametrize('kind', ['call', 'acall'])
+def test_server_errors_are_retried_with_backoff(kind, fake_spotify, monkeypatch):
+    # The largest jittered delay, so the backoff can be measured
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda low, high: high)
+    fake_spotify.responses = [(503, {}), (503, {})]
+    scheduler = RequestScheduler(rate=100, burst=10, backoff=0.1)
+
+    results = search_all(kind, fake_spotify, scheduler, [(0, 'interactive', 'a')])
+
+    assert results[0]['name'] == 'a'
+    times = search_times(fake_spotify)
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.09
+    assert times[2] - times[1] >= 0.19
+    assert scheduler.stats()['throttled'] == 0
+    assert scheduler.stats()['retries'] == 2
+
+
+@pytest.mark.parametrize('kind', ['call', 'acall'])
+def test_give_up_after_max_retries(kind, fake_spotify):
+    fake_spotify.responses = [(503, {}), (503, {})]
+    scheduler = RequestScheduler(rate=100, burst=10, max_retries=1, backoff=0.01)
+
+    results = search_all(kind, fake_spotify, scheduler, [(0, 'interactive', 'a')])
+
+    assert isinstance(results[0], Exception)
+    assert len(search_times(fake_spotify)) == 2
+    assert scheduler.stats()['retries'] == 1
+
+
+@pytest.mark.parametrize('kind', ['call', 'acall'])
+def test_interactive_lane_is_served_first(kind, fake_spotify):
+    fake_spotify.responses = [(429, {'Retry-After': '0.3'})]
+    scheduler = RequestScheduler(rate=20, burst=1)
+
+    # Background requests arrive first, but all of them wait for `Retry-After` of the first one
+    search_all(kind, fake_spotify, scheduler, [
+        (0, 'interactive', 'first'),
+        (0.05, 'background', 'b1'), (0.07, 'background', 'b2'),
+        (0.1, 'interactive', 'i1'), (0.12, 'interactive', 'i2')
+    ])
+
+    queries = [params['q'] for params in fake_spotify.api_requests('search')]
+    assert queries == ['first', 'first', 'i1', 'i2', 'b1', 'b2']
+
+
+@pytest.mark.parametrize('timeouts', [(10, 5), (10, None)])
+def test_batched_requests_keep_the_scheduling_of_their_callers(timeouts):
+    contexts = []
+
+    def fetch(track_ids):
+        contexts.append(current_scheduling())
+        return [None] * len(track_ids)
+
+    batcher = AudioFeatureBatcher(fetch=fetch, max_wait=0.1)
+    threads = []
+    for track_id, lane, timeout in [('a', 'background', timeouts[0]), ('b', 'interactive', timeouts[1])]:
+        def get(track_id=track_id, lane=lane, timeout=timeout):
+            with scheduling(lane, timeout=timeout):
+                batcher.get(track_id)
+
+        threads.append(threading.Thread(target=get))
+    start = time.monotonic()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+    finally:
+        batcher.close()
+
+    async def run():
+        async def fetch_async(track_ids):
+            return fetch(track_ids)
+
+        batcher = AsyncAudioFeatureBatcher(fetch=fetch_async, max_wait=0.05)
+
+        async def get(track_id, lane, timeout):
+            with scheduling(lane, timeout=timeout):
+                await batcher.get(track_id)
+
+        try:
+            await get('c', 'background', None)
+            await asyncio.gather(get('a', 'background', timeouts[0]), get('b', 'interactive', timeouts[1]))
+        finally:
+            await batcher.aclose()
+
+    asyncio.run(run())
+
+    # One call per batch, in the most urgent lane and until the last caller gives up
+    lanes, deadlines = zip(*contexts)
+    assert lanes == ('interactive', 'background', 'interactive')
+    assert deadlines[1] is None
+    if timeouts[1] is None:
+        assert deadlines[0] is None and deadlines[2] is None
+    else:
+        assert all(start + 9 < deadline < start + 11 for deadline in [deadlines[0], deadlines[2]])
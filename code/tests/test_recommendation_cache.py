@@ -0,0 +1,139 @@
+# Import necessary dependencies
+import asyncio
+import threading
+
+import pytest
+
+from rate_limit import current_scheduling, scheduling
+from recommendation_cache import RecommendationCache
+from search_cache import MISSING
+
+
+def test_concurrent_callers_share_one_computation():
+    cache = RecommendationCache()
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+    waiter.start()
+    while cache.n_coalesced == 0:
+        pass
+    release.set()
+    owner.join()
+    waiter.join()
+
+    assert results == ['result', 'result']
+    assert cache.n_computed == 1
+    assert cache.get_or_compute('key', compute) == 'result'
+    assert cache.stats()['hits'] == 1
+
+
+def test_result_stored_during_a_lookup_is_not_computed_again():
+    cache = RecommendationCache()
+    lookup = cache.results.get
+    stored = threading.Event()
+    delayed = []
+
+    def slow_lookup(key, default=MISSING):
+        result = lookup(key, default)
+        # The first lookup misses, then the other caller gets to compute and store the result
+        if not delayed:
+            delayed.append(key)
+            stored.wait(0.5)
+        return result
+
+    cache.results.get = slow_lookup
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', lambda: 'result')))
+    first.start()
+    while not delayed:
+        pass
+    results.append(cache.get_or_compute('key', lambda: 'result'))
+    stored.set()
+    first.join()
+
+    assert results == ['result', 'result']
+    assert cache.n_computed == 1
+
+
+def test_async_callers_share_one_computation():
+    async def run():
+        cache = RecommendationCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        results = await asyncio.gather(*[cache.aget_or_compute('key', compute) for _ in range(5)])
+        return results, calls, cache.stats()
+
+    results, calls, stats = asyncio.run(run())
+
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert stats['coalesced'] == 4
+
+
+def test_cancelled_owner_does_not_cancel_waiters():
+    async def run():
+        cache = RecommendationCache()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        owner = asyncio.create_task(cache.aget_or_compute('key', compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aget_or_compute('key', compute))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await waiter, cache.n_computed
+
+    assert asyncio.run(run()) == ('result', 1)
+
+
+def test_failed_computation_is_not_cached():
+    async def run():
+        cache = RecommendationCache()
+        attempts = []
+
+        async def compute():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            if len(attempts) == 1:
+                raise ValueError('failed')
+            return 'result'
+
+        results = await asyncio.gather(*[cache.aget_or_compute('key', compute) for _ in range(2)], return_exceptions=True)
+        return results, await cache.aget_or_compute('key', compute)
+
+    results, retried = asyncio.run(run())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert retried == 'result'
+
+
+def test_shared_computation_does_not_run_in_the_context_of_its_caller():
+    async def run():
+        cache = RecommendationCache()
+
+        async def compute():
+            return current_scheduling()
+
+        with scheduling('background', timeout=0.01):
+            return await cache.aget_or_compute('key', compute)
+
+    assert asyncio.run(run()) == (None, None)
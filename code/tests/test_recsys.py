@@ -0,0 +1,169 @@
+# Import necessary dependencies
+import asyncio
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from benchmark_suite import synthetic_tracks
+from catalog import Catalog
+from preprocessor import TrackPreprocessor
+from recommendation_cache import RecommendationCache
+from recsys import RecSys
+from user_profiles import UserProfileStore
+
+
+@pytest.fixture
+def rec_sys(synthetic_catalog, tmp_path):
+    rec_sys = RecSys(
+        client_id='id', client_secret='secret', pkl_path=synthetic_catalog['pkl'], db_path=synthetic_catalog['db'],
+        recommendation_cache=RecommendationCache(), profile_store=UserProfileStore(str(tmp_path / 'profiles.sqlite'))
+    )
+    yield rec_sys
+    rec_sys.close()
+
+
+def test_personalized_requests_share_candidates(rec_sys):
+    track_name = rec_sys.snapshot.store.column('name', [0])[0]
+
+    first = rec_sys.recommend(track_name, top_k=5, user_id=1)
+    other = rec_sys.recommend(track_name, top_k=5, user_id=2)
+    again = rec_sys.recommend(track_name, top_k=5, user_id=1)
+
+    # One scoring for all three requests
+    assert rec_sys.recommendation_cache.n_computed == 1
+    assert list(other['name']) == list(first['name'])
+    # Tracks already recommended to the user are skipped on top of the shared candidates
+    assert len(again) == 5 and not set(again['name']) & set(first['name'])
+
+
+def test_personalized_candidates_match_an_uncached_search(rec_sys):
+    snapshot = rec_sys.snapshot
+    track_id, query, cluster = rec_sys._local_seed(snapshot, snapshot.store.column('name', [0])[0])
+    rec_sys.profile_store.update(7, features=snapshot.store.features[100], seen=list(snapshot.store.column('id', range(50))))
+    profile = rec_sys.profile_store.get(7)
+
+    shared = rec_sys._candidates(snapshot, track_id, query, cluster, top_k=5, n_probe=1)
+    own = snapshot.backend.search(query=query, cluster=cluster, top_k=rec_sys._n_candidates(profile, 5))
+
+    assert np.array_equal(
+        rec_sys._personalize(snapshot, profile, query, *shared, top_k=5)[0],
+        rec_sys._personalize(snapshot, profile, query, *own, top_k=5)[0]
+    )
+
+
+def test_async_profile_access_does_not_block_the_event_loop(rec_sys, monkeypatch):
+    threads = []
+    for method in ['get', 'update']:
+        original = getattr(rec_sys.profile_store, method)
+        monkeypatch.setattr(rec_sys.profile_store, method, lambda *args, original=original, **kwargs: (
+            threads.append(threading.get_ident()), original(*args, **kwargs)
+        )[1])
+    track_name = rec_sys.snapshot.store.column('name', [0])[0]
+
+    async def run():
+        results = await asyncio.gather(*[rec_sys.arecommend(track_name, top_k=5, user_id=user_id) for user_id in [1, 2]])
+        await rec_sys.aadd_preference(user_id=1, track_name=track_name)
+        return results
+
+    first, other = asyncio.run(run())
+
+    assert list(first['name']) == list(other['name'])
+    assert len(threads) == 5 and threading.get_ident() not in threads
+    assert rec_sys.recommendation_cache.n_computed == 2
+    assert rec_sys.profile_store.get(1).count == 2
+
+
+def test_recommend_many_matches_single_recommendations(rec_sys, monkeypatch):
+    names = rec_sys.snapshot.store.column('name', [3, 10, 42])
+    # Titles that are not in the catalog and not found on Spotify are left out
+    monkeypatch.setattr(rec_sys.search_engine, 'find_many_track_features', lambda titles: [None] * len(titles))
+    track_names = [names[0], 'unknown title', names[1], names[2]]
+
+    for n_probe in [1, 2]:
+        result = rec_sys.recommend_many(track_names, top_k=4, n_probe=n_probe, chunk_size=2)
+
+        assert sorted(set(result['seed'])) == [0, 2, 3]
+        for seed in [0, 2, 3]:
+            rows = result[result['seed'] == seed]
+            assert rows['rank'].tolist() == [1, 2, 3, 4]
+            assert rows['name'].tolist() == rec_sys.recommend(track_names[seed], top_k=4, n_probe=n_probe)['name'].tolist()
+
+
+def test_async_name_lookups_do_not_block_the_event_loop(rec_sys, monkeypatch):
+    threads = []
+    lookup = rec_sys.snapshot.name_index.lookup
+    monkeypatch.setattr(rec_sys.snapshot.name_index, 'lookup', lambda *args, **kwargs: (
+        threads.append(threading.get_ident()), lookup(*args, **kwargs)
+    )[1])
+    track_name = rec_sys.snapshot.store.column('name', [0])[0]
+
+    async def run():
+        await rec_sys.arecommend(track_name, top_k=5)
+        await rec_sys.aadd_preference(user_id=1, track_name=track_name)
+
+    asyncio.run(run())
+
+    assert len(threads) == 2 and threading.get_ident() not in threads
+
+
+def test_async_requests_load_a_new_version_off_the_event_loop(synthetic_catalog, tmp_path, monkeypatch):
+    root = str(tmp_path / 'catalog')
+    shutil.copytree(synthetic_catalog['db'], root)
+    rec_sys = RecSys(client_id='id', client_secret='secret', pkl_path=synthetic_catalog['pkl'], db_path=root, refresh_interval=0)
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+    version = Catalog(root, centroids=preprocessor.centroids).add_tracks(
+        synthetic_tracks(5, start=100_000).to_dict(orient='records'), preprocessor=preprocessor
+    ).version
+
+    threads = []
+    open_snapshot = rec_sys._open_snapshot
+    monkeypatch.setattr(rec_sys, '_open_snapshot', lambda *args: (threads.append(threading.get_ident()), open_snapshot(*args))[1])
+
+    async def run():
+        return await rec_sys.arecommend(rec_sys.snapshot.store.column('name', [0])[0], top_k=5)
+
+    try:
+        assert len(asyncio.run(run())) == 5
+    finally:
+        rec_sys.close()
+
+    assert rec_sys.snapshot.version == version and len(rec_sys.snapshot.store) == 3005
+    assert len(threads) == 1 and threading.get_ident() not in threads
+
+
+def test_recommend_playlist(rec_sys, monkeypatch):
+    store = rec_sys.snapshot.store
+    seeds = [3, 10, 42, 100]
+    monkeypatch.setattr(rec_sys.search_engine, 'find_many_track_features', lambda titles: [None] * len(titles))
+    seed_keys = set(zip(store.column('name', seeds), store.column('artists', seeds)))
+
+    for diversity in [0.0, 0.5]:
+        result = rec_sys.recommend_playlist(store.column('name', seeds), top_k=10, diversity=diversity)
+        keys = list(zip(result['name'], result['artists']))
+
+        assert len(result) == 10 and list(result.columns) == ['name', 'album', 'artists', 'track_number', 'similarity']
+        assert len(set(keys)) == 10 and not set(keys) & seed_keys
+        if diversity == 0.0:
+            assert (np.diff(result['similarity']) <= 0).all()
+
+    assert len(rec_sys.recommend_playlist(['unknown title'], top_k=10)) == 0
+
+
+def test_async_state_and_summary_do_not_block_the_event_loop(rec_sys, monkeypatch):
+    threads = []
+    for method in ['get', 'get_state', 'set_state']:
+        original = getattr(rec_sys.profile_store, method)
+        monkeypatch.setattr(rec_sys.profile_store, method, lambda *args, original=original, **kwargs: (
+            threads.append(threading.get_ident()), original(*args, **kwargs)
+        )[1])
+
+    async def run():
+        await rec_sys.profile_store.aset_state(1, 'add_preferences')
+        return await rec_sys.profile_store.aget_state(1), await rec_sys.apreference_summary(1)
+
+    state, summary = asyncio.run(run())
+
+    assert state == 'add_preferences' and summary['count'] == 0
+    assert len(threads) == 3 and threading.get_ident() not in threads
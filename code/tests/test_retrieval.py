@@ -0,0 +1,91 @@
+# Import necessary dependencies
+import shutil
+
+import numpy as np
+import pytest
+
+from benchmark_suite import synthetic_tracks
+from catalog import Catalog, SegmentedArray
+from preprocessor import TrackPreprocessor
+from retrieval import IVFPQBackend, build_ann_index, make_backend
+
+
+@pytest.fixture
+def catalog(synthetic_catalog, tmp_path):
+    root = str(tmp_path / 'catalog')
+    shutil.copytree(synthetic_catalog['db'], root)
+    preprocessor = TrackPreprocessor(pkl_path=synthetic_catalog['pkl'])
+
+    return Catalog(root, centroids=preprocessor.centroids), preprocessor
+
+
+def test_segmented_array_slices():
+    arrays = [np.arange(10).reshape(5, 2), np.arange(10, 16).reshape(3, 2)]
+    segmented, whole = SegmentedArray(arrays), np.concatenate(arrays)
+
+    for rows in [slice(0, 8), slice(3, 7), slice(None, None, 2), slice(6, 100), slice(-3, None), slice(5, 5)]:
+        np.testing.assert_array_equal(segmented[rows], whole[rows])
+    np.testing.assert_array_equal(segmented[6], whole[6])
+    np.testing.assert_array_equal(segmented[[7, 0, 5]], whole[[7, 0, 5]])
+
+
+def test_ann_index_builds_over_delta_segments(catalog, tmp_path):
+    catalog, preprocessor = catalog
+    snapshot = catalog.add_tracks(synthetic_tracks(20, start=100_000).to_dict(orient='records'), preprocessor=preprocessor)
+
+    index = build_ann_index(snapshot, str(tmp_path / 'ann'), n_lists=16, chunk_size=1000, n_iter=5)
+    assert index.n_vectors == len(snapshot.store) == 3020
+
+    backend = make_backend('ivf_pq', snapshot, str(tmp_path / 'ann'), n_probe=16)
+    assert isinstance(backend, IVFPQBackend)
+
+    # A new track finds itself
+    query = np.asarray(snapshot.store.features[3010], dtype=np.float64)
+    assert backend.search(query=query, top_k=1)[0].tolist() == [3010]
+
+
+def test_ann_backend_skips_removed_tracks(catalog, tmp_path):
+    catalog, preprocessor = catalog
+    build_ann_index(catalog.snapshot(), str(tmp_path / 'ann'), n_lists=4, n_iter=5)
+
+    snapshot = catalog.snapshot()
+    query = np.asarray(snapshot.store.features[0], dtype=np.float64)
+    nearest, _ = make_backend('ivf_pq', snapshot, str(tmp_path / 'ann'), n_probe=4).search(query=query, top_k=20)
+
+    snapshot = catalog.remove_tracks(snapshot.store.column('id', nearest[:10]))
+    backend = make_backend('ivf_pq', snapshot, str(tmp_path / 'ann'), n_probe=4)
+    row_ids, similarity = backend.search(query=query, top_k=10)
+
+    assert len(row_ids) == 10 and not np.isin(row_ids, nearest[:10]).any()
+    assert set(row_ids.tolist()) == set(nearest[10:].tolist())
+
+
+def test_added_tracks_are_searched_next_to_the_mapped_index(catalog, tmp_path):
+    catalog, preprocessor = catalog
+    build_ann_index(catalog.snapshot(), str(tmp_path / 'ann'), n_lists=16, n_iter=5)
+    snapshot = catalog.add_tracks(synthetic_tracks(20, start=100_000).to_dict(orient='records'), preprocessor=preprocessor)
+
+    backend = make_backend('ivf_pq', snapshot, str(tmp_path / 'ann'), n_probe=16)
+
+    assert isinstance(backend.index.codes, np.memmap) and len(backend.index.codes) == 3000
+    assert backend.index.delta_row_ids.tolist() == list(range(3000, 3020))
+    query = np.asarray(snapshot.store.features[3010], dtype=np.float64)
+    assert backend.search(query=query, top_k=1)[0].tolist() == [3010]
+
+
+def test_ann_index_is_encoded_again_after_a_compaction(catalog, tmp_path, caplog):
+    catalog, preprocessor = catalog
+    build_ann_index(catalog.snapshot(), str(tmp_path / 'ann'), n_lists=16, n_iter=5)
+    catalog.add_tracks(synthetic_tracks(20, start=100_000).to_dict(orient='records'), preprocessor=preprocessor)
+    snapshot = catalog.remove_tracks(catalog.snapshot().store.column('id', np.arange(10)))
+    track_id = snapshot.store.column('id', [3010])[0]
+
+    snapshot = catalog.compact()
+    backend = make_backend('ivf_pq', snapshot, str(tmp_path / 'ann'), n_probe=16)
+
+    assert 'another base segment' in caplog.text
+    assert isinstance(backend, IVFPQBackend) and backend.index.n_vectors == len(snapshot.store) == 3010
+    # Rows moved up by the removed tracks
+    assert snapshot.store.column('id', [3000])[0] == track_id
+    query = np.asarray(snapshot.store.features[3000], dtype=np.float64)
+    assert backend.search(query=query, top_k=1)[0].tolist() == [3000]
@@ -0,0 +1,24 @@
+# Import necessary dependencies
+import asyncio
+
+import numpy as np
+
+from scoring_pool import ScoringPool
+from track_store import TrackStore
+
+
+def test_process_workers_score_like_threads(synthetic_catalog):
+    queries = np.asarray(TrackStore(synthetic_catalog['db']).features[:5], dtype=np.float64)
+
+    async def run(pool):
+        try:
+            return await asyncio.gather(*[pool.score(query=query, clusters=np.array([0, 1]), top_k=5) for query in queries])
+        finally:
+            pool.shutdown()
+
+    processes = asyncio.run(run(ScoringPool(db_path=synthetic_catalog['db'], kind='process', max_workers=2)))
+    threads = asyncio.run(run(ScoringPool(db_path=synthetic_catalog['db'], kind='thread', max_workers=2)))
+
+    for (process_rows, process_scores), (thread_rows, thread_scores) in zip(processes, threads):
+        np.testing.assert_array_equal(process_rows, thread_rows)
+        np.testing.assert_allclose(process_scores, thread_scores)
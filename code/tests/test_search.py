@@ -0,0 +1,139 @@
+# Import necessary dependencies
+import threading
+
+import pytest
+
+from search import TrackSearchEngine
+from search_cache import SpotifyCache
+
+TRACKS = {
+    'track:Song A': {'id': 'a', 'name': 'Song A', 'album': {'name': 'Album', 'id': 'al', 'release_date': '2001-01-01'}, 'artists': [{'name': 'X', 'id': 'x'}]},
+    'track:Song B': {'id': 'b', 'name': 'Song B', 'album': {'name': 'Album', 'id': 'al', 'release_date': '2001-01-01'}, 'artists': [{'name': 'X', 'id': 'x'}]}
+}
+# Track `b` has no audio features on Spotify
+FEATURES = {'a': {'id': 'a', 'danceability': 0.5, 'energy': 0.7}}
+
+
+class StubSpotify():
+    """
+    Offline stand-in for `spotipy.Spotify` that counts calls.
+    """
+
+    instances = []
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.prefix = None
+        self.calls = []
+        self._lock = threading.Lock()
+        StubSpotify.instances.append(self)
+
+    def search(self, q, type='track', limit=1):
+        with self._lock:
+            self.calls.append(('search', q))
+        return {'tracks': {'items': [TRACKS[q]] if q in TRACKS else []}}
+
+    def audio_features(self, track_ids):
+        with self._lock:
+            self.calls.append(('audio_features', tuple(track_ids)))
+        return [FEATURES.get(track_id) for track_id in track_ids]
+
+
+class StubCredentials():
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+
+@pytest.fixture
+def make_engine(monkeypatch):
+    import spotipy
+    import spotipy.oauth2
+
+    monkeypatch.setattr(spotipy, 'Spotify', StubSpotify)
+    monkeypatch.setattr(spotipy.oauth2, 'SpotifyClientCredentials', StubCredentials)
+    StubSpotify.instances.clear()
+
+    def make_engine(**kwargs) -> TrackSearchEngine:
+        return TrackSearchEngine(client_id='id', client_secret='secret', **kwargs)
+
+    return make_engine
+
+
+def test_search_track_cache_miss_then_hit(make_engine):
+    engine = make_engine(cache=SpotifyCache())
+
+    assert engine.search_track('track:Song A')['id'] == 'a'
+    # Normalized query is a cache hit
+    assert engine.search_track('TRACK:song   a')['id'] == 'a'
+
+    assert engine.sp.calls == [('search', 'track:Song A')]
+
+
+def test_search_track_without_cache_always_calls_spotify(make_engine):
+    engine = make_engine()
+
+    engine.search_track('track:Song A')
+    engine.search_track('track:Song A')
+
+    assert engine.sp.calls == [('search', 'track:Song A')] * 2
+
+
+def test_search_track_not_found_is_not_cached(make_engine):
+    engine = make_engine(cache=SpotifyCache())
+
+    for _ in range(2):
+        with pytest.raises(IndexError):
+            engine.search_track('track:Unknown')
+
+    assert engine.sp.calls == [('search', 'track:Unknown')] * 2
+
+
+def test_get_audio_features_cache_miss_then_hit(make_engine):
+    engine = make_engine(cache=SpotifyCache())
+
+    assert engine.get_audio_features('a') == FEATURES['a']
+    assert engine.get_audio_features('a') == FEATURES['a']
+
+    assert engine.sp.calls == [('audio_features', ('a',))]
+
+
+def test_get_audio_features_none_is_not_cached(make_engine):
+    engine = make_engine(cache=SpotifyCache())
+
+    assert engine.get_audio_features('b') is None
+    assert engine.get_audio_features('b') is None
+
+    assert engine.sp.calls == [('audio_features', ('b',))] * 2
+
+
+def test_disk_cache_survives_restart(make_engine, tmp_path):
+    path = str(tmp_path / 'spotify.sqlite')
+
+    engine = make_engine(cache=SpotifyCache(path=path))
+    engine.find_track_features('Song A')
+
+    engine = make_engine(cache=SpotifyCache(path=path))
+    assert engine.find_track_features('Song A')['danceability'] == 0.5
+    # The new engine never created a client
+    assert len(StubSpotify.instances) == 1
+
+
+def test_get_many_audio_features_fetches_only_missing(make_engine):
+    engine = make_engine(cache=SpotifyCache())
+    engine.get_audio_features('a')
+
+    assert engine.get_many_audio_features(['a', 'b', 'b', 'c']) == [FEATURES['a'], None, None, None]
+    assert engine.sp.calls == [('audio_features', ('a',)), ('audio_features', ('b', 'c'))]
+
+
+def test_batched_audio_features_share_one_call(make_engine):
+    engine = make_engine(cache=SpotifyCache(), batch_window=0.05)
+
+    results = {}
+    threads = [threading.Thread(target=lambda track_id=track_id: results.update({track_id: engine.get_audio_features(track_id)})) for track_id in ['a', 'b']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {'a': FEATURES['a'], 'b': None}
+    assert [sorted(ids) for name, ids in engine.sp.calls] == [['a', 'b']]
@@ -0,0 +1,86 @@
+# Import necessary dependencies
+import numpy as np
+import pytest
+
+from benchmark import probe_recall_report, sample_queries
+from preprocessor import TrackPreprocessor
+from track_index import ClusterIndex, normalize, normalize_rows, probe_clusters, top_k_positions
+from track_store import TrackStore
+
+
+@pytest.fixture(scope='module')
+def index(synthetic_catalog):
+    store = TrackStore(synthetic_catalog['db'])
+
+    return store, ClusterIndex.build(features=store.features, clusters=store.clusters), TrackPreprocessor(pkl_path=synthetic_catalog['pkl']).centroids
+
+
+def test_first_probe_is_the_assigned_cluster(index):
+    store, _, centroids = index
+    features = np.asarray(store.features[:200], dtype=np.float64)
+
+    clusters = probe_clusters(query=features, centroids=centroids, n_probe=3)
+
+    assert clusters.shape == (200, 3)
+    assert np.mean(clusters[:, 0] == np.asarray(store.clusters[:200])) > 0.99
+    assert np.array_equal(probe_clusters(query=features[0], centroids=centroids, n_probe=3), clusters[0])
+
+
+def test_multi_probe_search_scans_exactly_the_probed_clusters(index):
+    store, index, centroids = index
+    vectors = normalize_rows(np.asarray(store.features, dtype=np.float64))
+
+    for query in sample_queries(store, n_queries=20, seed=3):
+        clusters = probe_clusters(query=query, centroids=centroids, n_probe=4)
+        rows = np.flatnonzero(np.isin(np.asarray(store.clusters), clusters))
+        expected = rows[top_k_positions(vectors[rows] @ normalize(query), 10)]
+
+        row_ids, _ = index.search(query=query, cluster=clusters, top_k=10)
+
+        np.testing.assert_array_equal(row_ids, expected)
+
+
+def test_recall_grows_with_probes(index):
+    store, index, centroids = index
+
+    report = probe_recall_report(index=index, centroids=centroids, queries=sample_queries(store, n_queries=100), top_k=10,
+                                 n_probes=[1, 2, 4, index.n_clusters])
+    recall = report['recall'].tolist()
+
+    assert all(earlier <= later for earlier, later in zip(recall, recall[1:]))
+    # Probing every cluster is exact search
+    assert recall[-2] == recall[-1] == 1.0
+
+
+def test_quantization_error_is_at_most_half_a_step(index):
+    _, index, _ = index
+    quantized = index.quantize()
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+
+    error = np.abs(quantized.codes * quantized.scale + quantized.offset - vectors)
+
+    assert quantized.codes.dtype == np.int8 and quantized.precision == 'int8'
+    assert (error <= quantized.scale / 2 + 1e-6).all()
+
+
+def test_int8_scan_agrees_with_float32(index):
+    store, index, centroids = index
+    quantized = index.quantize(rerank=4)
+    queries = sample_queries(store, n_queries=100, seed=5)
+    clusters = probe_clusters(query=queries, centroids=centroids, n_probe=2)
+
+    overlap = []
+    for query, query_clusters in zip(queries, clusters):
+        exact_rows, exact_similarity = index.search(query=query, cluster=query_clusters, top_k=10)
+        row_ids, similarity = quantized.search(query=query, cluster=query_clusters, top_k=10)
+
+        overlap.append(len(set(row_ids.tolist()) & set(exact_rows.tolist())) / len(exact_rows))
+        # The shortlist is re-ranked in full precision
+        np.testing.assert_allclose(similarity, normalize_rows(np.asarray(store.features[row_ids], dtype=np.float64)) @ normalize(query), atol=1e-5)
+        assert similarity[-1] <= exact_similarity[-1] + 1e-6
+
+    assert np.mean(overlap) > 0.99
+
+    row_ids, _ = quantized.search_many(queries=queries, clusters=clusters[:, 0], top_k=10)
+    exact_rows, _ = index.search_many(queries=queries, clusters=clusters[:, 0], top_k=10)
+    assert np.mean([len(set(a) & set(b)) / 10 for a, b in zip(row_ids.tolist(), exact_rows.tolist())]) > 0.99
@@ -0,0 +1,85 @@
+# Import necessary dependencies
+import numpy as np
+import pandas as pd
+import pytest
+
+from track_store import TrackStore, TrackStoreWriter, METADATA_COLUMNS
+
+
+def make_chunk(start: int, n_rows: int, n_features: int = 3) -> tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    rows = np.arange(start, start + n_rows)
+    metadata = pd.DataFrame({
+        'id': [f'id{row}' for row in rows],
+        'name': [f'Лето {row}' if row % 2 else f'Song {row}' for row in rows],
+        'album': ['' if row % 3 == 0 else f'Album {row}' for row in rows],
+        'artists': [str([f'Artist {row}']) for row in rows],
+        'track_number': [None if row % 5 == 0 else str(row % 12) for row in rows]
+    })
+
+    return rows[:, None] + np.arange(n_features) / 10, rows % 4, metadata
+
+
+def write_store(path: str, chunks: list[tuple[int, int]]) -> None:
+    with TrackStoreWriter(path, features=['a', 'b', 'c']) as writer:
+        for start, n_rows in chunks:
+            features, clusters, metadata = make_chunk(start, n_rows)
+            writer.append(features=features, clusters=clusters, metadata=metadata)
+
+
+def test_round_trip(tmp_path):
+    write_store(str(tmp_path), [(0, 7), (7, 0), (7, 5)])
+    store = TrackStore(str(tmp_path))
+    features, clusters, metadata = make_chunk(0, 12)
+
+    assert len(store) == 12 and store.feature_names == ['a', 'b', 'c']
+    assert np.allclose(store.features, features) and store.features.dtype == np.float32
+    assert np.array_equal(store.clusters, clusters)
+    for column in METADATA_COLUMNS:
+        assert store.column(column, np.arange(12)) == metadata[column].tolist()
+    # Missing track numbers are stored as 0
+    assert store.column('track_number', np.array([0, 1, 5])) == [0, 1, 0]
+
+    rows = np.array([9, 2, 9])
+    assert store.metadata(rows).to_dict(orient='list') == {
+        'name': ['Лето 9', 'Song 2', 'Лето 9'], 'album': ['', 'Album 2', ''],
+        'artists': ["['Artist 9']", "['Artist 2']", "['Artist 9']"], 'track_number': [9, 2, 9]
+    }
+    assert list(store.metadata(rows, columns=['id']).columns) == ['id']
+
+
+def test_empty_store(tmp_path):
+    write_store(str(tmp_path), [])
+    store = TrackStore(str(tmp_path))
+
+    assert len(store) == 0 and store.features.shape == (0, 3)
+    assert store.find(['id0']).tolist() == []
+
+
+def test_find(tmp_path):
+    write_store(str(tmp_path), [(0, 50)])
+    store = TrackStore(str(tmp_path))
+
+    assert store.find(['id42', 'id3', 'missing', 'id3']).tolist() == [3, 42]
+
+
+def test_readers_keep_their_store_while_it_is_rewritten(tmp_path):
+    write_store(str(tmp_path), [(0, 10)])
+    store = TrackStore(str(tmp_path))
+
+    write_store(str(tmp_path), [(100, 20)])
+
+    assert store.column('id', np.arange(10)) == [f'id{row}' for row in range(10)]
+    assert np.allclose(store.features[:, 0], np.arange(10))
+    assert len(TrackStore(str(tmp_path))) == 20
+
+
+def test_failed_write_leaves_the_store_as_it_was(tmp_path):
+    write_store(str(tmp_path), [(0, 10)])
+
+    with pytest.raises(AssertionError):
+        with TrackStoreWriter(str(tmp_path), features=['a', 'b', 'c']) as writer:
+            features, clusters, metadata = make_chunk(0, 5)
+            writer.append(features=features, clusters=clusters[:4], metadata=metadata)
+
+    assert TrackStore(str(tmp_path)).column('id', np.arange(10)) == [f'id{row}' for row in range(10)]
+    assert not [path for path in tmp_path.iterdir() if path.suffix == '.tmp']
@@ -1,7 +1,17 @@
+import asyncio
 import logging
+import os
 from telegram import ForceReply, Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
 from recsys import RecSys
+from catalog_search import parse_artists
+from search_cache import SpotifyCache
+from scoring_pool import ScoringPool, PoolBusyError
+from recommendation_cache import RecommendationCache
+from retrieval import ann_index_path
+from metrics import MetricsServer, SamplingProfiler, enable as enable_metrics, span
+from rate_limit import RequestScheduler, DeadlineExceededError, scheduling
+from user_profiles import UserProfileStore
 
 
 # Read token and recommendation system credentials
@@ -9,8 +19,35 @@ TOKEN = open('token.txt').read().strip()
 CLIENT_ID = open('clientID.txt').read().strip()
 CLIENT_SECRET = open('clientSecret.txt').read().strip()
 
-# Initialize recommendation system
-rec_sys = RecSys(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+# Scoring workers: 'process', 'thread', or 'none' to score on the event loop
+SCORING_POOL_KIND = os.environ.get('SCORING_POOL_KIND', 'process')
+SCORING_POOL_WORKERS = int(os.environ.get('SCORING_POOL_WORKERS', os.cpu_count()))
+SCORING_POOL_MAX_PENDING = int(os.environ.get('SCORING_POOL_MAX_PENDING', 256))
+
+# Retrieval backend: 'cluster_scan' or 'ivf_pq' (build the index with `python retrieval.py` first)
+RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'cluster_scan')
+ANN_N_PROBE = int(os.environ.get('ANN_N_PROBE', 8))
+ANN_PATH = ann_index_path('../models/k_means.pkl')
+RETRIEVAL_OPTIONS = {'n_probe': ANN_N_PROBE} if RETRIEVAL_BACKEND == 'ivf_pq' else {}
+
+# Cluster scan precision: 'float32' or 'int8' (quantized scan, full precision re-rank of the shortlist)
+FEATURE_PRECISION = os.environ.get('FEATURE_PRECISION', 'float32')
+
+# Spotify requests per second shared by all users, and seconds a user waits for a reply
+# before their pending Spotify requests are shed
+SPOTIFY_RATE = float(os.environ.get('SPOTIFY_RATE', 10))
+REPLY_TIMEOUT = float(os.environ.get('REPLY_TIMEOUT', 15))
+
+# Seconds between checks whether added and removed tracks should be compacted into one segment
+COMPACTION_INTERVAL = float(os.environ.get('COMPACTION_INTERVAL', 600))
+
+# Seconds to collect audio feature lookups of concurrent users into one Spotify call
+SPOTIFY_BATCH_WINDOW = float(os.environ.get('SPOTIFY_BATCH_WINDOW', 0.005))
+
+# Stage latency histograms on http://127.0.0.1:METRICS_PORT/metrics, and collapsed
+# stacks on /profile if PROFILE_INTERVAL (seconds between samples) is set as well
+METRICS_PORT = os.environ.get('METRICS_PORT')
+PROFILE_INTERVAL = os.environ.get('PROFILE_INTERVAL')
 
 # Enable logging
 logging.basicConfig(
@@ -18,8 +55,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Define a state to track user input
-GET_RECOMMENDATIONS_STATE = {}
+# Pending actions of users waiting for a song name, persisted in `profile_store`
+GET_RECOMMENDATIONS_STATE = 'get_recommendations'
+ADD_PREFERENCES_STATE = 'add_preferences'
+
+
+# Created by `create_services`, so scoring workers that import this module do not start a bot of their own
+scoring_pool = None
+profile_store = None
+rec_sys = None
+
+
+def create_services() -> None:
+    global scoring_pool, profile_store, rec_sys
+
+    if SCORING_POOL_KIND != 'none':
+        scoring_pool = ScoringPool(
+            kind=SCORING_POOL_KIND,
+            max_workers=SCORING_POOL_WORKERS,
+            max_pending=SCORING_POOL_MAX_PENDING,
+            retrieval=RETRIEVAL_BACKEND,
+            ann_path=ANN_PATH,
+            retrieval_options=RETRIEVAL_OPTIONS,
+            precision=FEATURE_PRECISION
+        )
+
+    if METRICS_PORT is not None:
+        enable_metrics()
+        profiler = SamplingProfiler(interval=float(PROFILE_INTERVAL)).start() if PROFILE_INTERVAL is not None else None
+        MetricsServer(port=int(METRICS_PORT), profiler=profiler).start()
+
+    # Taste, recommended tracks and pending action of every user, kept across restarts
+    profile_store = UserProfileStore(path='../data/user_profiles.sqlite')
+
+    # Initialize recommendation system
+    rec_sys = RecSys(
+        client_id=CLIENT_ID,
+        client_secret=CLIENT_SECRET,
+        spotify_cache=SpotifyCache(path='../data/spotify_cache.sqlite'),
+        spotify_batch_window=SPOTIFY_BATCH_WINDOW,
+        spotify_scheduler=RequestScheduler(rate=SPOTIFY_RATE, burst=max(int(SPOTIFY_RATE), 1)),
+        scoring_pool=scoring_pool,
+        recommendation_cache=RecommendationCache(max_size=10_000, ttl=600),
+        profile_store=profile_store,
+        compaction_interval=COMPACTION_INTERVAL,
+        retrieval=RETRIEVAL_BACKEND,
+        ann_path=ANN_PATH,
+        retrieval_options=RETRIEVAL_OPTIONS,
+        precision=FEATURE_PRECISION
+    )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -30,6 +114,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await profile_store.aset_state(update.message.from_user.id, None)
     await show_main_buttons(update, edit=False)
 
 async def show_main_buttons(update: Update, edit: bool = True) -> None:
@@ -60,38 +145,90 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         [InlineKeyboardButton("Back", callback_data='back')]
     ])
 
+    user_id = query.from_user.id
+
     if query.data == 'get_recommendations':
         # Ask the user for the song name
-        user_id = query.from_user.id
-        GET_RECOMMENDATIONS_STATE[user_id] = True
+        await profile_store.aset_state(user_id, GET_RECOMMENDATIONS_STATE)
         await query.edit_message_text("Please send me the name of a song to get recommendations.")
+    elif query.data == 'add_preferences':
+        await profile_store.aset_state(user_id, ADD_PREFERENCES_STATE)
+        await query.edit_message_text("Please send me the name of a song you like.")
+    elif query.data == 'my_preferences':
+        await query.edit_message_text(format_preferences(await rec_sys.apreference_summary(user_id)), reply_markup=back_button)
     elif query.data == 'back':
+        await profile_store.aset_state(user_id, None)
         await show_main_buttons(update, edit=True)
     else:
         await query.edit_message_text("This functionality is under development.", reply_markup=back_button)
 
 
+def format_preferences(summary: dict) -> str:
+    if summary['count'] == 0:
+        return "You have no preferences yet. Add songs you like, or just ask for recommendations."
+
+    text = f"Your taste is based on {summary['count']} songs."
+    if summary['high']:
+        text += f"\nMore than usual: {', '.join(summary['high'])}."
+    if summary['low']:
+        text += f"\nLess than usual: {', '.join(summary['low'])}."
+    if summary['seen']:
+        text += f"\nI remember {summary['seen']} songs I already recommended and will not repeat them."
+
+    return text
+
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
     message_text = update.message.text
+    state = await profile_store.aget_state(user_id)
 
-    if user_id in GET_RECOMMENDATIONS_STATE and GET_RECOMMENDATIONS_STATE[user_id]:
+    if state == ADD_PREFERENCES_STATE:
+        # Keep the state, so the user can add several songs in a row
+        try:
+            with scheduling(lane='interactive', timeout=REPLY_TIMEOUT):
+                track = await asyncio.wait_for(rec_sys.aadd_preference(user_id=user_id, track_name=message_text), REPLY_TIMEOUT)
+            await update.message.reply_text(
+                f"Added {track['name']} by {', '.join(track['artists'])} to your preferences ({track['count']} songs). "
+                "Send another one, or use /help to go back."
+            )
+        except (asyncio.TimeoutError, DeadlineExceededError):
+            await update.message.reply_text("Spotify is slow right now, please try again in a few seconds.")
+        except IndexError:
+            await update.message.reply_text("I could not find this song, please try another one.")
+        except Exception as e:
+            logger.error(f"Error adding preference: {e}")
+            await update.message.reply_text("An error occurred while adding the song. Please try again.")
+
+    elif state == GET_RECOMMENDATIONS_STATE:
         # Reset the state
-        GET_RECOMMENDATIONS_STATE.pop(user_id)
+        await profile_store.aset_state(user_id, None)
 
         # Fetch recommendations
         try:
-            recommendations = rec_sys.recommend(track_name=message_text, top_k=5)
+            with scheduling(lane='interactive', timeout=REPLY_TIMEOUT):
+                recommendations = await asyncio.wait_for(
+                    rec_sys.arecommend(track_name=message_text, top_k=5, user_id=user_id), REPLY_TIMEOUT
+                )
             if recommendations.empty:
-                await update.message.reply_text("No recommendations found for the provided song.")
+                with span('telegram_send'):
+                    await update.message.reply_text("No recommendations found for the provided song.")
             else:
                 # Format recommendations
                 recommendation_text = "\n\n".join(
-                    f"🎵 *{row['name']}*\n   💿 Album: {row['album']}\n   🎤 Artists: {', '.join(row['artists'])}\n   🔢 Track Number: {row['track_number']}"
+                    f"🎵 *{row['name']}*\n   💿 Album: {row['album']}\n   🎤 Artists: {', '.join(parse_artists(row['artists']))}\n   🔢 Track Number: {row['track_number']}"
                     for _, row in recommendations.iterrows()
                 )
-                await update.message.reply_text(f"Here are your recommendations:\n\n{recommendation_text}", parse_mode="Markdown")
+                with span('telegram_send'):
+                    await update.message.reply_text(f"Here are your recommendations:\n\n{recommendation_text}", parse_mode="Markdown")
+        except PoolBusyError:
+            # Keep the state, so the user can simply resend the song
+            await profile_store.aset_state(user_id, GET_RECOMMENDATIONS_STATE)
+            await update.message.reply_text("I'm busy right now, please try again in a few seconds.")
+        except (asyncio.TimeoutError, DeadlineExceededError):
+            # Spotify is rate limiting or slow, the lookups of this user were dropped
+            await profile_store.aset_state(user_id, GET_RECOMMENDATIONS_STATE)
+            await update.message.reply_text("Spotify is slow right now, please try again in a few seconds.")
         except Exception as e:
             logger.error(f"Error fetching recommendations: {e}")
             await update.message.reply_text("An error occurred while fetching recommendations. Please try again.")
@@ -100,8 +237,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("I didn't understand that. Use /help to see available options.")
 
 
+async def shutdown(application: Application) -> None:
+    # Flush batched Spotify lookups and close the connection pool
+    await rec_sys.async_search_engine.aclose()
+    # Let a running compaction finish instead of stopping it halfway
+    await asyncio.to_thread(rec_sys.close)
+
+
 def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+    create_services()
+
+    # Handle updates concurrently, so one slow reply does not hold back the others
+    application = Application.builder().token(TOKEN).concurrent_updates(True).post_shutdown(shutdown).build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
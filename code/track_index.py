@@ -0,0 +1,677 @@
+# Import necessary dependencies
+import heapq
+import json
+import os
+
+import numpy as np
+
+from const import *
+from track_store import TrackStore
+
+INDEX_DIR_NAME = 'cluster_index'
+
+PRECISIONS = ['float32', 'int8']
+
+
+class ClusterIndex():
+    """
+    Per-cluster index of L2-normalized track features.
+
+    Rows of every K-Means cluster are stored as one contiguous block, so the
+    cosine similarity between a query and a cluster is a single matrix-vector
+    product over a slice of `vectors`.
+
+    With `codes`, clusters are scanned over `int8` scalar-quantized vectors,
+    a quarter of the bytes of `vectors`, and only a shortlist of `rerank * top_k`
+    candidates is re-ranked with `vectors` in full precision.
+
+    Attributes
+    ----------
+    `vectors`: np.ndarray
+        `float32` L2-normalized features of shape (n_tracks, n_features) grouped by cluster.
+    `row_ids`: np.ndarray
+        Track store row of every row of `vectors`.
+    `offsets`: np.ndarray
+        Cluster `c` occupies rows `offsets[c]:offsets[c + 1]` of `vectors`.
+    `codes`: np.ndarray
+        `int8` codes of `vectors`, `None` to scan `vectors` directly.
+    `scale`: np.ndarray
+        Per-dimension scale of `codes`, `vectors ~ codes * scale + offset`.
+    `offset`: np.ndarray
+        Per-dimension offset of `codes`.
+    `rerank`: int
+        Shortlist size of the quantized scan as a multiple of `top_k`.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray = None,
+        row_ids: np.ndarray = None,
+        offsets: np.ndarray = None,
+        codes: np.ndarray = None,
+        scale: np.ndarray = None,
+        offset: np.ndarray = None,
+        rerank: int = 4
+    ) -> None:
+        """
+        Initialize `ClusterIndex` object.
+
+        Parameters
+        ----------
+        `vectors`: np.ndarray = None
+            L2-normalized features grouped by cluster.
+        `row_ids`: np.ndarray = None
+            Track store row of every row of `vectors`.
+        `offsets`: np.ndarray = None
+            Start of every cluster block in `vectors` followed by the amount of rows.
+        `codes`: np.ndarray = None
+            `int8` codes of `vectors` (see `quantize`), `None` to scan in `float32`.
+        `scale`: np.ndarray = None
+            Per-dimension scale of `codes`.
+        `offset`: np.ndarray = None
+            Per-dimension offset of `codes`.
+        `rerank`: int = 4
+            Shortlist size of the quantized scan as a multiple of `top_k`.
+
+        Returns
+        ----------
+        `self`: ClusterIndex
+            ClusterIndex class object.
+        """
+
+        assert vectors is not None and row_ids is not None and offsets is not None, (
+            '`vectors`, `row_ids`, and `offsets` must be specified.'
+        )
+
+        self.vectors = vectors
+        self.row_ids = row_ids
+        self.offsets = offsets
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.rerank = rerank
+
+    @property
+    def n_clusters(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def precision(self) -> str:
+        return 'float32' if self.codes is None else 'int8'
+
+    def quantize(self, rerank: int = 4, chunk_size: int = 1_000_000) -> 'ClusterIndex':
+        """
+        Index over the same vectors that scans `int8` codes and re-ranks the shortlist in `float32`.
+
+        Every dimension is mapped linearly from its range over `vectors` to [-127, 127].
+
+        Parameters
+        ----------
+        `rerank`: int = 4
+            Shortlist size as a multiple of `top_k`.
+        `chunk_size`: int = 1_000_000
+            Amount of vectors quantized at once.
+
+        Returns
+        ----------
+        `index`: ClusterIndex
+            The quantized index.
+        """
+
+        if len(self.vectors) == 0:
+            low = high = np.zeros(self.vectors.shape[1], dtype=np.float32)
+        else:
+            low = np.min([np.asarray(self.vectors[i:i + chunk_size]).min(axis=0) for i in range(0, len(self.vectors), chunk_size)], axis=0)
+            high = np.max([np.asarray(self.vectors[i:i + chunk_size]).max(axis=0) for i in range(0, len(self.vectors), chunk_size)], axis=0)
+
+        offset = ((high + low) / 2).astype(np.float32)
+        scale = ((high - low) / 254).astype(np.float32)
+        scale[scale == 0] = 1
+
+        codes = np.empty(self.vectors.shape, dtype=np.int8)
+        for i in range(0, len(self.vectors), chunk_size):
+            codes[i:i + chunk_size] = np.clip(np.rint((np.asarray(self.vectors[i:i + chunk_size]) - offset) / scale), -127, 127)
+
+        return ClusterIndex(vectors=self.vectors, row_ids=self.row_ids, offsets=self.offsets,
+                            codes=codes, scale=scale, offset=offset, rerank=rerank)
+
+    @classmethod
+    def build(cls, features: np.ndarray = None, clusters: np.ndarray = None) -> 'ClusterIndex':
+        """
+        Build the index from a feature matrix and cluster ids.
+
+        Parameters
+        ----------
+        `features`: np.ndarray = None
+            Preprocessed features of shape (n_tracks, n_features).
+        `clusters`: np.ndarray = None
+            Cluster id of every track.
+
+        Returns
+        ----------
+        `index`: ClusterIndex
+            The built index.
+        """
+
+        assert features is not None and clusters is not None, (
+            '`features` and `clusters` must be specified.'
+        )
+
+        clusters = np.asarray(clusters)
+        n_clusters = max(K_CLUSTERS, int(clusters.max()) + 1 if len(clusters) else 0)
+
+        # Stable sort keeps the original order of tracks inside every cluster
+        row_ids = np.argsort(clusters, kind='stable')
+        offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(clusters, minlength=n_clusters))
+
+        vectors = np.ascontiguousarray(features[row_ids], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+        return cls(vectors=vectors, row_ids=row_ids, offsets=offsets)
+
+    @classmethod
+    def from_store(cls, store: TrackStore = None, precision: str = 'float32') -> 'ClusterIndex':
+        """
+        Load the index saved next to the track store or build it from the store.
+
+        Parameters
+        ----------
+        `store`: TrackStore = None
+            Track store to index.
+        `precision`: str = 'float32'
+            'float32' to scan full precision vectors, 'int8' to scan quantized codes.
+
+        Returns
+        ----------
+        `index`: ClusterIndex
+            The loaded or built index.
+        """
+
+        assert store is not None, (
+            '`store` must be specified.'
+        )
+
+        index_path = os.path.join(store.path, INDEX_DIR_NAME)
+        if os.path.exists(os.path.join(index_path, 'meta.json')):
+            return cls.load(index_path, precision=precision)
+
+        index = cls.build(features=store.features, clusters=store.clusters)
+
+        return index.quantize() if precision == 'int8' else index
+
+    def save(self, path: str = None) -> None:
+        """
+        Save the index as raw arrays together with its `int8` codes, so that `load` can memory-map either.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the index directory.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        os.makedirs(path, exist_ok=True)
+
+        np.ascontiguousarray(self.vectors, dtype=np.float32).tofile(os.path.join(path, 'vectors.f32'))
+        np.asarray(self.row_ids, dtype=np.int64).tofile(os.path.join(path, 'row_ids.i64'))
+        np.asarray(self.offsets, dtype=np.int64).tofile(os.path.join(path, 'offsets.i64'))
+
+        quantized = self if self.codes is not None else self.quantize()
+        np.asarray(quantized.codes, dtype=np.int8).tofile(os.path.join(path, 'codes.i8'))
+        np.concatenate([quantized.scale, quantized.offset]).astype(np.float32).tofile(os.path.join(path, 'quantization.f32'))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'n_tracks': len(self.row_ids), 'n_features': self.vectors.shape[1], 'n_clusters': self.n_clusters}, f, indent=4)
+
+    @classmethod
+    def load(cls, path: str = None, precision: str = 'float32') -> 'ClusterIndex':
+        """
+        Memory-map the index saved by `save`.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the index directory.
+        `precision`: str = 'float32'
+            'float32' to scan full precision vectors, 'int8' to scan quantized codes.
+
+        Returns
+        ----------
+        `index`: ClusterIndex
+            The loaded index.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+        assert precision in PRECISIONS, (
+            f'`precision` must be one of {PRECISIONS}.'
+        )
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        n_tracks, n_features, n_clusters = meta['n_tracks'], meta['n_features'], meta['n_clusters']
+
+        if n_tracks == 0:
+            index = cls(vectors=np.zeros((0, n_features), dtype=np.float32),
+                        row_ids=np.zeros(0, dtype=np.int64),
+                        offsets=np.fromfile(os.path.join(path, 'offsets.i64'), dtype=np.int64))
+        else:
+            index = cls(vectors=np.memmap(os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r', shape=(n_tracks, n_features)),
+                        row_ids=np.memmap(os.path.join(path, 'row_ids.i64'), dtype=np.int64, mode='r', shape=(n_tracks,)),
+                        offsets=np.fromfile(os.path.join(path, 'offsets.i64'), dtype=np.int64, count=n_clusters + 1))
+
+        if precision == 'float32':
+            return index
+
+        # Indices saved before quantization was added are quantized in memory
+        codes_path = os.path.join(path, 'codes.i8')
+        if n_tracks == 0 or not os.path.exists(codes_path):
+            return index.quantize()
+
+        scale, offset = np.fromfile(os.path.join(path, 'quantization.f32'), dtype=np.float32).reshape(2, n_features)
+        index.codes = np.memmap(codes_path, dtype=np.int8, mode='r', shape=(n_tracks, n_features))
+        index.scale, index.offset = scale, offset
+
+        return index
+
+    def exclusion_mask(self, rows: np.ndarray = None) -> np.ndarray | None:
+        """
+        Mask of `rows` in index order for the `excluded` argument of searches, `None` if there are none.
+        """
+
+        assert rows is not None, (
+            '`rows` must be specified.'
+        )
+
+        if len(rows) == 0:
+            return None
+
+        return np.isin(np.asarray(self.row_ids), rows)
+
+    def search(
+        self,
+        query: np.ndarray = None,
+        cluster: int | list[int] = None,
+        top_k: int = 5,
+        excluded: np.ndarray = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Retrieve `top_k` tracks of `cluster` with the highest cosine similarity to `query`.
+
+        Parameters
+        ----------
+        `query`: np.ndarray = None
+            Preprocessed features of the query track.
+        `cluster`: int | list[int] = None
+            Cluster to search in, or several clusters whose results are merged.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve.
+        `excluded`: np.ndarray = None
+            Mask of tracks to skip from `exclusion_mask`, e.g. removed tracks.
+
+        Returns
+        ----------
+        `row_ids`: np.ndarray
+            Track store rows of retrieved tracks sorted by decreasing similarity.
+        `similarity`: np.ndarray
+            Cosine similarity of retrieved tracks.
+        """
+
+        assert query is not None and cluster is not None, (
+            '`query` and `cluster` must be specified.'
+        )
+
+        query = normalize(query)
+
+        if np.ndim(cluster) == 0:
+            return self._search_cluster(query, int(cluster), top_k, excluded)
+
+        # Merge results of every probed cluster keeping only `top_k` best in a min-heap
+        heap = []
+        for c in cluster:
+            row_ids, similarity = self._search_cluster(query, int(c), top_k, excluded)
+
+            for row_id, score in zip(row_ids.tolist(), similarity.tolist()):
+                # Lower row wins ties, so the merged order matches a single scan
+                item = (score, -row_id)
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        heap.sort(reverse=True)
+
+        return (np.array([-row_id for _, row_id in heap], dtype=np.int64),
+                np.array([score for score, _ in heap], dtype=np.float32))
+
+    def _search_cluster(self, query: np.ndarray, cluster: int, top_k: int, excluded: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[cluster], self.offsets[cluster + 1]
+        positions, similarity = self._scan(query, start, end, top_k, excluded)
+
+        top = _finite(similarity, top_k_positions(similarity, top_k))
+
+        return np.asarray(self.row_ids[start + positions[top]]), similarity[top]
+
+    def _scan(self, query: np.ndarray, start: int, end: int, top_k: int, excluded: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        # Positions within `start:end` worth ranking and their full precision similarity, excluded ones at -inf
+        if self.codes is None:
+            similarity = self.vectors[start:end] @ query
+            if excluded is not None:
+                similarity[excluded[start:end]] = -np.inf
+            return np.arange(end - start), similarity
+
+        # Codes are cast in chunks that stay in cache, NumPy has no `int8` matrix-vector product
+        scaled_query = query * self.scale
+        approximate = np.empty(end - start, dtype=np.float32)
+        for chunk_start in range(start, end, 8192):
+            chunk_end = min(chunk_start + 8192, end)
+            np.dot(np.asarray(self.codes[chunk_start:chunk_end], dtype=np.float32), scaled_query, out=approximate[chunk_start - start:chunk_end - start])
+        if excluded is not None:
+            approximate[excluded[start:end]] = -np.inf
+
+        # Sorted, so that ties are still broken by position
+        positions = np.sort(top_k_positions(approximate, self.rerank * top_k))
+        similarity = np.asarray(self.vectors[start + positions]) @ query
+        if excluded is not None:
+            similarity[excluded[start + positions]] = -np.inf
+
+        return positions, similarity
+
+    def search_many(
+        self,
+        queries: np.ndarray = None,
+        clusters: np.ndarray = None,
+        top_k: int = 5,
+        max_chunk_elements: int = 2 ** 24,
+        excluded: np.ndarray = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Retrieve `top_k` most similar tracks for every query within its cluster.
+
+        Queries are grouped by cluster and every group is scored with one
+        matrix-matrix product. Groups are split into chunks so that no
+        similarity matrix holds more than `max_chunk_elements` values.
+
+        Parameters
+        ----------
+        `queries`: np.ndarray = None
+            Preprocessed query features of shape (n_queries, n_features).
+        `clusters`: np.ndarray = None
+            Cluster to search in for every query, or a matrix of shape (n_queries, n_probe)
+            with several clusters per query whose results are merged.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve.
+        `max_chunk_elements`: int = 2 ** 24
+            Upper bound of the size of one similarity matrix.
+        `excluded`: np.ndarray = None
+            Mask of tracks to skip from `exclusion_mask`, e.g. removed tracks.
+
+        Returns
+        ----------
+        `row_ids`: np.ndarray
+            Track store rows of shape (n_queries, top_k) sorted by decreasing similarity.
+            Padded with -1 when a cluster has less than `top_k` tracks that are not excluded.
+        `similarity`: np.ndarray
+            Cosine similarity of shape (n_queries, top_k), padded with -inf.
+        """
+
+        assert queries is not None and clusters is not None, (
+            '`queries` and `clusters` must be specified.'
+        )
+
+        queries = normalize_rows(queries)
+        clusters = np.asarray(clusters)
+
+        if clusters.ndim > 1:
+            results = [self.search_many(queries, clusters[:, probe], top_k, max_chunk_elements, excluded) for probe in range(clusters.shape[1])]
+            return merge_top_k(row_ids=np.hstack([row_ids for row_ids, _ in results]),
+                               similarity=np.hstack([similarity for _, similarity in results]),
+                               top_k=top_k)
+
+        row_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        similarity = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+        for cluster in np.unique(clusters):
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            k = min(top_k, end - start)
+            if k == 0:
+                continue
+
+            block = self.vectors[start:end]
+            block_row_ids = np.asarray(self.row_ids[start:end])
+            block_codes = np.asarray(self.codes[start:end], dtype=np.float32) if self.codes is not None else None
+            block_excluded = excluded[start:end] if excluded is not None and excluded[start:end].any() else None
+
+            group = np.flatnonzero(clusters == cluster)
+            chunk_size = max(1, max_chunk_elements // (end - start))
+
+            for chunk_start in range(0, len(group), chunk_size):
+                chunk = group[chunk_start:chunk_start + chunk_size]
+
+                if block_codes is None:
+                    scores, positions = queries[chunk] @ block.T, None
+                    if block_excluded is not None:
+                        scores[:, block_excluded] = -np.inf
+                else:
+                    # Quantized scan, then full precision similarity of the shortlist only
+                    approximate = (queries[chunk] * self.scale) @ block_codes.T
+                    if block_excluded is not None:
+                        approximate[:, block_excluded] = -np.inf
+                    shortlist = min(self.rerank * k, end - start)
+                    if shortlist < approximate.shape[1]:
+                        positions = np.sort(np.argpartition(-approximate, shortlist - 1, axis=1)[:, :shortlist], axis=1)
+                    else:
+                        positions = np.tile(np.arange(shortlist), (len(chunk), 1))
+                    scores = np.einsum('qsd,qd->qs', np.asarray(block[positions.ravel()]).reshape(*positions.shape, -1), queries[chunk])
+                    if block_excluded is not None:
+                        scores[block_excluded[positions]] = -np.inf
+
+                if k < scores.shape[1]:
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                else:
+                    top = np.tile(np.arange(k), (len(chunk), 1))
+
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                if positions is not None:
+                    top = np.take_along_axis(positions, top, axis=1)
+                order = np.lexsort((top, -top_scores), axis=1)
+
+                row_ids[chunk, :k] = block_row_ids[np.take_along_axis(top, order, axis=1)]
+                similarity[chunk, :k] = np.take_along_axis(top_scores, order, axis=1)
+
+        # Excluded tracks that made it into a short cluster's top are padding
+        row_ids[np.isneginf(similarity)] = -1
+
+        return row_ids, similarity
+
+    def search_exact(self, query: np.ndarray = None, top_k: int = 5, excluded: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Retrieve `top_k` most similar tracks by brute-force scan over all clusters.
+
+        Parameters
+        ----------
+        `query`: np.ndarray = None
+            Preprocessed features of the query track.
+        `top_k`: int = 5
+            The amount of most similar tracks to retrieve.
+        `excluded`: np.ndarray = None
+            Mask of tracks to skip from `exclusion_mask`, e.g. removed tracks.
+
+        Returns
+        ----------
+        `row_ids`: np.ndarray
+            Track store rows of retrieved tracks sorted by decreasing similarity.
+        `similarity`: np.ndarray
+            Cosine similarity of retrieved tracks.
+        """
+
+        assert query is not None, (
+            '`query` must be specified.'
+        )
+
+        positions, similarity = self._scan(normalize(query), 0, len(self.vectors), top_k, excluded)
+        top = _finite(similarity, top_k_positions(similarity, top_k))
+
+        return np.asarray(self.row_ids[positions[top]]), similarity[top]
+
+
+def probe_clusters(query: np.ndarray = None, centroids: np.ndarray = None, n_probe: int = 1) -> np.ndarray:
+    """
+    Rank K-Means clusters by the distance between their centroids and `query`.
+
+    Parameters
+    ----------
+    `query`: np.ndarray = None
+        Preprocessed features of the query track, or a matrix with one query per row.
+    `centroids`: np.ndarray = None
+        Cluster centers of K-Means model, e.g. `k_means.cluster_centers_`.
+    `n_probe`: int = 1
+        The amount of closest clusters to return.
+
+    Returns
+    ----------
+    `clusters`: np.ndarray
+        `n_probe` closest clusters, the closest one (the one K-Means predicts) first.
+        For a matrix of queries, an array of shape (n_queries, n_probe).
+    """
+
+    assert query is not None and centroids is not None, (
+        '`query` and `centroids` must be specified.'
+    )
+
+    query = np.asarray(query, dtype=np.float64)
+    distances = ((np.atleast_2d(query)[:, None, :] - np.asarray(centroids)[None, :, :]) ** 2).sum(axis=2)
+    clusters = np.argsort(distances, axis=1, kind='stable')[:, :n_probe]
+
+    return clusters if query.ndim > 1 else clusters[0]
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize `vector` and cast it to `float32`.
+    """
+
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm > 0 else vector
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize every row of `matrix` and cast it to `float32`.
+    """
+
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    return np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+
+def merge_top_k(row_ids: np.ndarray = None, similarity: np.ndarray = None, top_k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keep `top_k` best candidates of every row of concatenated search results.
+
+    Parameters
+    ----------
+    `row_ids`: np.ndarray = None
+        Candidate track store rows of shape (n_queries, n_candidates), -1 for padding.
+    `similarity`: np.ndarray = None
+        Candidate similarity of shape (n_queries, n_candidates), -inf for padding.
+    `top_k`: int = 5
+        The amount of candidates to keep.
+
+    Returns
+    ----------
+    `row_ids`: np.ndarray
+        Track store rows of shape (n_queries, top_k) sorted by decreasing similarity.
+    `similarity`: np.ndarray
+        Similarity of shape (n_queries, top_k).
+    """
+
+    # Lower row wins ties, padding goes last
+    order = np.lexsort((np.where(row_ids < 0, np.iinfo(np.int64).max, row_ids), -similarity), axis=1)[:, :top_k]
+
+    return np.take_along_axis(row_ids, order, axis=1), np.take_along_axis(similarity, order, axis=1)
+
+
+def _finite(similarity: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    # Excluded tracks have -inf similarity and are only in the top of clusters with too few others
+    return positions[np.isfinite(similarity[positions])]
+
+
+def top_k_positions(similarity: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Positions of the `top_k` largest values of `similarity` sorted by decreasing value.
+
+    Ties are broken by position, the same way `pd.DataFrame.nlargest` does.
+    """
+
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if top_k < len(similarity):
+        candidates = np.argpartition(-similarity, top_k - 1)[:top_k]
+        # `argpartition` may leave out tied elements with lower position, so take all of them
+        candidates = np.flatnonzero(similarity >= similarity[candidates].min())
+    else:
+        candidates = np.arange(len(similarity))
+
+    order = np.lexsort((candidates, -similarity[candidates]))
+
+    return candidates[order][:top_k]
+
+
+def mmr_rerank(vectors: np.ndarray = None, relevance: np.ndarray = None, top_k: int = 5, diversity: float = 0.3) -> np.ndarray:
+    """
+    Greedy Maximal Marginal Relevance re-ranking of candidates.
+
+    Every step picks the candidate maximizing
+    `(1 - diversity) * relevance - diversity * max similarity to the already picked ones`,
+    keeping the running maximum similarity as one vector updated with a single
+    matrix-vector product per pick.
+
+    Parameters
+    ----------
+    `vectors`: np.ndarray = None
+        L2-normalized candidate vectors of shape (n_candidates, n_features).
+    `relevance`: np.ndarray = None
+        Relevance of every candidate to the query.
+    `top_k`: int = 5
+        The amount of candidates to pick.
+    `diversity`: float = 0.3
+        Trade-off between relevance (0.0) and diversity (1.0).
+
+    Returns
+    ----------
+    `positions`: np.ndarray
+        Positions of the picked candidates in pick order.
+    """
+
+    assert vectors is not None and relevance is not None, (
+        '`vectors` and `relevance` must be specified.'
+    )
+
+    top_k = min(top_k, len(relevance))
+    picked = np.zeros(top_k, dtype=np.int64)
+    max_similarity = np.full(len(relevance), -np.inf)
+    available = np.ones(len(relevance), dtype=bool)
+
+    for step in range(top_k):
+        # Nothing picked yet: the redundancy term is zero
+        redundancy = max_similarity if step else np.zeros(len(relevance))
+        score = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+
+        position = int(np.argmax(score))
+        picked[step] = position
+        available[position] = False
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[position])
+
+    return picked
@@ -0,0 +1,472 @@
+# Import necessary dependencies
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+
+from const import *
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+STORE_FORMAT_VERSION = 1
+
+METADATA_COLUMNS = ['id', 'name', 'album', 'artists']
+TRACK_NUMBER_COLUMN = 'track_number'
+
+
+ID_INDEX_FILES = ['id_hashes.i64', 'id_rows.i32']
+
+
+def stable_hash(text: str) -> int:
+    """
+    Stable 64-bit hash of `text`, the same in every process and run.
+    """
+
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def track_hashes(track_ids: list[str] = None) -> np.ndarray:
+    """
+    Stable 64-bit hashes of track ids, 8 bytes per track instead of a 22 character id.
+    """
+
+    assert track_ids is not None, (
+        '`track_ids` must be specified.'
+    )
+
+    return np.fromiter((stable_hash(str(track_id)) for track_id in track_ids), dtype=np.int64, count=len(track_ids))
+
+
+def save_id_index(path: Callable[[str], str], hashes: np.ndarray) -> None:
+    """
+    Write sorted track id `hashes` and their rows to the files named by `path`.
+    """
+
+    order = np.argsort(hashes, kind='stable')
+    hashes[order].tofile(path('id_hashes.i64'))
+    order.astype(np.int32).tofile(path('id_rows.i32'))
+
+
+class TrackStoreWriter():
+    """
+    Write preprocessed tracks into a binary columnar track store chunk by chunk.
+
+    Layout of the store directory:
+
+    - `meta.json`: format version, amount of tracks and feature order;
+    - `features.f32`: contiguous `float32` matrix of shape (n_tracks, n_features);
+    - `clusters.i32`: `int32` cluster id of every track;
+    - `track_number.i32`: `int32` track number of every track;
+    - `<column>.bin` / `<column>.off`: UTF-8 blob and `int64` offsets of every
+      string metadata column in `METADATA_COLUMNS`;
+    - `id_hashes.i64` / `id_rows.i32`: sorted 64-bit hashes of track ids (see
+      `track_hashes`) and the row of every hash, to find tracks by id.
+
+    Files are written under a temporary name and moved into place on `close`,
+    so readers of a store that is being rewritten keep their memory-mapped
+    files and never see a truncated one.
+
+    Attributes
+    ----------
+    `path`: str
+        Path to the store directory.
+    `features`: list[str]
+        Order of feature columns in the feature matrix.
+    `n_tracks`: int
+        Amount of tracks written so far.
+    """
+
+    def __init__(self, path: str = None, features: list[str] = PREPROCESSED_FEATURES) -> None:
+        """
+        Initialize `TrackStoreWriter` object.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the store directory. Created if it does not exist.
+        `features`: list[str] = PREPROCESSED_FEATURES
+            Order of feature columns in the feature matrix.
+
+        Returns
+        ----------
+        `self`: TrackStoreWriter
+            TrackStoreWriter class object.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.features = list(features)
+        self.n_tracks = 0
+
+        self._features_file = open(self._temporary_path('features.f32'), 'wb')
+        self._clusters_file = open(self._temporary_path('clusters.i32'), 'wb')
+        self._track_number_file = open(self._temporary_path(f'{TRACK_NUMBER_COLUMN}.i32'), 'wb')
+        self._blob_files = {column: open(self._temporary_path(f'{column}.bin'), 'wb') for column in METADATA_COLUMNS}
+        self._offsets = {column: [np.zeros(1, dtype=np.int64)] for column in METADATA_COLUMNS}
+        self._blob_sizes = {column: 0 for column in METADATA_COLUMNS}
+        self._id_hashes = []
+
+    def append(self, features: np.ndarray = None, clusters: np.ndarray = None, metadata: 'pd.DataFrame' = None) -> None:
+        """
+        Append a chunk of tracks to the store.
+
+        Parameters
+        ----------
+        `features`: np.ndarray = None
+            Preprocessed features of shape (n, n_features) in `self.features` order.
+        `clusters`: np.ndarray = None
+            Cluster id of every track.
+        `metadata`: pd.DataFrame = None
+            Data frame with `METADATA_COLUMNS` and `track_number` columns.
+        """
+
+        assert features is not None and clusters is not None and metadata is not None, (
+            '`features`, `clusters`, and `metadata` must be specified.'
+        )
+        assert len(features) == len(clusters) == len(metadata.index), (
+            '`features`, `clusters`, and `metadata` must have the same length.'
+        )
+
+        import pandas as pd
+
+        self._features_file.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+        self._clusters_file.write(np.asarray(clusters, dtype=np.int32).tobytes())
+        self._track_number_file.write(
+            pd.to_numeric(metadata.loc[:, TRACK_NUMBER_COLUMN], errors='coerce').fillna(0).to_numpy(dtype=np.int32).tobytes()
+        )
+
+        for column in METADATA_COLUMNS:
+            values = metadata.loc[:, column].fillna('').astype(str)
+            if column == 'id':
+                self._id_hashes.append(track_hashes(values.tolist()))
+            encoded = [value.encode('utf-8') for value in values]
+            lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+
+            self._blob_files[column].write(b''.join(encoded))
+            self._offsets[column].append(self._blob_sizes[column] + np.cumsum(lengths))
+            self._blob_sizes[column] += int(lengths.sum())
+
+        self.n_tracks += len(clusters)
+
+    def close(self) -> None:
+        """
+        Flush offsets and `meta.json`, close all files of the store and move them into place.
+        """
+
+        self._close_files()
+
+        for column in METADATA_COLUMNS:
+            np.concatenate(self._offsets[column]).tofile(self._temporary_path(f'{column}.off'))
+
+        save_id_index(self._temporary_path, np.concatenate(self._id_hashes) if self._id_hashes else np.zeros(0, dtype=np.int64))
+
+        # An old `meta.json` goes first, so the store is never loaded with a mix of old and new files.
+        # Replaced files keep their inodes alive for readers that already mapped them
+        meta_path = os.path.join(self.path, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        for file_name in self._file_names():
+            os.replace(self._temporary_path(file_name), os.path.join(self.path, file_name))
+
+        # `meta.json` is written last, so a half-written store is never loaded
+        with open(self._temporary_path('meta.json'), 'w') as f:
+            json.dump({
+                'format_version': STORE_FORMAT_VERSION,
+                'n_tracks': self.n_tracks,
+                'features': self.features,
+                'metadata_columns': METADATA_COLUMNS + [TRACK_NUMBER_COLUMN]
+            }, f, indent=4)
+        os.replace(self._temporary_path('meta.json'), meta_path)
+
+    def discard(self) -> None:
+        """
+        Close and delete the written files, leaving the store in `path` as it was.
+        """
+
+        self._close_files()
+
+        for file_name in self._file_names():
+            if os.path.exists(self._temporary_path(file_name)):
+                os.remove(self._temporary_path(file_name))
+
+    def _temporary_path(self, file_name: str) -> str:
+        return os.path.join(self.path, f'{file_name}.tmp')
+
+    def _file_names(self) -> list[str]:
+        return [
+            'features.f32', 'clusters.i32', f'{TRACK_NUMBER_COLUMN}.i32',
+            *[f'{column}.bin' for column in METADATA_COLUMNS], *[f'{column}.off' for column in METADATA_COLUMNS],
+            *ID_INDEX_FILES
+        ]
+
+    def _close_files(self) -> None:
+        for f in [self._features_file, self._clusters_file, self._track_number_file, *self._blob_files.values()]:
+            f.close()
+
+    def __enter__(self) -> 'TrackStoreWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+
+class TrackStore():
+    """
+    Read-only binary columnar track store.
+
+    All arrays are memory-mapped, so opening the store is instant and the pages
+    are shared between processes that open the same store.
+
+    Attributes
+    ----------
+    `path`: str
+        Path to the store directory.
+    `n_tracks`: int
+        Amount of tracks in the store.
+    `feature_names`: list[str]
+        Order of feature columns in `features`.
+    `features`: np.memmap
+        `float32` feature matrix of shape (n_tracks, n_features).
+    `clusters`: np.memmap
+        `int32` cluster id of every track.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Open the track store.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the store directory written by `TrackStoreWriter`.
+
+        Returns
+        ----------
+        `self`: TrackStore
+            TrackStore class object.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        assert meta.get('format_version') == STORE_FORMAT_VERSION, (
+            f'Unsupported track store format version: {meta.get("format_version")}.'
+        )
+
+        self.path = path
+        self.n_tracks = meta['n_tracks']
+        self.feature_names = meta['features']
+
+        self.features = self._open_array('features.f32', np.float32, (self.n_tracks, len(self.feature_names)))
+        self.clusters = self._open_array('clusters.i32', np.int32, (self.n_tracks,))
+        self.track_numbers = self._open_array(f'{TRACK_NUMBER_COLUMN}.i32', np.int32, (self.n_tracks,))
+
+        # String columns are only mapped here and decoded row by row on access
+        self._blobs = {column: self._open_array(f'{column}.bin', np.uint8) for column in METADATA_COLUMNS}
+        self._offsets = {column: self._open_array(f'{column}.off', np.int64, (self.n_tracks + 1,)) for column in METADATA_COLUMNS}
+        self._id_index = None
+
+    def _open_array(self, file_name: str, dtype: type, shape: tuple = None) -> np.ndarray:
+        file_path = os.path.join(self.path, file_name)
+
+        # `np.memmap` refuses to map empty files
+        if os.path.getsize(file_path) == 0:
+            return np.zeros(shape if shape is not None else (0,), dtype=dtype)
+
+        return np.memmap(file_path, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self) -> int:
+        return self.n_tracks
+
+    def find(self, track_ids: list[str] = None) -> np.ndarray:
+        """
+        Rows of tracks whose id is in `track_ids`, in increasing order.
+
+        Ids are looked up by hash with a binary search, only the matching rows are decoded.
+        """
+
+        assert track_ids is not None, (
+            '`track_ids` must be specified.'
+        )
+
+        hashes, rows = self._load_id_index()
+        queries = track_hashes(list(track_ids))
+        starts = np.searchsorted(hashes, queries, side='left')
+        ends = np.searchsorted(hashes, queries, side='right')
+
+        found = np.unique(np.concatenate([np.asarray(rows[start:end]) for start, end in zip(starts.tolist(), ends.tolist())] + [np.zeros(0, dtype=np.int32)]))
+        if len(found) == 0:
+            return found.astype(np.int64)
+
+        # Two ids may share a hash
+        track_ids = set(track_ids)
+
+        return np.array([row for row, track_id in zip(found.tolist(), self.column('id', found)) if track_id in track_ids], dtype=np.int64)
+
+    def _load_id_index(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._id_index is None:
+            if all(os.path.exists(os.path.join(self.path, file_name)) for file_name in ID_INDEX_FILES):
+                self._id_index = (self._open_array('id_hashes.i64', np.int64, (self.n_tracks,)),
+                                  self._open_array('id_rows.i32', np.int32, (self.n_tracks,)))
+            else:
+                # Stores written before the id index existed: build it once and keep it if the store is writable
+                hashes = np.concatenate([track_hashes(self.column('id', np.arange(start, min(start + 100_000, self.n_tracks))))
+                                         for start in range(0, self.n_tracks, 100_000)] + [np.zeros(0, dtype=np.int64)])
+                try:
+                    save_id_index(lambda file_name: os.path.join(self.path, f'{file_name}.tmp'), hashes)
+                    for file_name in ID_INDEX_FILES:
+                        os.replace(os.path.join(self.path, f'{file_name}.tmp'), os.path.join(self.path, file_name))
+                except OSError:
+                    pass
+                order = np.argsort(hashes, kind='stable')
+                self._id_index = (hashes[order], order.astype(np.int32))
+
+        return self._id_index
+
+    def column(self, column: str = None, rows: np.ndarray = None) -> list:
+        """
+        Read values of one metadata column.
+
+        Parameters
+        ----------
+        `column`: str = None
+            One of `METADATA_COLUMNS` or `track_number`.
+        `rows`: np.ndarray = None
+            Row positions to read.
+
+        Returns
+        ----------
+        `values`: list
+            Values of `column` at `rows`.
+        """
+
+        assert column is not None and rows is not None, (
+            '`column` and `rows` must be specified.'
+        )
+
+        if column == TRACK_NUMBER_COLUMN:
+            return self.track_numbers[rows].tolist()
+
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets = self._offsets[column]
+        starts, ends = np.asarray(offsets[rows]).tolist(), np.asarray(offsets[rows + 1]).tolist()
+
+        # Slicing a `memoryview` skips the per-slice overhead of `np.memmap`
+        blob = memoryview(self._blobs[column])
+
+        return [str(blob[start:end], 'utf-8') for start, end in zip(starts, ends)]
+
+    def metadata(self, rows: np.ndarray = None, columns: list[str] = None) -> 'pd.DataFrame':
+        """
+        Read metadata of given tracks.
+
+        Parameters
+        ----------
+        `rows`: np.ndarray = None
+            Row positions to read.
+        `columns`: list[str] = None
+            Metadata columns to read, `None` for `name`, `album`, `artists` and `track_number`.
+
+        Returns
+        ----------
+        `result`: pd.DataFrame
+            A Data frame with `columns` of given tracks in the order of `rows`.
+        """
+
+        assert rows is not None, (
+            '`rows` must be specified.'
+        )
+
+        if columns is None:
+            columns = ['name', 'album', 'artists', TRACK_NUMBER_COLUMN]
+
+        # Only the callers that want a data frame pay for importing pandas
+        import pandas as pd
+
+        return pd.DataFrame(data={column: self.column(column, rows) for column in columns}, columns=columns)
+
+
+def convert_csv(csv_path: str = None, store_path: str = None, chunk_size: int = 100_000) -> TrackStore:
+    """
+    One-time conversion of the preprocessed tracks ".csv" file into a track store.
+
+    Parameters
+    ----------
+    `csv_path`: str = None
+        Path to ".csv" file that contains all preprocessed tracks.
+    `store_path`: str = None
+        Path to the store directory to write.
+    `chunk_size`: int = 100_000
+        Amount of rows read from `csv_path` at once.
+
+    Returns
+    ----------
+    `store`: TrackStore
+        The written track store.
+    """
+
+    assert csv_path is not None and store_path is not None, (
+        '`csv_path` and `store_path` must be specified.'
+    )
+
+    import pandas as pd
+
+    with TrackStoreWriter(store_path, features=PREPROCESSED_FEATURES) as writer:
+        for chunk in pd.read_csv(csv_path, index_col='Unnamed: 0', chunksize=chunk_size):
+            writer.append(
+                features=chunk.loc[:, PREPROCESSED_FEATURES].to_numpy(dtype=np.float32),
+                clusters=chunk.loc[:, 'cluster'].to_numpy(dtype=np.int32),
+                metadata=chunk
+            )
+
+    return TrackStore(store_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert preprocessed tracks ".csv" file into a binary track store.')
+    parser.add_argument('--csv', default='../data/preprocessed_audio_features_clusters.csv', help='Path to the preprocessed tracks ".csv" file.')
+    parser.add_argument('--out', default='../data/track_store', help='Path to the store directory to write.')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='Amount of rows read at once.')
+    args = parser.parse_args()
+
+    # Written next to the catalog and moved into it once complete, see `Catalog.replace`
+    work_dir = tempfile.mkdtemp(prefix='convert_csv_', dir=os.path.dirname(os.path.abspath(args.out)))
+    new_store_path = os.path.join(work_dir, 'track_store')
+
+    try:
+        store = convert_csv(csv_path=args.csv, store_path=new_store_path, chunk_size=args.chunk_size)
+
+        # Save the per-cluster index next to the store, so `RecSys` memory-maps it instead of building it
+        from track_index import ClusterIndex, INDEX_DIR_NAME
+        ClusterIndex.build(features=store.features, clusters=store.clusters).save(os.path.join(new_store_path, INDEX_DIR_NAME))
+
+        # Same for the title index used to answer queries without Spotify
+        from catalog_search import CatalogNameIndex, NAME_INDEX_DIR_NAME
+        CatalogNameIndex.build(store).save(os.path.join(new_store_path, NAME_INDEX_DIR_NAME))
+
+        # A full conversion replaces every version of an incrementally updated catalog
+        from catalog import Catalog
+        Catalog(args.out).replace(new_store_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f'Written {len(store)} tracks to {args.out}')
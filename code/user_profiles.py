@@ -0,0 +1,255 @@
+# Import necessary dependencies
+import asyncio
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from track_store import track_hashes
+
+
+class UserProfile():
+    """
+    Taste of one user in the preprocessed feature space.
+
+    Attributes
+    ----------
+    `user_id`: int
+        ID of the user, e.g. Telegram user id.
+    `vector_sum`: np.ndarray
+        Sum of preprocessed features of all tracks the user interacted with, `None` before the first one.
+    `count`: int
+        The amount of tracks summed in `vector_sum`.
+    `seen`: np.ndarray
+        Hashes of recently recommended tracks (see `track_hashes`), oldest first.
+    `state`: str
+        Pending bot action of the user, `None` if there is none.
+    """
+
+    __slots__ = ('user_id', 'vector_sum', 'count', 'seen', 'state')
+
+    def __init__(self, user_id: int, vector_sum: np.ndarray = None, count: int = 0, seen: np.ndarray = None, state: str = None) -> None:
+        self.user_id = user_id
+        self.vector_sum = vector_sum
+        self.count = count
+        self.seen = seen if seen is not None else np.zeros(0, dtype=np.int64)
+        self.state = state
+
+    @property
+    def mean(self) -> np.ndarray | None:
+        """
+        Mean preprocessed features of the user, `None` before the first interaction.
+        """
+
+        return self.vector_sum / self.count if self.count else None
+
+
+class UserProfileStore():
+    """
+    Persistent per-user profiles in a SQLite database.
+
+    A profile is a running sum and count of preprocessed track features, the
+    hashes of at most `max_seen` recently recommended tracks and a pending bot
+    action, which is about 60 bytes plus 8 bytes per seen track. Profiles are
+    updated in place on every interaction, so history is never replayed.
+
+    Attributes
+    ----------
+    `path`: str
+        Path to the SQLite database file.
+    `max_seen`: int
+        The amount of recommended tracks remembered per user, older ones are forgotten first.
+    """
+
+    def __init__(self, path: str = None, max_seen: int = 1024) -> None:
+        """
+        Initialize `UserProfileStore` object.
+
+        Parameters
+        ----------
+        `path`: str = None
+            Path to the SQLite database file. Created if it does not exist.
+        `max_seen`: int = 1024
+            The amount of recommended tracks remembered per user, older ones are forgotten first.
+
+        Returns
+        ----------
+        `self`: UserProfileStore
+            UserProfileStore class object.
+        """
+
+        assert path is not None, (
+            '`path` must be specified.'
+        )
+
+        self.path = path
+        self.max_seen = max_seen
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # Every interaction commits; in WAL mode this only risks the last ones on power loss, not corruption
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS profiles ('
+            'user_id INTEGER PRIMARY KEY, vector BLOB, count INTEGER NOT NULL DEFAULT 0, '
+            'seen BLOB, state TEXT, updated REAL NOT NULL)'
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+
+    def get(self, user_id: int = None) -> UserProfile:
+        """
+        Profile of `user_id`, an empty one if the user is unknown.
+        """
+
+        assert user_id is not None, (
+            '`user_id` must be specified.'
+        )
+
+        with self._lock:
+            return self._get(user_id)
+
+    def update(self, user_id: int = None, features: np.ndarray = None, seen: list[str] = None) -> UserProfile:
+        """
+        Add tracks the user interacted with and tracks recommended to the user in one write.
+
+        Parameters
+        ----------
+        `user_id`: int = None
+            ID of the user.
+        `features`: np.ndarray = None
+            Preprocessed features of one track or of several tracks (one per row), `None` to add none.
+            A sum of a different length, e.g. after retraining with other features, is started over.
+        `seen`: list[str] = None
+            IDs of recommended tracks, `None` to add none.
+
+        Returns
+        ----------
+        `profile`: UserProfile
+            Updated profile.
+        """
+
+        assert user_id is not None, (
+            '`user_id` must be specified.'
+        )
+
+        with self._lock:
+            # `BEGIN IMMEDIATE`, so another process can not update the profile in between
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                profile = self._get(user_id)
+
+                if features is not None:
+                    features = np.array(features, dtype=np.float64, ndmin=2)
+                    if profile.vector_sum is None or len(profile.vector_sum) != features.shape[1]:
+                        profile.vector_sum, profile.count = np.zeros(features.shape[1]), 0
+                    profile.vector_sum = profile.vector_sum + features.sum(axis=0)
+                    profile.count += len(features)
+
+                if seen is not None and len(seen):
+                    hashes = track_hashes(list(seen))
+                    # Seen again moves to the end, so it is forgotten last
+                    kept = profile.seen[~np.isin(profile.seen, hashes)]
+                    profile.seen = np.concatenate([kept, hashes[np.sort(np.unique(hashes, return_index=True)[1])]])[-self.max_seen:]
+
+                self._put(profile)
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return profile
+
+    def get_state(self, user_id: int = None) -> str | None:
+        """
+        Pending bot action of `user_id`, `None` if there is none.
+        """
+
+        assert user_id is not None, (
+            '`user_id` must be specified.'
+        )
+
+        with self._lock:
+            row = self._connection.execute('SELECT state FROM profiles WHERE user_id = ?', (user_id,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set_state(self, user_id: int = None, state: str = None) -> None:
+        """
+        Set the pending bot action of `user_id`, `None` to clear it.
+        """
+
+        assert user_id is not None, (
+            '`user_id` must be specified.'
+        )
+
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO profiles (user_id, state, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, updated = excluded.updated',
+                (user_id, state, time.time())
+            )
+
+    async def aget_state(self, user_id: int = None) -> str | None:
+        """
+        Coroutine version of `get_state`, the query runs in a thread.
+        """
+
+        return await asyncio.to_thread(self.get_state, user_id)
+
+    async def aset_state(self, user_id: int = None, state: str = None) -> None:
+        """
+        Coroutine version of `set_state`, the query runs in a thread.
+        """
+
+        await asyncio.to_thread(self.set_state, user_id, state)
+
+    def clear(self, user_id: int = None) -> None:
+        """
+        Forget the taste and the recommended tracks of `user_id`, keeping the pending bot action.
+        """
+
+        assert user_id is not None, (
+            '`user_id` must be specified.'
+        )
+
+        with self._lock:
+            self._connection.execute(
+                'UPDATE profiles SET vector = NULL, count = 0, seen = NULL, updated = ? WHERE user_id = ?', (time.time(), user_id)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get(self, user_id: int) -> UserProfile:
+        row = self._connection.execute(
+            'SELECT vector, count, seen, state FROM profiles WHERE user_id = ?', (user_id,)
+        ).fetchone()
+
+        if row is None:
+            return UserProfile(user_id)
+
+        vector, count, seen, state = row
+
+        return UserProfile(
+            user_id,
+            vector_sum=np.frombuffer(vector, dtype=np.float32).astype(np.float64) if vector is not None else None,
+            count=count,
+            seen=np.frombuffer(seen, dtype=np.int64).copy() if seen is not None else None,
+            state=state
+        )
+
+    def _put(self, profile: UserProfile) -> None:
+        vector = profile.vector_sum.astype(np.float32).tobytes() if profile.vector_sum is not None else None
+
+        self._connection.execute(
+            'INSERT INTO profiles (user_id, vector, count, seen, state, updated) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET vector = excluded.vector, count = excluded.count, '
+            'seen = excluded.seen, updated = excluded.updated',
+            (profile.user_id, vector, profile.count, profile.seen.astype(np.int64).tobytes(), profile.state, time.time())
+        )